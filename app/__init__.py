@@ -1,6 +1,30 @@
-# flake8: noqa
-from app.cpu_scaler import CpuScaler
-from app.elb_scaler import ElbScaler
-from app.schedule_scaler import ScheduleScaler
-from app.scheduled_jobs_scaler import ScheduledJobsScaler
-from app.sqs_scaler import SqsScaler
+import importlib
+
+from app.exceptions import CannotLoadApp
+
+# config `type` to the module the scaler lives in. A module is only imported once a scaler of its type is built, so
+# deployments and tests that don't use the AWS, database or CF scalers never load boto3, psycopg2 or cloudfoundry_client
+SCALERS = {
+    "CpuScaler": "app.cpu_scaler",
+    "ElbScaler": "app.elb_scaler",
+    "HttpJsonScaler": "app.http_json_scaler",
+    "RedisQueueScaler": "app.redis_queue_scaler",
+    "ResourcePressureScaler": "app.resource_pressure_scaler",
+    "ScheduleScaler": "app.schedule_scaler",
+    "ScheduledJobsScaler": "app.scheduled_jobs_scaler",
+    "SqsLatencyScaler": "app.sqs_latency_scaler",
+    "SqsScaler": "app.sqs_scaler",
+}
+
+
+def get_scaler_class(scaler_type):
+    if scaler_type not in SCALERS:
+        raise CannotLoadApp("Unknown scaler type {}".format(scaler_type))
+    return getattr(importlib.import_module(SCALERS[scaler_type]), scaler_type)
+
+
+def __getattr__(name):
+    # keeps `from app import SqsScaler` working without importing every scaler up front
+    if name in SCALERS:
+        return get_scaler_class(name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
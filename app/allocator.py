@@ -0,0 +1,133 @@
+import logging
+import math
+
+from app.metrics import get_metrics_registry
+
+
+class BudgetRequest:
+    def __init__(self, name, desired, current, min_instances, priority=0, weight=1, cost=1):
+        self.name = name
+        self.desired = desired
+        self.current = current
+        self.min_instances = min_instances
+        self.priority = priority
+        self.weight = weight
+        self.cost = cost
+
+
+def water_fill(demands, available):
+    """Splits `available` between (demand, weight, cost) tuples in proportion to weight.
+
+    Every request is raised to level * weight instances, or its demand if that is lower, with the level as high as the
+    budget allows. Each instance uses up `cost` of the budget. Works through the requests in the order they saturate,
+    so it is O(n log n) rather than handing out one instance at a time. Returns the (fractional) grant per request.
+    """
+    order = sorted(range(len(demands)), key=lambda i: demands[i][0] / demands[i][1])
+    slope = sum(weight * cost for _, weight, cost in demands)
+    level = 0.0
+    spent = 0.0
+    for i in order:
+        demand, weight, cost = demands[i]
+        saturation_level = demand / weight
+        to_saturate = slope * (saturation_level - level)
+        if spent + to_saturate >= available:
+            level += (available - spent) / slope if slope else 0
+            break
+        spent += to_saturate
+        level = saturation_level
+        slope -= weight * cost
+    else:
+        level = math.inf
+    return [min(demand, level * weight) for demand, weight, _ in demands]
+
+
+class BudgetAllocator:
+    """Keeps the instances of every app within one fleet wide budget, so the apps together can't exhaust a shared
+    backend like the database's connection limit.
+
+    Each app is always allowed its min_instances. What is left goes to the highest priority apps first and is split
+    between apps of the same priority by weight (water-filling), each instance costing the app's `cost` (1 for an
+    instance budget, the size of its connection pool for a connection budget). An app is never allowed to grow into
+    budget that another app is still holding on to until that app has scaled down.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.metrics = get_metrics_registry()
+
+    def _fill_priority(self, requests, available):
+        demands = [(request.desired - request.min_instances, request.weight, request.cost) for request in requests]
+        grants = water_fill(demands, available)
+        whole = [math.floor(grant) for grant in grants]
+        left = available - sum(count * request.cost for count, request in zip(whole, requests))
+
+        # the fractions left over from the split go to whoever was closest to another whole instance, round after round
+        # while anyone still wanting more fits in what is left, so budget an expensive app can't use isn't wasted
+        by_remainder = sorted(range(len(requests)), key=lambda i: grants[i] - whole[i], reverse=True)
+        granted = True
+        while granted:
+            granted = False
+            for i in by_remainder:
+                request = requests[i]
+                if whole[i] < demands[i][0] and request.cost <= left:
+                    whole[i] += 1
+                    left -= request.cost
+                    granted = True
+        return {request.name: request.min_instances + extra for request, extra in zip(requests, whole)}
+
+    def allocate(self, requests):
+        """Returns the highest instance count each app may have this tick"""
+        allocations = {}
+        budgeted = []
+        for request in requests:
+            request.desired = max(request.desired, request.min_instances)
+            if request.cost == 0:
+                # doesn't use the shared backend, nothing to hold it back
+                allocations[request.name] = request.desired
+            else:
+                budgeted.append(request)
+
+        available = self.total - sum(request.min_instances * request.cost for request in budgeted)
+        if available < 0:
+            logging.warning(
+                "The minimum instances of the apps already exceed the instance budget {}".format(self.total)
+            )
+            available = 0
+
+        for priority in sorted({request.priority for request in budgeted}, reverse=True):
+            level = [request for request in budgeted if request.priority == priority]
+            level_allocations = self._fill_priority(level, available)
+            allocations.update(level_allocations)
+            available -= sum((level_allocations[r.name] - r.min_instances) * r.cost for r in level)
+
+        self._limit_growth(budgeted, allocations)
+        self._export(requests, allocations)
+        return allocations
+
+    def _limit_growth(self, requests, allocations):
+        # apps over their allocation only give instances back one scale down at a time, until then they still use them
+        headroom = self.total - sum(request.cost * request.current for request in requests)
+        for request in sorted(requests, key=lambda r: r.priority, reverse=True):
+            growth = allocations[request.name] - request.current
+            if growth <= 0:
+                continue
+            allowed = max(0, min(growth, headroom // request.cost))
+            allocations[request.name] = request.current + allowed
+            headroom -= allowed * request.cost
+
+    def _export(self, requests, allocations):
+        used = 0
+        for request in requests:
+            allocation = allocations[request.name]
+            used += allocation * request.cost
+            denied = max(0, request.desired - allocation)
+            self.metrics.set_gauge("autoscaler_budget_allocation", allocation, app=request.name)
+            self.metrics.set_gauge("autoscaler_budget_denied_instances", denied, app=request.name)
+            if denied:
+                logging.info(
+                    "Instance budget: {} wants {} instances, allowed {}".format(
+                        request.name, request.desired, allocation
+                    )
+                )
+        self.metrics.set_gauge("autoscaler_budget_total", self.total)
+        self.metrics.set_gauge("autoscaler_budget_allocated", used)
@@ -1,13 +1,59 @@
+import math
+
 import app
+from app.config import config
+from app.controllers import build_controller
+from app.exceptions import CannotLoadApp
+
+
+def app_key(org, space, name):
+    """Identifies an app across every org and space we scale.
+
+    Apps in the default CF_ORG and CF_SPACE are keyed on their name alone, so the cooldowns and state kept in redis
+    before there could be more than one space carry on applying to them.
+    """
+    if (org, space) == (config["GENERAL"]["CF_ORG"], config["GENERAL"]["CF_SPACE"]):
+        return name
+    return "{}.{}.{}".format(org, space, name)
 
 
 class App:
-    def __init__(self, name, min_instances, max_instances, scalers):
+    def __init__(
+        self,
+        name,
+        min_instances,
+        max_instances,
+        scalers,
+        controller=None,
+        budget=None,
+        upstream=None,
+        org=None,
+        space=None,
+    ):
         self.name = name
+        self.org = org or config["GENERAL"]["CF_ORG"]
+        self.space = space or config["GENERAL"]["CF_SPACE"]
+        self.key = app_key(self.org, self.space, name)
+        self.cf_attributes = None
+        self.min_instances = min_instances
+        self.max_instances = max_instances
+        budget = budget or {}
+        self.priority = budget.get("priority", 0)
+        self.weight = budget.get("weight", 1)
+        self.budget_cost = budget.get("cost", 1)
+        if self.weight <= 0 or self.budget_cost < 0:
+            raise CannotLoadApp("Budget weight must be positive and cost not negative for {}".format(name))
+        # apps in the same space feeding this one's work, with how many of our instances one of theirs keeps busy
+        self.upstream = [
+            (app_key(self.org, self.space, dependency["app"]), float(dependency.get("fan_out", 1)))
+            for dependency in upstream or []
+        ]
+        # scalers and controllers keep state and publish metrics under the key, it is only the name in CF
+        self.controller = build_controller(self.key, min_instances, max_instances, controller)
         self.scalers = []
         for scaler in scalers:
-            scaler_cls = getattr(app, scaler["type"])
-            self.scalers.append(scaler_cls(name, min_instances, max_instances, **scaler))
+            scaler_cls = app.get_scaler_class(scaler["type"])
+            self.scalers.append(scaler_cls(self.key, min_instances, max_instances, **scaler))
 
     def query_scalers(self):
         desired_instance_counts = []
@@ -15,8 +61,36 @@ class App:
             desired_instance_counts.append(scaler.get_desired_instance_count())
         return desired_instance_counts
 
+    @property
+    def inputs_stale(self):
+        return any(scaler.stale for scaler in self.scalers)
+
     def get_desired_instance_count(self):
         return max(self.query_scalers())
 
+    def _upstream_shares(self, upstream_loads):
+        return [math.ceil(upstream_loads[key] * fan_out) for key, fan_out in self.upstream if key in upstream_loads]
+
+    def get_load_instance_count(self, upstream_loads=None):
+        """How many instances this tick's work needs, up to max_instances but not raised to min_instances.
+
+        That is what the scalers found, or our share of the upstream apps' load if that is more. Downstream apps follow
+        this rather than our desired count, so an idle app held at its floor doesn't hold them up too.
+        """
+        loads = [
+            scaler.last_load_instance_count for scaler in self.scalers if scaler.last_load_instance_count is not None
+        ]
+        loads += self._upstream_shares(upstream_loads or {})
+        return min(self.max_instances, max(loads, default=0))
+
+    def get_upstream_instance_count(self, upstream_loads):
+        """What the upstream apps' load this tick means for us, None if we don't follow any"""
+        counts = self._upstream_shares(upstream_loads)
+        if not counts:
+            return None
+        return max(self.min_instances, min(self.max_instances, max(counts)))
+
     def refresh_cf_info(self, cf_attributes):
         self.cf_attributes = cf_attributes
+        for scaler in self.scalers:
+            scaler.refresh_cf_info(cf_attributes)
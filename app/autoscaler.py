@@ -2,22 +2,25 @@ import datetime
 import logging
 import os
 import sched
+import statistics
 import time
+from collections import deque
 
-from cloudfoundry_client.errors import InvalidStatusCode
 from redis import Redis
 
+from app.allocator import BudgetAllocator, BudgetRequest
 from app.app import App
 from app.config import config
-from app.exceptions import CannotLoadConfig
-from app.paas_client import PaasClient
-from app.utils import get_statsd_client
-
-
-def _get_redis_url():
-    if "REDIS_URL" in os.environ:
-        return os.environ["REDIS_URL"]
-    return "redis://redis.local"
+from app.exceptions import CannotLoadConfig, CfAuthUnavailable
+from app.journal import DecisionJournal
+from app.metrics import MetricsServer, get_metrics_registry
+from app.paas_client import PaasClient, count_instance_states
+from app.pipeline import pipeline_order
+from app.profiler import TickProfiler
+from app.scale_dispatcher import ScaleDispatcher
+from app.snapshot import StateSnapshotter
+from app.tick_interval import build_tick_interval
+from app.utils import get_redis_url, get_statsd_client
 
 
 class Autoscaler:
@@ -26,25 +29,94 @@ class Autoscaler:
         self.last_scale_down = {}
         self.scheduler = sched.scheduler(self._now, time.sleep)
         self.schedule_interval_seconds = config["GENERAL"]["SCHEDULE_INTERVAL_SECONDS"]
+        self.tick_interval = build_tick_interval(
+            self.schedule_interval_seconds, config["GENERAL"].get("ADAPTIVE_TICK_INTERVAL")
+        )
+        if self.tick_interval is not None and self.tick_interval.max_seconds >= config["GENERAL"].get(
+            "HEALTHZ_MAX_TICK_AGE_SECONDS", 60
+        ):
+            raise CannotLoadConfig("The longest tick interval has to be shorter than HEALTHZ_MAX_TICK_AGE_SECONDS")
+        self.interval_seconds = self.schedule_interval_seconds
+        # what the last tick decided, for working out the next interval
+        self.tick_desired = {}
+        self.tick_scaled = False
         self.cooldown_seconds_after_scale_up = config["GENERAL"]["COOLDOWN_SECONDS_AFTER_SCALE_UP"]
         self.cooldown_seconds_after_scale_down = config["GENERAL"]["COOLDOWN_SECONDS_AFTER_SCALE_DOWN"]
         self.statsd_client = get_statsd_client()
+        self.metrics = get_metrics_registry()
         self.paas_client = PaasClient()
-
-        redis_url = _get_redis_url()
+        # clients for the other orgs and spaces apps are configured in
+        self.paas_clients = {}
+        self.scale_dispatcher = ScaleDispatcher(
+            self.paas_client, max_workers=config["GENERAL"].get("SCALE_DISPATCHER_MAX_WORKERS", 8)
+        )
+        self.instance_ready_uptime_seconds = config["GENERAL"].get("INSTANCE_READY_UPTIME_SECONDS", 0)
+        self.scale_up_hold_max_seconds = config["GENERAL"].get("SCALE_UP_HOLD_MAX_SECONDS", 300)
+        # apps we scaled up whose new instances have not all come up yet
+        self.awaiting_ready = set()
+        self.scale_up_held_since = {}
+        # when the last scale up was accepted and how long its instances took to become ready, per app
+        self.scale_up_accepted_at = {}
+        self.measured_startup_seconds = {}
+        self.startup_samples = {}
+        self.startup_sample_count = config["GENERAL"].get("INSTANCE_STARTUP_SAMPLES", 5)
+        # instance states fetched while working out this tick's desired counts
+        self.instance_states = {}
+        instance_budget = config["GENERAL"].get("INSTANCE_BUDGET")
+        self.allocator = BudgetAllocator(instance_budget) if instance_budget else None
+
+        redis_url = get_redis_url()
 
         self.redis_client = Redis.from_url(redis_url)
+        self.profiler = TickProfiler(
+            log_dir=config["GENERAL"].get("PROFILE_LOG_DIR", "/home/vcap/logs"),
+            top_n=config["GENERAL"].get("PROFILE_TOP_N", 25),
+            redis_client=self.redis_client,
+        )
+        self.snapshotter = StateSnapshotter(
+            self.redis_client,
+            interval_seconds=config["GENERAL"].get("SNAPSHOT_INTERVAL_SECONDS", 30),
+            max_age_seconds=config["GENERAL"].get("SNAPSHOT_MAX_AGE_SECONDS", 600),
+        )
+        # set once state from a previous process has been restored
+        self.warm_started = False
+        self.journal = self._build_journal()
+        self.tick_record = None
         self._load_autoscaler_apps()
 
+    def _build_journal(self):
+        settings = config["GENERAL"].get("DECISION_JOURNAL")
+        if not settings:
+            return None
+        return DecisionJournal(
+            settings["DIR"],
+            max_bytes=settings.get("MAX_BYTES", 10 * 1024 * 1024),
+            backup_count=settings.get("BACKUP_COUNT", 5),
+            compress=settings.get("COMPRESS", False),
+        )
+
+    def _app_configs(self):
+        yield from config["APPS"]
+        # apps in other orgs and spaces, e.g. to scale preview, staging and production from one process
+        for target in config.get("TARGETS") or []:
+            for app in target["apps"]:
+                yield dict(app, org=target.get("org"), space=target["space"])
+
     def _load_autoscaler_apps(self):
         apps = []
-        for app in config["APPS"]:
+        for app in self._app_configs():
             try:
                 apps.append(App(**app))
             except Exception as e:
                 msg = "Could not load {}: The error was: {}".format(app, e)
                 logging.critical(msg, exc_info=True)
                 raise CannotLoadConfig(msg)
+        keys = [app.key for app in apps]
+        duplicates = sorted({key for key in keys if keys.count(key) > 1})
+        if duplicates:
+            raise CannotLoadConfig("Apps are configured more than once: {}".format(", ".join(duplicates)))
+        # fails on unknown or circular upstream apps before we start scaling
+        pipeline_order(apps)
         self.autoscaler_apps = apps
 
     def _now(self):
@@ -52,7 +124,7 @@ class Autoscaler:
 
     def _schedule(self):
         current_time = self._now()
-        run_at = current_time + self.schedule_interval_seconds
+        run_at = current_time + self.interval_seconds
         logging.debug("Next run time {}".format(str(run_at)))
 
         # Copying from docs: https://docs.python.org/3/library/sched.html#sched.scheduler.run
@@ -66,35 +138,180 @@ class Autoscaler:
         print("User:           {}".format(self.paas_client.username))
         print("Org:            {}".format(self.paas_client.org))
         print("Space:          {}".format(self.paas_client.space))
-
+        other_spaces = sorted(
+            {(app.org, app.space) for app in self.autoscaler_apps} - {(self.paas_client.org, self.paas_client.space)}
+        )
+        if other_spaces:
+            print("Also scaling:   {}".format(", ".join("{}/{}".format(*target) for target in other_spaces)))
+
+        self._start_metrics_server()
+        self.profiler.install_signal_handler()
+        if self.journal is not None:
+            self.journal.start()
+        self.warm_started = self.snapshotter.restore(self.autoscaler_apps) > 0
         self._schedule()
         while True:
             self.scheduler.run()
 
+    def _start_metrics_server(self):
+        # cf tells the app which port its route points at
+        port = int(os.environ.get("PORT", 8080))
+        max_tick_age_seconds = config["GENERAL"].get("HEALTHZ_MAX_TICK_AGE_SECONDS", 60)
+        try:
+            MetricsServer(port, max_tick_age_seconds, token=os.environ.get("METRICS_TOKEN")).start()
+            print("Metrics:        http://0.0.0.0:{}/metrics".format(port))
+        except OSError as e:
+            logging.error("Could not start the metrics server on port {}: {}".format(port, e))
+
     def run_task(self):
-        paas_apps = self.paas_client.get_paas_apps()
+        with self.metrics.timer("autoscaler_tick_duration_seconds"):
+            self.profiler.run(self._run_tick)
+
+        self.metrics.mark_tick()
+        self.snapshotter.maybe_save(self.autoscaler_apps)
+        self._update_interval()
+        self._schedule()
+
+    def _update_interval(self):
+        if self.tick_interval is not None:
+            self.interval_seconds = self.tick_interval.next_interval(
+                self._tick_inputs(), self.tick_desired, self.tick_scaled, self._now()
+            )
+        self.metrics.set_gauge("autoscaler_tick_interval_seconds", self.interval_seconds)
 
+    def _tick_inputs(self):
+        inputs = {}
         for app in self.autoscaler_apps:
-            if app.name not in paas_apps:
+            for scaler in app.scalers:
+                for metric_name, value in scaler.inputs.items():
+                    if isinstance(value, (int, float)):
+                        inputs[(type(scaler).__name__, metric_name)] = value
+        return inputs
+
+    def _run_tick(self):
+        if self.journal is not None:
+            self.tick_record = {"timestamp": self._now(), "apps": {}}
+        self.tick_scaled = False
+        # one listing per org and space, however many of its apps we scale
+        paas_apps = {}
+        cf_unavailable = None
+        for target in sorted({(app.org, app.space) for app in self.autoscaler_apps}):
+            try:
+                paas_apps[target] = self._get_paas_client(*target).get_paas_apps()
+            except CfAuthUnavailable as e:
+                # every space shares the one login, there is no point asking for the others
+                cf_unavailable = e
+                break
+        self.instance_states = {}
+        if cf_unavailable is None and all(paas_apps.values()):
+            # an empty listing is more likely a failed one than a space with nothing in it, keep held updates then
+            self.scale_dispatcher.prune(
+                {attributes["guid"] for space_apps in paas_apps.values() for attributes in space_apps.values()}
+            )
+
+        # every app's desired count has to be known before the budget can be split between them. Upstream apps go
+        # first, so the whole pipeline reacts to a burst in the same tick
+        desired = {}
+        # the load behind each desired count, what downstream apps follow
+        loads = {}
+        for app in pipeline_order(self.autoscaler_apps):
+            space_apps = paas_apps.get((app.org, app.space), {})
+            if app.name in space_apps:
+                app.refresh_cf_info(space_apps[app.name])
+            elif cf_unavailable is None:
                 logging.warning(
-                    "Application {} does not exist, check the config and ensure it is deployed".format(app.name)
+                    "Application {} does not exist, check the config and ensure it is deployed".format(app.key)
                 )
                 continue
-            app.refresh_cf_info(paas_apps[app.name])
-            self.scale(app)
+            elif app.cf_attributes is None:
+                # CF went away before we ever heard of the app, otherwise we carry on with what it last told us
+                continue
+            try:
+                desired[app.key] = self._get_desired_instance_count(app, loads)
+                loads[app.key] = app.get_load_instance_count(loads)
+            except Exception as e:
+                # one app's broken inputs shouldn't stop the others from being scaled
+                logging.error("Could not scale {}: {}".format(app.key, e), exc_info=True)
+
+        self.tick_desired = desired
+        if cf_unavailable is not None:
+            # the decisions are still worked out, journaled and exported, they just can't be sent until we are back
+            logging.warning("Not scaling this tick: {}".format(cf_unavailable))
+            self.metrics.set_gauge("autoscaler_tick_scaling_suspended", 1)
+            for app in self.autoscaler_apps:
+                if app.key in desired:
+                    self._record_suspended_decision(app, desired[app.key])
+            self._finish_tick()
+            return
+        self.metrics.set_gauge("autoscaler_tick_scaling_suspended", 0)
+
+        allowed = self._allocate(desired)
+        for app in self.autoscaler_apps:
+            if app.key not in desired:
+                continue
+            try:
+                self.scale(app, desired[app.key], allowed.get(app.key))
+            except Exception as e:
+                logging.error("Could not scale {}: {}".format(app.key, e), exc_info=True)
 
-        self._schedule()
+        self.scale_dispatcher.dispatch()
+        self._finish_tick()
 
-    def _do_scale(self, app, new_instance_count):
-        try:
-            self.paas_client.update(app.cf_attributes["guid"], new_instance_count)
-        except InvalidStatusCode as e:
-            if e.body.get("error_code") == "CF-ScaleDisabledDuringDeployment":
-                msg = "Cannot scale during deployment {}".format(app.name)
-                logging.debug(msg)
-            else:
-                msg = "Failed to scale {}: {}".format(app.name, str(e))
-                logging.error(msg)
+    def _finish_tick(self):
+        if self.tick_record is not None:
+            self.journal.record(self.tick_record)
+            self.tick_record = None
+
+    def _record_suspended_decision(self, app, desired_instance_count):
+        current_instance_count = app.cf_attributes["instances"]
+        if self.tick_record is not None:
+            self.tick_record["apps"][app.key] = self._journal_entry(
+                app, current_instance_count, desired_instance_count, current_instance_count
+            )
+        self.metrics.set_gauge("autoscaler_app_instances", current_instance_count, app=app.key, kind="current")
+        self.metrics.set_gauge("autoscaler_app_instances", desired_instance_count, app=app.key, kind="desired")
+
+    def _get_paas_client(self, org, space):
+        if (org, space) == (self.paas_client.org, self.paas_client.space):
+            return self.paas_client
+        if (org, space) not in self.paas_clients:
+            # logs in through the same session as every other client for the API
+            self.paas_clients[(org, space)] = PaasClient(org, space)
+        return self.paas_clients[(org, space)]
+
+    def _allocate(self, desired):
+        if self.allocator is None:
+            return {}
+        requests = [
+            BudgetRequest(
+                app.key,
+                desired[app.key],
+                app.cf_attributes["instances"],
+                app.min_instances,
+                priority=app.priority,
+                weight=app.weight,
+                cost=app.budget_cost,
+            )
+            for app in self.autoscaler_apps
+            if app.key in desired
+        ]
+        return self.allocator.allocate(requests)
+
+    def _do_scale(self, app, current_instance_count, new_instance_count):
+        def on_success():
+            # a refused or held update changed nothing, the tick interval only needs to shrink once cf took it
+            self.tick_scaled = True
+            # the app listing is only refreshed every so often, don't act on the old count until then
+            app.cf_attributes["instances"] = new_instance_count
+            # nor on stats from before the update, they would show the new instances as not even started
+            self.paas_client.invalidate_app_stats(app.cf_attributes["guid"])
+            if new_instance_count > current_instance_count:
+                self.awaiting_ready.add(app.key)
+                self.scale_up_accepted_at[app.key] = self._now()
+            if app.controller is None:
+                self._record_scale(app.key, current_instance_count, new_instance_count)
+
+        self.scale_dispatcher.submit(app, new_instance_count, on_success)
 
     def get_new_instance_count(self, current, desired, app_name):
         new_instance_count = current
@@ -109,35 +326,164 @@ class Autoscaler:
                 logging.debug("Skipping scale down due to a recent scale down event")
                 return current
 
-            self._set_last_scale("last_scale_down", app_name, self._now())
             new_instance_count = current - 1
 
         # scale up
         elif desired > current:
-            self._set_last_scale("last_scale_up", app_name, self._now())
             new_instance_count = desired
 
         return new_instance_count
 
-    def scale(self, app):
-        app_name = app.name
+    def _record_scale(self, app_name, current, new_instance_count):
+        # only called once cf has taken the new count, so a refused update doesn't start a cooldown
+        if new_instance_count > current:
+            self._set_last_scale("last_scale_up", app_name, self._now())
+        elif new_instance_count < current:
+            self._set_last_scale("last_scale_down", app_name, self._now())
+
+    def _refresh_instance_states(self, app):
+        try:
+            stats = self.paas_client.get_app_stats(app.name, app.cf_attributes["guid"])
+            states = count_instance_states(stats or {}, self.instance_ready_uptime_seconds)
+        except Exception as e:
+            logging.warning("Could not get instance states for {}: {}".format(app.key, e))
+            return None
+        if app.key in self.awaiting_ready and stats:
+            # instances CF has accepted but not placed yet don't show up in the stats at all
+            missing = app.cf_attributes["instances"] - sum(states.values())
+            states["starting"] += max(0, missing)
+
+        # scalers size their throughput on what is actually serving, not on what was asked for
+        app.cf_attributes["ready_instances"] = states["ready"]
+        if states["starting"] == 0:
+            self.awaiting_ready.discard(app.key)
+            accepted_at = self.scale_up_accepted_at.pop(app.key, None)
+            if accepted_at is not None:
+                self._record_startup(app.key, self._now() - accepted_at)
+        for kind, count in states.items():
+            self.metrics.set_gauge("autoscaler_app_instances", count, app=app.key, kind=kind)
+        return states
+
+    def _record_startup(self, app_key, seconds):
+        self.metrics.set_gauge("autoscaler_instance_startup_seconds", seconds, app=app_key)
+        samples = self.startup_samples.setdefault(app_key, deque(maxlen=self.startup_sample_count))
+        samples.append(seconds)
+        # one scale up that came up suspiciously fast (or slow) doesn't move the estimate on its own
+        self.measured_startup_seconds[app_key] = statistics.median(samples)
+
+    def _hold_scale_up(self, app, states):
+        """Whether to wait for instances that are still starting before asking for more"""
+        if not states or states["starting"] == 0:
+            self.scale_up_held_since.pop(app.key, None)
+            return False
+
+        held_since = self.scale_up_held_since.setdefault(app.key, self._now())
+        if self._now() - held_since >= self.scale_up_hold_max_seconds:
+            # they may never become ready, don't wait on them forever
+            logging.warning("Instances of {} have been starting for too long, scaling up anyway".format(app.key))
+            self.scale_up_held_since.pop(app.key, None)
+            return False
+
+        logging.info("Holding scale up of {}, {} instances are still starting".format(app.key, states["starting"]))
+        return True
+
+    def _get_desired_instance_count(self, app, upstream_loads=None):
+        if app.key in self.awaiting_ready:
+            self.instance_states[app.key] = self._refresh_instance_states(app)
+        else:
+            # only known while instances are coming up, otherwise everything asked for is taken to be serving
+            app.cf_attributes.pop("ready_instances", None)
+        if app.key in self.measured_startup_seconds:
+            # lets scalers that plan ahead ask for instances early enough
+            app.cf_attributes["instance_startup_seconds"] = self.measured_startup_seconds[app.key]
         desired_instance_count = app.get_desired_instance_count()
+
+        if app.upstream and upstream_loads:
+            upstream_instance_count = app.get_upstream_instance_count(upstream_loads)
+            if upstream_instance_count is not None:
+                self.metrics.set_gauge(
+                    "autoscaler_app_instances", upstream_instance_count, app=app.key, kind="upstream"
+                )
+                if upstream_instance_count > desired_instance_count:
+                    logging.debug(
+                        "Upstream apps raise {} from {} to {}".format(
+                            app.key, desired_instance_count, upstream_instance_count
+                        )
+                    )
+                    desired_instance_count = upstream_instance_count
+        return desired_instance_count
+
+    def scale(self, app, desired_instance_count=None, allowed_instance_count=None):
+        app_name = app.key
+        if desired_instance_count is None:
+            desired_instance_count = self._get_desired_instance_count(app)
+        states = self.instance_states.pop(app_name, None)
         current_instance_count = app.cf_attributes["instances"]
+        target_instance_count = desired_instance_count
+        if allowed_instance_count is not None:
+            target_instance_count = min(desired_instance_count, allowed_instance_count)
 
-        new_instance_count = self.get_new_instance_count(current_instance_count, desired_instance_count, app_name)
+        if app.controller is not None:
+            new_instance_count = app.controller.get_new_instance_count(
+                current_instance_count, target_instance_count, self._now(), self.redis_client
+            )
+        else:
+            new_instance_count = self.get_new_instance_count(current_instance_count, target_instance_count, app_name)
+        if allowed_instance_count is not None:
+            # the controller can overshoot its input, it doesn't get to overshoot the budget
+            new_instance_count = min(new_instance_count, max(current_instance_count, allowed_instance_count))
+        if new_instance_count > current_instance_count:
+            if states is None:
+                states = self._refresh_instance_states(app)
+            if self._hold_scale_up(app, states):
+                new_instance_count = current_instance_count
+        if new_instance_count < current_instance_count and app.inputs_stale:
+            # a missing input would otherwise look like no load
+            logging.warning("Not scaling {} down, some of its inputs are stale".format(app_name))
+            new_instance_count = current_instance_count
         if current_instance_count != new_instance_count:
-            logging.info("Scaling {} from {} to {}".format(app.name, current_instance_count, new_instance_count))
-            self._do_scale(app, new_instance_count)
+            logging.info("Scaling {} from {} to {}".format(app.key, current_instance_count, new_instance_count))
+            self._do_scale(app, current_instance_count, new_instance_count)
+        else:
+            # an update held back by a deployment may no longer be what we want
+            self.scale_dispatcher.cancel(app)
+
+        if self.tick_record is not None:
+            self.tick_record["apps"][app_name] = self._journal_entry(
+                app, current_instance_count, desired_instance_count, new_instance_count, allowed_instance_count
+            )
 
         self.statsd_client.gauge("{}.instance-count".format(app_name), new_instance_count)
+        self.metrics.set_gauge("autoscaler_app_instances", current_instance_count, app=app_name, kind="current")
+        self.metrics.set_gauge("autoscaler_app_instances", desired_instance_count, app=app_name, kind="desired")
+        self.metrics.set_gauge("autoscaler_app_instances", new_instance_count, app=app_name, kind="new")
+
+    def _journal_entry(self, app, current, desired, new_instance_count, allowed=None):
+        return {
+            "current": current,
+            "desired": desired,
+            "allowed": allowed,
+            "new": new_instance_count,
+            "min_instances": app.min_instances,
+            "max_instances": app.max_instances,
+            "stale": app.inputs_stale,
+            # as last read from or written to redis, the journal doesn't cost extra round trips
+            "cooldown": {
+                "last_scale_up": self.last_scale_up.get(app.key),
+                "last_scale_down": self.last_scale_down.get(app.key),
+            },
+            "scalers": [scaler.journal_entry() for scaler in app.scalers],
+        }
 
     def _recent_scale(self, app_name, redis_key, timeout):
         # if we redeployed autoscaler and we lost the last scale time
         now = self._now()
 
+        read_failed = False
         try:
             last_scale = self.redis_client.hget(redis_key, app_name)
         except Exception as e:
+            read_failed = True
             logging.warning(
                 "Could not retrieve data from redis for {}. Error was \
                     {}".format(
@@ -147,14 +493,19 @@ class Autoscaler:
             last_scale = None
 
         if not last_scale:
+            if self.warm_started and not read_failed:
+                # an earlier process was already running and never scaled this app this way, no cooldown applies
+                return False
             last_scale = now
             self._set_last_scale(redis_key, app_name, last_scale)
         else:
             last_scale = float(last_scale)
+        getattr(self, redis_key)[app_name] = last_scale
 
         return now < (last_scale + timeout)
 
     def _set_last_scale(self, key, app_name, timestamp):
+        getattr(self, key)[app_name] = timestamp
         try:
             self.redis_client.hset(key, app_name, timestamp)
         except Exception as e:
@@ -1,12 +1,18 @@
 import logging
 import os
+import time
 from datetime import datetime, timedelta
 
-import boto3
-import psycopg2
+from app.circuit_breaker import get_circuit_breaker
+from app.config import config
+from app.exceptions import SourceUnavailable
+from app.metrics import get_metrics_registry
+from app.polling import get_signal_cache
+from app.utils import get_statsd_client, lazy_import
 
-from app.paas_client import PaasClient
-from app.utils import get_statsd_client
+# only loaded once an AWS or database scaler makes its first call
+boto3 = lazy_import("boto3")
+psycopg2 = lazy_import("psycopg2")
 
 
 class BaseScaler:
@@ -14,17 +20,97 @@ class BaseScaler:
         self.app_name = app_name
         self.min_instances = min_instances
         self.max_instances = max_instances
+        self.cf_attributes = None
         self.statsd_client = get_statsd_client()
+        self.signal_cache = get_signal_cache()
+        self.metrics = get_metrics_registry()
+        self.staleness_budget = timedelta(seconds=config["GENERAL"].get("STALENESS_BUDGET_SECONDS", 300))
+        self.last_good_instance_count = None
+        self.last_good_at = None
+        self.stale = False
+        # what the last call saw and how long it took, for the decision journal
+        self.inputs = {}
+        self.last_desired_instance_count = None
+        # before min_instances and max_instances are applied, what the inputs alone call for
+        self.last_load_instance_count = None
+        self.last_latency = None
 
     def get_desired_instance_count(self):
-        desired_instances = self._get_desired_instance_count()
+        started = time.monotonic()
+        self.inputs = {}
+        try:
+            desired_instances = self._get_desired_instance_count()
+        except SourceUnavailable as e:
+            desired_instances = self._get_stale_instance_count(e)
+        else:
+            self.last_good_instance_count = desired_instances
+            self.last_good_at = self._now()
+            self.stale = False
+        self.metrics.set_gauge(
+            "autoscaler_scaler_inputs_stale", int(self.stale), app=self.app_name, scaler=type(self).__name__
+        )
+
+        self.last_load_instance_count = desired_instances
         desired_instances = max(desired_instances, self.min_instances)
         desired_instances = min(desired_instances, self.max_instances)
 
+        self.last_desired_instance_count = desired_instances
+        self.last_latency = time.monotonic() - started
         return desired_instances
 
+    def journal_entry(self):
+        return {
+            "type": type(self).__name__,
+            "desired": self.last_desired_instance_count,
+            "inputs": self.inputs,
+            "stale": self.stale,
+            "latency": self.last_latency,
+        }
+
+    def get_state(self):
+        # what a restarted process would otherwise have lost, subclasses add their own on top
+        return {
+            "last_good_instance_count": self.last_good_instance_count,
+            "last_good_at": self.last_good_at.timestamp() if self.last_good_at is not None else None,
+        }
+
+    def set_state(self, state):
+        self.last_good_instance_count = state.get("last_good_instance_count")
+        last_good_at = state.get("last_good_at")
+        self.last_good_at = datetime.fromtimestamp(last_good_at) if last_good_at is not None else None
+
+    def _get_stale_instance_count(self, error):
+        # the caller won't scale down on stale inputs, so holding on to an old value can only keep instances around
+        self.stale = True
+        if self.last_good_at is not None and self._now() - self.last_good_at <= self.staleness_budget:
+            logging.warning(
+                "{} for {} is using its last good value {}: {}".format(
+                    type(self).__name__, self.app_name, self.last_good_instance_count, error
+                )
+            )
+            return self.last_good_instance_count
+
+        current_instances = (self.cf_attributes or {}).get("instances", self.min_instances)
+        logging.warning(
+            "{} for {} has no recent value, holding at {} instances: {}".format(
+                type(self).__name__, self.app_name, current_instances, error
+            )
+        )
+        return current_instances
+
+    def refresh_cf_info(self, cf_attributes):
+        self.cf_attributes = cf_attributes
+
     def gauge(self, metric_name, metric_value):
         self.statsd_client.gauge(metric_name, metric_value)
+        self.inputs[metric_name] = metric_value
+        self.metrics.set_gauge(
+            "autoscaler_scaler_input",
+            metric_value,
+            app=self.app_name,
+            scaler=type(self).__name__,
+            metric=metric_name,
+        )
 
     def _now(self):
         # to make mocking in tests easier
@@ -34,41 +120,67 @@ class BaseScaler:
         raise NotImplementedError
 
 
+# the account we run as doesn't change, every AWS scaler in a region shares one lookup
+_aws_account_ids = {}
+
+
+def reset_aws_account_ids():
+    _aws_account_ids.clear()
+
+
 class AwsBaseScaler(BaseScaler):
     def __init__(self, app_name, min_instances, max_instances, aws_region=None):
         super().__init__(app_name, min_instances, max_instances)
 
         self.aws_region = aws_region or os.environ.get("AWS_REGION", "eu-west-1")
-        self.aws_account_id = self._get_boto3_client("sts", region_name=self.aws_region).get_caller_identity()[
-            "Account"
-        ]  # noqa
+        if self.aws_region not in _aws_account_ids:
+            _aws_account_ids[self.aws_region] = self._get_boto3_client(
+                "sts", region_name=self.aws_region
+            ).get_caller_identity()["Account"]
+        self.aws_account_id = _aws_account_ids[self.aws_region]
 
     def _get_boto3_client(self, client, **kwargs):
-        return boto3.client(client, **kwargs)
+        from botocore.config import Config
+
+        # fail fast, a slow AWS API is handled by the circuit breakers rather than by waiting on it
+        boto_config = Config(
+            connect_timeout=config["GENERAL"].get("AWS_CONNECT_TIMEOUT_SECONDS", 2),
+            read_timeout=config["GENERAL"].get("AWS_READ_TIMEOUT_SECONDS", 5),
+            retries={"max_attempts": config["GENERAL"].get("AWS_MAX_ATTEMPTS", 2), "mode": "standard"},
+        )
+        return boto3.client(client, config=boto_config, **kwargs)
 
 
 class PaasBaseScaler(BaseScaler):
     def __init__(self, app_name, min_instances, max_instances):
         super().__init__(app_name, min_instances, max_instances)
+        from app.paas_client import PaasClient
+
         self.paas_client = PaasClient()
 
+    def _get_app_stats(self):
+        # by guid, so it is the response the autoscaler already fetched and never a namesake in another space
+        guid = (self.cf_attributes or {}).get("guid")
+        return self.paas_client.get_app_stats(self.app_name, guid)
 
-class DbQueryScaler(BaseScaler):
-    DB_CONNECTION_TIMEOUT = timedelta(seconds=60)
 
+class DbQueryScaler(BaseScaler):
     def __init__(self, app_name, min_instances, max_instances):
         super().__init__(app_name, min_instances, max_instances)
         self._init_db_uri()
-        self.last_db_error = datetime.min
+        self.db_connect_timeout_seconds = config["GENERAL"].get("DB_CONNECT_TIMEOUT_SECONDS", 2)
+        self.db_statement_timeout_ms = config["GENERAL"].get("DB_STATEMENT_TIMEOUT_MS", 5000)
+
+    @property
+    def circuit_breaker(self):
+        # keyed by the query, scalers running the same query share its result and its breaker
+        return get_circuit_breaker("postgres", self.query)
 
     def _init_db_uri(self):
         self.db_uri = os.environ["SQLALCHEMY_DATABASE_URI"].replace("postgresql://", "postgres://")
         return
 
     def run_query(self):
-        if datetime.utcnow() - self.last_db_error < self.DB_CONNECTION_TIMEOUT:
-            return 0
-
         if self.query is None:
             msg = "No query has been defined"
             logging.critical(msg)
@@ -79,16 +191,19 @@ class DbQueryScaler(BaseScaler):
             logging.critical(msg)
             raise Exception(msg)
 
-        try:
-            with psycopg2.connect(self.db_uri) as conn:
-                with conn.cursor() as cursor:
-                    cursor.execute(self.query)
-                    items_count = cursor.fetchone()[0]
-                    return items_count
-        except psycopg2.OperationalError:
-            # if there is exceptional load we might have run out of connections. try again in sixty seconds.
-            logging.warning("Could not connect to database", exc_info=True)
-            self.last_db_error = datetime.utcnow()
-
-            # return 0 so that autoscaler can continue to look at other metrics.
-            return 0
+        # raises SourceUnavailable if the database can't be reached, rather than pretending there is no work
+        return self.signal_cache.get("postgres", self.query, self._execute_query)
+
+    def _execute_query(self):
+        with psycopg2.connect(
+            self.db_uri,
+            connect_timeout=self.db_connect_timeout_seconds,
+            options="-c statement_timeout={}".format(self.db_statement_timeout_ms),
+        ) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(self.query)
+                return self._read_result(cursor)
+
+    def _read_result(self, cursor):
+        items_count = cursor.fetchone()[0]
+        return items_count
@@ -0,0 +1,45 @@
+import json
+import logging
+import statistics
+from collections import deque
+
+REDIS_CALIBRATION_KEY = "calibrated_throughput"
+
+
+class ThroughputCalibrator:
+    """Estimates how many tasks a single worker gets through per minute from what the workers actually did.
+
+    Samples are only meaningful while the workers are saturated, so the caller decides when to add one. The estimate
+    is the median of the last `window` samples, so a single odd minute (a deploy, a slow dependency) doesn't move it.
+    """
+
+    def __init__(self, name, window=15, min_samples=3):
+        self.name = name
+        self.min_samples = min_samples
+        self.samples = deque(maxlen=window)
+        self.state_loaded = False
+
+    @property
+    def estimate(self):
+        if len(self.samples) < self.min_samples:
+            return None
+        return statistics.median(self.samples)
+
+    def add_sample(self, tasks_per_worker_per_minute):
+        self.samples.append(tasks_per_worker_per_minute)
+
+    def load_state(self, redis_client):
+        self.state_loaded = True
+        try:
+            state = redis_client.hget(REDIS_CALIBRATION_KEY, self.name)
+        except Exception as e:
+            logging.warning("Could not load calibration for {}. Error was {}".format(self.name, e))
+            return
+        if state:
+            self.samples.extend(json.loads(state)["samples"])
+
+    def save_state(self, redis_client):
+        try:
+            redis_client.hset(REDIS_CALIBRATION_KEY, self.name, json.dumps({"samples": list(self.samples)}))
+        except Exception as e:
+            logging.warning("Could not save calibration for {}. Error was {}".format(self.name, e))
@@ -0,0 +1,248 @@
+import base64
+import json
+import logging
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from http import HTTPStatus
+
+from cloudfoundry_client.client import CloudFoundryClient
+from requests.adapters import HTTPAdapter
+
+from app.config import config
+from app.exceptions import CfAuthUnavailable
+from app.metrics import get_metrics_registry
+from app.rate_limiter import PRIORITY_READ, PRIORITY_UPDATE, get_cf_rate_limiter
+from app.utils import get_statsd_client
+
+RETRYABLE_STATUSES = {HTTPStatus.TOO_MANY_REQUESTS} | {status for status in HTTPStatus if status >= 500}
+
+
+def _parse_retry_after(value):
+    # Retry-After is either a number of seconds or an HTTP date
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _token_expires_at(access_token):
+    # the exp claim of the JWT, we only read it, checking the signature is up to CF
+    try:
+        payload = access_token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class CfApiAdapter(HTTPAdapter):
+    """Sends every HTTP request of the CF session: one rate limiter token and one set of retries per request.
+
+    A listing walks many pages, each one waits for its own token and a throttled page is retried on its own instead of
+    the whole walk starting over. Retries back off exponentially with jitter, each wait is capped at
+    `backoff_max_seconds` and none is started that would take the retries past `retry_budget_seconds` in total.
+    Requests that don't set a timeout get `timeout`.
+    """
+
+    def __init__(
+        self,
+        rate_limiter,
+        timeout,
+        retries=3,
+        backoff_base_seconds=0.5,
+        backoff_max_seconds=10,
+        retry_budget_seconds=30,
+        on_response=None,
+        sleep=time.sleep,
+    ):
+        super().__init__()
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.retry_budget_seconds = retry_budget_seconds
+        self.on_response = on_response
+        self._sleep = sleep
+        self.statsd_client = get_statsd_client()
+        self.metrics = get_metrics_registry()
+
+    def _backoff_seconds(self, attempt):
+        # "equal jitter": never less than half the exponential delay, so retries from many callers spread out
+        delay = min(self.backoff_max_seconds, self.backoff_base_seconds * 2**attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def send(self, request, timeout=None, **kwargs):
+        # scale updates may use the tokens reserved for them, everything that only reads may not
+        priority = PRIORITY_READ if request.method in ("GET", "HEAD") else PRIORITY_UPDATE
+        attempt = 0
+        slept = 0
+        while True:
+            waited = self.rate_limiter.acquire(priority)
+            if waited:
+                self.statsd_client.timing("paas-client.throttle-wait", waited)
+                self.metrics.observe("autoscaler_cf_api_throttle_wait_seconds", waited)
+            with self.metrics.timer("autoscaler_cf_api_call_duration_seconds"):
+                response = super().send(request, timeout=timeout or self.timeout, **kwargs)
+            if self.on_response is not None:
+                # sees the responses we retry too, unlike the session's response hooks
+                self.on_response(response)
+            if response.status_code not in RETRYABLE_STATUSES or attempt >= self.retries:
+                return response
+            delay = self._backoff_seconds(attempt)
+            if slept + delay > self.retry_budget_seconds:
+                return response
+            logging.warning(
+                "CF API returned {} for {} {}, retrying in {:.2f} seconds (attempt {} of {})".format(
+                    response.status_code, request.method, request.path_url, delay, attempt + 1, self.retries
+                )
+            )
+            self.statsd_client.incr("paas-client.retries")
+            response.close()
+            self._sleep(delay)
+            slept += delay
+            attempt += 1
+
+
+class CfSession:
+    """The logged in CloudFoundryClient for an API endpoint, shared by every PaasClient and thread in the process.
+
+    The access token is refreshed `refresh_margin_seconds` before it expires, so calls don't have to fail on an expired
+    token first. A failed login doesn't block anyone: logins are suspended for an exponentially growing time, starting
+    at `auth_backoff_base_seconds` so we never try often enough to get the user locked out, and until then asking for
+    the client raises CfAuthUnavailable straight away.
+    """
+
+    def __init__(self, api_url, username, password, clock=time.time):
+        self.api_url = api_url
+        self.username = username
+        self.password = password
+        self._clock = clock
+        self.refresh_margin_seconds = config["GENERAL"].get("CF_TOKEN_REFRESH_MARGIN_SECONDS", 60)
+        self.auth_backoff_base_seconds = config["GENERAL"].get("CF_AUTH_BACKOFF_BASE_SECONDS", 5 * 60)
+        self.auth_backoff_max_seconds = config["GENERAL"].get("CF_AUTH_BACKOFF_MAX_SECONDS", 30 * 60)
+        self.retry_after_max_seconds = config["GENERAL"].get("CF_API_RETRY_AFTER_MAX_SECONDS", 60)
+        self.rate_limiter = get_cf_rate_limiter()
+        self.metrics = get_metrics_registry()
+        self.client = None
+        self.expires_at = None
+        self.failed_logins = 0
+        self.suspended_until = 0
+        self._lock = threading.Lock()
+
+    def suspended_for(self):
+        """How many more seconds logins are suspended for, 0 if they aren't"""
+        return max(0, self.suspended_until - self._clock())
+
+    def get_client(self):
+        with self._lock:
+            suspended_for = self.suspended_for()
+            if suspended_for:
+                raise CfAuthUnavailable(
+                    "Not logging in to {} for another {:.0f} seconds".format(self.api_url, suspended_for)
+                )
+            if self.client is None:
+                self._login()
+            elif self.expires_at is not None and self._clock() >= self.expires_at - self.refresh_margin_seconds:
+                self._refresh()
+            return self.client
+
+    def invalidate(self):
+        # logs in again on the next call, e.g. after the API told us our token is no good
+        with self._lock:
+            self.client = None
+            self.expires_at = None
+
+    def _login(self):
+        proxy = dict(http=os.environ.get("HTTP_PROXY", ""), https=os.environ.get("HTTPS_PROXY", ""))
+        try:
+            self.rate_limiter.acquire(PRIORITY_UPDATE)
+            client = CloudFoundryClient(self.api_url, proxy=proxy)
+            client.init_with_user_credentials(self.username, self.password)
+        except Exception as e:
+            self._on_login_failed(e)
+
+        # the session only exists once we have a token, every request it sends goes through our adapter
+        adapter = self._build_adapter()
+        client._session.mount("https://", adapter)
+        client._session.mount("http://", adapter)
+        self.client = client
+        self._on_token(client, "password")
+
+    def _build_adapter(self):
+        settings = config["GENERAL"]
+        return CfApiAdapter(
+            self.rate_limiter,
+            timeout=(
+                settings.get("CF_API_CONNECT_TIMEOUT_SECONDS", 5),
+                settings.get("CF_API_READ_TIMEOUT_SECONDS", 30),
+            ),
+            retries=settings.get("CF_API_MAX_RETRIES", 3),
+            backoff_base_seconds=settings.get("CF_API_BACKOFF_BASE_SECONDS", 0.5),
+            backoff_max_seconds=settings.get("CF_API_BACKOFF_MAX_SECONDS", 10),
+            retry_budget_seconds=settings.get("CF_API_RETRY_BUDGET_SECONDS", 30),
+            on_response=self._record_retry_after,
+        )
+
+    def _refresh(self):
+        try:
+            self.rate_limiter.acquire(PRIORITY_UPDATE)
+            self.client._refresh_token()
+        except Exception as e:
+            logging.warning("Could not refresh the CF token, logging in again: {}".format(e))
+            self.metrics.inc("autoscaler_cf_logins_total", kind="refresh", result="failed")
+            self.client = None
+            self._login()
+            return
+        self._on_token(self.client, "refresh")
+
+    def _on_token(self, client, kind):
+        self.expires_at = _token_expires_at(client._access_token)
+        self.failed_logins = 0
+        self.metrics.inc("autoscaler_cf_logins_total", kind=kind, result="ok")
+        self.metrics.set_gauge("autoscaler_cf_auth_suspended", 0)
+
+    def _on_login_failed(self, error):
+        self.client = None
+        self.expires_at = None
+        delay = min(self.auth_backoff_max_seconds, self.auth_backoff_base_seconds * 2**self.failed_logins)
+        self.failed_logins += 1
+        self.suspended_until = self._clock() + delay
+        logging.error("Failed to authenticate: {}, not trying again for {} seconds".format(error, delay))
+        self.metrics.inc("autoscaler_cf_logins_total", kind="password", result="failed")
+        self.metrics.set_gauge("autoscaler_cf_auth_suspended", 1)
+        raise CfAuthUnavailable("Failed to authenticate with {}: {}".format(self.api_url, error)) from error
+
+    def _record_retry_after(self, response):
+        if response.status_code not in (HTTPStatus.TOO_MANY_REQUESTS, HTTPStatus.SERVICE_UNAVAILABLE):
+            return
+        retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+        if retry_after:
+            # every caller waits on the rate limiter, don't let one header stall the scaling loop for long
+            retry_after = min(retry_after, self.retry_after_max_seconds)
+            logging.warning("CF API asked us to back off for {} seconds".format(retry_after))
+            self.rate_limiter.block_for(retry_after)
+
+
+# one session per API endpoint, whatever org and space the PaasClient using it looks at
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_cf_session(api_url, username, password):
+    with _sessions_lock:
+        if api_url not in _sessions:
+            _sessions[api_url] = CfSession(api_url, username, password)
+    return _sessions[api_url]
+
+
+def reset_cf_sessions():
+    with _sessions_lock:
+        _sessions.clear()
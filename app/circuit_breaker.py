@@ -0,0 +1,133 @@
+import logging
+import threading
+import time
+
+from app.config import config
+from app.exceptions import SourceUnavailable
+from app.metrics import get_metrics_registry
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+# exported as a number so it can be graphed and alerted on
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+def _is_client_error(e):
+    # the source answered, it just didn't like the request (a deleted queue, a missing app). 429 is the source
+    # telling us it is overloaded, that one counts
+    status = getattr(e, "status_code", None)
+    response = getattr(e, "response", None)
+    if status is None and isinstance(response, dict):
+        # botocore's ClientError
+        status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    elif status is None and response is not None:
+        status = getattr(response, "status_code", None)
+    return isinstance(status, int) and 400 <= status < 500 and status != 429
+
+
+class CircuitBreaker:
+    """Stops calling a data source that keeps failing, so a slow or broken dependency doesn't cost every tick a timeout.
+
+    After `failure_threshold` failures in a row the breaker opens and calls fail straight away with SourceUnavailable.
+    Once `reset_timeout_seconds` have passed a single call is let through to probe the source (half open): it closes
+    the breaker if it succeeds and opens it again if it fails. A client error (4xx) means the source is up and
+    answering, it is passed on as SourceUnavailable without counting as a failure.
+    """
+
+    def __init__(self, name, failure_threshold=3, reset_timeout_seconds=30, clock=time.monotonic, resource=None):
+        self.name = name
+        self.resource = resource
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_seconds = reset_timeout_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.metrics = get_metrics_registry()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._set_state(CLOSED)
+
+    @property
+    def labels(self):
+        if self.resource is None:
+            return {"source": self.name}
+        return {"source": self.name, "resource": str(self.resource)}
+
+    @property
+    def description(self):
+        if self.resource is None:
+            return self.name
+        return "{} {}".format(self.name, self.resource)
+
+    def _set_state(self, state):
+        if state != self.state:
+            logging.warning("Circuit breaker for {} is now {}".format(self.description, state))
+        self.state = state
+        self.metrics.set_gauge("autoscaler_circuit_breaker_state", STATE_VALUES[state], **self.labels)
+
+    def _before_call(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and self._clock() - self.opened_at >= self.reset_timeout_seconds:
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+        raise SourceUnavailable("Circuit breaker for {} is open".format(self.description))
+
+    def _on_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            self._set_state(CLOSED)
+
+    def _on_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.metrics.inc("autoscaler_circuit_breaker_trips_total", **self.labels)
+                self.opened_at = self._clock()
+                self._set_state(OPEN)
+
+    def call(self, func):
+        self._before_call()
+        try:
+            result = func()
+        except Exception as e:
+            if _is_client_error(e):
+                self._on_success()
+            else:
+                self._on_failure()
+            raise SourceUnavailable("{} failed: {}".format(self.description, e)) from e
+        self._on_success()
+        return result
+
+
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(source, resource=None):
+    # one breaker per resource of a data source (a queue, a metric, an app) for the whole process, every scaler
+    # reading it sees the same state while one broken resource doesn't cut the others off
+    with _circuit_breakers_lock:
+        if (source, resource) not in _circuit_breakers:
+            settings = config["GENERAL"].get("CIRCUIT_BREAKER") or {}
+            _circuit_breakers[(source, resource)] = CircuitBreaker(
+                source,
+                failure_threshold=settings.get("FAILURE_THRESHOLD", 3),
+                reset_timeout_seconds=settings.get("RESET_TIMEOUT_SECONDS", 30),
+                resource=resource,
+            )
+    return _circuit_breakers[(source, resource)]
+
+
+def reset_circuit_breakers():
+    with _circuit_breakers_lock:
+        _circuit_breakers.clear()
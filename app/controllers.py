@@ -0,0 +1,120 @@
+import json
+import logging
+
+from app.exceptions import CannotLoadApp
+
+REDIS_STATE_KEY = "controller_state"
+
+
+class TargetTrackingController:
+    """PI controller keeping the app's utilisation (desired instances / running instances) at a setpoint.
+
+    The scalers' desired count is treated as the load expressed in instances. The error is how many instances we are
+    away from load / setpoint and the integral term carries the steady state instance count, so the proportional term
+    reacts to a step change straight away while noise around a threshold is averaged out instead of flipping the count
+    back and forth. The integral is clamped to the instance limits and is not updated while the output is saturated
+    (anti-windup). Its state is kept in redis so a restart carries on where the old process left off.
+    """
+
+    def __init__(
+        self,
+        app_name,
+        min_instances,
+        max_instances,
+        setpoint=1.0,
+        kp=0.3,
+        ki=0.5,
+        deadband=1.0,
+        max_state_age_seconds=600,
+    ):
+        if float(ki) <= 0:
+            raise CannotLoadApp("The controller of {} needs a ki above 0, got {}".format(app_name, ki))
+        if float(setpoint) <= 0:
+            raise CannotLoadApp("The controller of {} needs a setpoint above 0, got {}".format(app_name, setpoint))
+        self.app_name = app_name
+        self.min_instances = min_instances
+        self.max_instances = max_instances
+        self.setpoint = float(setpoint)
+        self.kp = float(kp)
+        # per minute, so tuning does not depend on the tick interval
+        self.ki = float(ki)
+        # how far the output has to move away from the current count before we act on it
+        self.deadband = float(deadband)
+        self.max_state_age_seconds = max_state_age_seconds
+        self.integral = None
+        self.updated_at = None
+        self.state_loaded = False
+
+    def _clamp(self, value):
+        return max(self.min_instances, min(self.max_instances, value))
+
+    def load_state(self, redis_client):
+        self.state_loaded = True
+        try:
+            state = redis_client.hget(REDIS_STATE_KEY, self.app_name)
+        except Exception as e:
+            logging.warning("Could not load controller state for {}. Error was {}".format(self.app_name, e))
+            return
+        if state:
+            state = json.loads(state)
+            self.integral = state["integral"]
+            self.updated_at = state["updated_at"]
+
+    def save_state(self, redis_client):
+        state = json.dumps({"integral": self.integral, "updated_at": self.updated_at})
+        try:
+            redis_client.hset(REDIS_STATE_KEY, self.app_name, state)
+        except Exception as e:
+            logging.warning("Could not save controller state for {}. Error was {}".format(self.app_name, e))
+
+    def update(self, current, desired, now):
+        target = desired / self.setpoint
+        error = target - current
+
+        if self.integral is None or now - self.updated_at > self.max_state_age_seconds:
+            # bumpless start: behave as if we had been holding the current count all along
+            self.integral = current / self.ki
+            dt_minutes = 0
+        else:
+            dt_minutes = max(0, now - self.updated_at) / 60.0
+        self.updated_at = now
+
+        integral = self.integral + error * dt_minutes
+        output = self.kp * error + self.ki * integral
+        winding_up = (output > self.max_instances and error > 0) or (output < self.min_instances and error < 0)
+        if not winding_up:
+            self.integral = integral
+        # keep the integral term itself within what we could ever ask for
+        self.integral = self._clamp(self.ki * self.integral) / self.ki
+
+        output = self._clamp(output)
+        new_instance_count = current if abs(output - current) < self.deadband else int(round(output))
+        logging.debug(
+            "Controller {}: utilisation {:.2f}, error {:.2f}, output {:.2f}".format(
+                self.app_name, desired / max(current, 1), error, output
+            )
+        )
+        return new_instance_count
+
+    def get_new_instance_count(self, current, desired, now, redis_client):
+        if not self.state_loaded:
+            self.load_state(redis_client)
+        new_instance_count = self.update(current, desired, now)
+        self.save_state(redis_client)
+        return new_instance_count
+
+
+CONTROLLERS = {
+    "TargetTracking": TargetTrackingController,
+}
+
+
+def build_controller(app_name, min_instances, max_instances, controller_config):
+    if not controller_config:
+        # None means the autoscaler's own threshold and cooldown policy
+        return None
+    controller_config = dict(controller_config)
+    controller_type = controller_config.pop("type")
+    if controller_type not in CONTROLLERS:
+        raise CannotLoadApp("Unknown controller type {} for {}".format(controller_type, app_name))
+    return CONTROLLERS[controller_type](app_name, min_instances, max_instances, **controller_config)
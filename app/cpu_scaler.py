@@ -19,5 +19,5 @@ class CpuScaler(PaasBaseScaler):
         return desired_instance_count
 
     def _get_cpu_percentages(self):
-        paas_app = self.paas_client.get_app_stats(self.app_name)
+        paas_app = self._get_app_stats()
         return (instance["stats"]["usage"]["cpu"] * 100 for instance in paas_app.values())
@@ -1,17 +1,103 @@
 import logging
 import math
+from collections import defaultdict, deque
 from datetime import timedelta
 
 from app.base_scalers import AwsBaseScaler
+from app.exceptions import CannotLoadApp
+from app.window_statistics import build_statistic
+
+# what counts as a request on each kind of load balancer
+LOAD_BALANCER_METRICS = {
+    "application": ("AWS/ApplicationELB", "RequestCount"),
+    "network": ("AWS/NetworkELB", "NewFlowCount"),
+}
+RESPONSE_TIME_PERCENTILES = {"p95", "p99"}
+
+# every ALB/NLB metric any ElbScaler reads, per region, so they can all be fetched with one get_metric_data call
+_metric_queries = defaultdict(set)
+_metric_time_ranges = defaultdict(lambda: timedelta(0))
+
+
+def reset_metric_queries():
+    _metric_queries.clear()
+    _metric_time_ranges.clear()
+
+
+def _query_id(index):
+    # get_metric_data ids have to start with a lower case letter
+    return "m{}".format(index)
 
 
 class ElbScaler(AwsBaseScaler):
+    """Scales on the requests going through a load balancer.
+
+    Classic ELBs are named with elb_name. ALBs and NLBs are named with load_balancer (the `app/name/id` part of the
+    ARN), optionally narrowed down to one target_group. With a response_time_target, ALB scalers also scale the app up
+    by how far the latest p95 or p99 TargetResponseTime is over the target, whichever of the two needs more instances.
+    """
+
     def __init__(self, app_name, min_instances, max_instances, **kwargs):
         super().__init__(app_name, min_instances, max_instances, kwargs.get("aws_region"))
-        self.elb_name = kwargs["elb_name"]
+        self.elb_name = kwargs.get("elb_name")
+        self.load_balancer = kwargs.get("load_balancer")
+        if not self.elb_name and not self.load_balancer:
+            raise CannotLoadApp("ElbScaler for {} needs an elb_name or a load_balancer".format(app_name))
+        self.load_balancer_type = kwargs.get("load_balancer_type", "application")
+        self.target_group = kwargs.get("target_group")
         self.threshold = kwargs["threshold"]
         self.request_count_time_range = kwargs.get("request_count_time_range", {"minutes": 5})
+        self.response_time_target = kwargs.get("response_time_target")
+        self.response_time_percentile = kwargs.get("response_time_percentile", "p95")
+        self.statistic = build_statistic(
+            kwargs.get("statistic"), window=int(timedelta(**self.request_count_time_range).total_seconds() // 60)
+        )
         self.cloudwatch_client = None
+        # (when, running instances) over the request count time range, to know what produced each response time
+        self.running_instances_history = deque()
+
+        if self.elb_name and self.response_time_target is not None:
+            raise CannotLoadApp(
+                "Classic ELBs don't report response time percentiles, {} has a response_time_target".format(app_name)
+            )
+        if self.load_balancer:
+            self._validate_load_balancer_options()
+            self._register_metric_queries()
+
+    def _validate_load_balancer_options(self):
+        if self.load_balancer_type not in LOAD_BALANCER_METRICS:
+            raise CannotLoadApp("Unknown load balancer type {} for {}".format(self.load_balancer_type, self.app_name))
+        if self.response_time_target is not None:
+            if self.load_balancer_type != "application":
+                raise CannotLoadApp(
+                    "Only ALBs report response times, {} has a response_time_target".format(self.app_name)
+                )
+            if self.response_time_percentile not in RESPONSE_TIME_PERCENTILES:
+                raise CannotLoadApp(
+                    "response_time_percentile for {} has to be one of {}".format(
+                        self.app_name, sorted(RESPONSE_TIME_PERCENTILES)
+                    )
+                )
+
+    def _dimensions(self):
+        dimensions = [("LoadBalancer", self.load_balancer)]
+        if self.target_group:
+            dimensions.append(("TargetGroup", self.target_group))
+        return tuple(dimensions)
+
+    def _request_count_query(self):
+        namespace, metric_name = LOAD_BALANCER_METRICS[self.load_balancer_type]
+        return (namespace, metric_name, self._dimensions(), "Sum")
+
+    def _response_time_query(self):
+        return ("AWS/ApplicationELB", "TargetResponseTime", self._dimensions(), self.response_time_percentile)
+
+    def _register_metric_queries(self):
+        _metric_queries[self.aws_region].add(self._request_count_query())
+        if self.response_time_target is not None:
+            _metric_queries[self.aws_region].add(self._response_time_query())
+        time_range = timedelta(**self.request_count_time_range)
+        _metric_time_ranges[self.aws_region] = max(_metric_time_ranges[self.aws_region], time_range)
 
     def _init_cloudwatch_client(self):
         if self.cloudwatch_client is None:
@@ -19,35 +105,141 @@ class ElbScaler(AwsBaseScaler):
 
     def _get_desired_instance_count(self):
         logging.debug("Processing {}".format(self.app_name))
-        request_counts = self._get_request_counts()
-        if len(request_counts) == 0:
-            request_counts = [0]
-        logging.debug("Request counts: {}".format(request_counts))
+        if self.load_balancer:
+            metrics = self._get_load_balancer_metrics()
+            request_counts = metrics.get(self._request_count_query(), [])
+        else:
+            request_counts = self._get_request_counts()
+        logging.debug("Request counts: {}".format([value for _, value in request_counts]))
 
-        # Keep the highest request count over the specified time range
-        highest_request_count = max(request_counts)
-        logging.debug("Highest request count: {}".format(highest_request_count))
+        # The highest request count over the specified time range, unless another statistic is configured
+        highest_request_count = self.statistic.summarise(request_counts)
+        logging.debug("Request count ({}): {}".format(self.statistic.name, highest_request_count))
 
         self.gauge("{}.request-count".format(self.app_name), highest_request_count)
         desired_instance_count = int(math.ceil(highest_request_count / float(self.threshold)))
+
+        if self.load_balancer and self.response_time_target is not None:
+            response_times = metrics.get(self._response_time_query(), [])
+            desired_instance_count = max(desired_instance_count, self._get_instance_count_for_latency(response_times))
         return desired_instance_count
 
+    def _get_instance_count_for_latency(self, response_times):
+        cf_attributes = self.cf_attributes or {}
+        running_instances = cf_attributes.get("ready_instances", cf_attributes.get("instances"))
+        if not running_instances:
+            return 0
+        self._record_running_instances(running_instances)
+        if not response_times:
+            return 0
+
+        # the latest minute, measured on however many instances were serving then. Older, slower minutes were already
+        # acted on, scaling on them again against today's count would compound every scale up until they age out
+        timestamp, response_time = response_times[-1]
+        self.gauge("{}.response-time-{}".format(self.app_name, self.response_time_percentile), response_time)
+        if response_time <= self.response_time_target:
+            # fast enough, the request counts decide. Latency has a floor that more instances won't get under
+            return 0
+        # assumes response times fall back in proportion to the extra instances
+        return int(math.ceil(self._running_instances_at(timestamp) * response_time / float(self.response_time_target)))
+
+    def _record_running_instances(self, running_instances):
+        now = self._now()
+        self.running_instances_history.append((now, running_instances))
+        cutoff = now - timedelta(**self.request_count_time_range) - timedelta(minutes=1)
+        # keep the last count from before the cutoff, it still applies at the start of the window
+        while len(self.running_instances_history) > 1 and self.running_instances_history[1][0] <= cutoff:
+            self.running_instances_history.popleft()
+
+    def _running_instances_at(self, timestamp):
+        earlier = [count for at, count in self.running_instances_history if at <= timestamp]
+        if earlier:
+            return earlier[-1]
+        return self.running_instances_history[0][1]
+
+    def get_state(self):
+        state = super().get_state()
+        state["statistic"] = self.statistic.get_state()
+        return state
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.statistic.set_state(state.get("statistic", {}))
+
     def _get_request_counts(self):
         self._init_cloudwatch_client()
         start_time = self._now() - timedelta(**self.request_count_time_range)
         end_time = self._now()
-        result = self.cloudwatch_client.get_metric_statistics(
-            Namespace="AWS/ELB",
-            MetricName="RequestCount",
-            Dimensions=[
-                {"Name": "LoadBalancerName", "Value": self.elb_name},
-            ],
-            StartTime=start_time,
-            EndTime=end_time,
-            Period=60,
-            Statistics=["Sum"],
-            Unit="Count",
+        result = self.signal_cache.get(
+            "cloudwatch",
+            ("RequestCount", self.elb_name, str(self.request_count_time_range)),
+            lambda: self.cloudwatch_client.get_metric_statistics(
+                Namespace="AWS/ELB",
+                MetricName="RequestCount",
+                Dimensions=[
+                    {"Name": "LoadBalancerName", "Value": self.elb_name},
+                ],
+                StartTime=start_time,
+                EndTime=end_time,
+                Period=60,
+                Statistics=["Sum"],
+                Unit="Count",
+            ),
         )
         datapoints = result["Datapoints"]
         datapoints = sorted(datapoints, key=lambda x: x["Timestamp"])
-        return [row["Sum"] for row in datapoints]
+        return [(row["Timestamp"], row["Sum"]) for row in datapoints]
+
+    def _get_load_balancer_metrics(self):
+        # the first scaler to get here fetches the metrics of every ALB and NLB scaler in the region
+        self._init_cloudwatch_client()
+        metrics = self.signal_cache.get("cloudwatch", ("elbv2", self.aws_region), self._fetch_load_balancer_metrics)
+        # fetched over the longest time range any scaler asked for, only keep the part of it this one wants
+        start_time = self._now() - timedelta(**self.request_count_time_range)
+        return {
+            query: [
+                (timestamp.replace(tzinfo=None), value)
+                for timestamp, value in datapoints
+                if timestamp.replace(tzinfo=None) >= start_time
+            ]
+            for query, datapoints in metrics.items()
+        }
+
+    def _fetch_load_balancer_metrics(self):
+        queries = sorted(_metric_queries[self.aws_region])
+        metric_data_queries = [
+            {
+                "Id": _query_id(index),
+                "MetricStat": {
+                    "Metric": {
+                        "Namespace": namespace,
+                        "MetricName": metric_name,
+                        "Dimensions": [{"Name": name, "Value": value} for name, value in dimensions],
+                    },
+                    "Period": 60,
+                    "Stat": stat,
+                },
+                "ReturnData": True,
+            }
+            for index, (namespace, metric_name, dimensions, stat) in enumerate(queries)
+        ]
+        end_time = self._now()
+        start_time = end_time - _metric_time_ranges[self.aws_region]
+
+        metrics = {query: [] for query in queries}
+        kwargs = {}
+        while True:
+            response = self.cloudwatch_client.get_metric_data(
+                MetricDataQueries=metric_data_queries,
+                StartTime=start_time,
+                EndTime=end_time,
+                ScanBy="TimestampAscending",
+                **kwargs
+            )
+            for result in response["MetricDataResults"]:
+                query = queries[int(result["Id"][1:])]
+                metrics[query].extend(zip(result["Timestamps"], result["Values"]))
+            if not response.get("NextToken"):
+                break
+            kwargs["NextToken"] = response["NextToken"]
+        return metrics
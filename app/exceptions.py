@@ -8,3 +8,11 @@ class CannotLoadConfig(AutoscalerException):
 
 class CannotLoadApp(AutoscalerException):
     pass
+
+
+class SourceUnavailable(AutoscalerException):
+    pass
+
+
+class CfAuthUnavailable(SourceUnavailable):
+    pass
@@ -0,0 +1,121 @@
+import logging
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.base_scalers import BaseScaler
+from app.config import config
+from app.exceptions import SourceUnavailable
+
+# every url any HttpJsonScaler reads, fetched together so the apps' endpoints are called concurrently
+_urls = set()
+_session = None
+_executor = None
+_lock = threading.Lock()
+# url -> (etag, last modified, payload) of the last 200 response, for conditional requests
+_validators = {}
+
+
+def get_http_session():
+    # one session keeps connections to each host alive between ticks, shared by every HttpJsonScaler
+    global _session, _executor
+    with _lock:
+        if _session is None:
+            max_workers = config["GENERAL"].get("HTTP_MAX_WORKERS", 8)
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="http-json")
+    return _session
+
+
+def reset_http_session():
+    global _session, _executor
+    with _lock:
+        if _session is not None:
+            _session.close()
+            _executor.shutdown(wait=False)
+        _session = None
+        _executor = None
+        _urls.clear()
+        _validators.clear()
+
+
+def fetch_json(url, timeout):
+    headers = {}
+    etag, last_modified, payload = _validators.get(url, (None, None, None))
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    response = get_http_session().get(url, headers=headers, timeout=timeout)
+    if response.status_code == 304 and payload is not None:
+        return payload
+    response.raise_for_status()
+    payload = response.json()
+    if "ETag" in response.headers or "Last-Modified" in response.headers:
+        _validators[url] = (response.headers.get("ETag"), response.headers.get("Last-Modified"), payload)
+    return payload
+
+
+def fetch_all(timeout):
+    """Fetches every registered url concurrently. A url that fails maps to the error instead of taking the rest down"""
+    get_http_session()
+    urls = sorted(_urls)
+    futures = [(url, _executor.submit(fetch_json, url, timeout)) for url in urls]
+    results = {}
+    for url, future in futures:
+        try:
+            results[url] = future.result()
+        except Exception as e:
+            logging.warning("Could not fetch {}: {}".format(url, e))
+            results[url] = e
+    return results
+
+
+def find_json_path(payload, json_path):
+    """Follows a dotted path like `queues.email.0.inflight` into the payload"""
+    value = payload
+    for part in json_path.split("."):
+        if isinstance(value, list):
+            value = value[int(part)]
+        else:
+            value = value[part]
+    return value
+
+
+class HttpJsonScaler(BaseScaler):
+    """Scales on a number read from a JSON endpoint, e.g. the queue or in-flight counts on an app's /_status page"""
+
+    def __init__(self, app_name, min_instances, max_instances, **kwargs):
+        super().__init__(app_name, min_instances, max_instances)
+        self.url = kwargs["url"]
+        self.json_path = kwargs["json_path"]
+        self.threshold = kwargs["threshold"]
+        self.timeout = kwargs.get("timeout_seconds", config["GENERAL"].get("HTTP_TIMEOUT_SECONDS", 5))
+        _urls.add(self.url)
+
+    def _get_desired_instance_count(self):
+        # served from the signal cache until the http polling interval has passed
+        results = self.signal_cache.get("http", "all", lambda: fetch_all(self.timeout))
+        payload = results.get(self.url)
+        if payload is None:
+            # registered after the cached fetch was made
+            try:
+                payload = fetch_json(self.url, self.timeout)
+            except Exception as e:
+                payload = e
+        if isinstance(payload, Exception):
+            raise SourceUnavailable("Could not fetch {}: {}".format(self.url, payload))
+
+        try:
+            value = float(find_json_path(payload, self.json_path))
+        except (KeyError, IndexError, ValueError, TypeError) as e:
+            raise SourceUnavailable("No number at {} in {}: {!r}".format(self.json_path, self.url, e))
+        self.gauge("{}.{}".format(self.app_name, self.json_path), value)
+        return int(math.ceil(value / float(self.threshold)))
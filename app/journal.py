@@ -0,0 +1,188 @@
+import argparse
+import gzip
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+import zlib
+
+from app.metrics import get_metrics_registry
+
+JOURNAL_NAME = "journal.jsonl"
+_STOP = object()
+
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class DecisionJournal:
+    """Appends one JSON line per tick describing what every app's scalers saw and what was decided.
+
+    Records are handed to a writer thread through a bounded queue, so the scaling loop never waits on the disk. If the
+    writer falls behind, records are dropped and counted rather than queued up without limit. Once the current file
+    has grown to max_bytes on disk (compressed, if it is), it is rotated to journal.1.jsonl and so on, keeping
+    backup_count old files.
+    """
+
+    def __init__(self, directory, max_bytes=10 * 1024 * 1024, backup_count=5, compress=False, queue_size=1000):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.suffix = ".gz" if compress else ""
+        self.path = os.path.join(directory, JOURNAL_NAME + self.suffix)
+        self.metrics = get_metrics_registry()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._file = None
+        self._bytes_written = 0
+        self._thread = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._write_loop, name="decision-journal", daemon=True)
+        self._thread.start()
+        return self
+
+    def record(self, entry):
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.metrics.inc("autoscaler_journal_dropped_records_total")
+
+    def close(self, timeout=5):
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _write_loop(self):
+        while True:
+            entry = self._queue.get()
+            if entry is _STOP:
+                break
+            try:
+                self._write(entry)
+            except Exception as e:
+                logging.error("Could not write to the decision journal {}: {}".format(self.path, e))
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self, entry):
+        if self._file is None:
+            self._file = _open(self.path, "a")
+            self._bytes_written = os.path.getsize(self.path)
+
+        line = json.dumps(entry, separators=(",", ":"), sort_keys=True) + "\n"
+        self._file.write(line)
+        # one flush per tick, so a crash loses at most the record being written
+        self._file.flush()
+        # what is on disk, len(line) would count characters before compression
+        self._bytes_written = os.path.getsize(self.path)
+        if self._bytes_written >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for index in range(self.backup_count - 1, 0, -1):
+            source = self._backup_path(index)
+            if os.path.exists(source):
+                os.replace(source, self._backup_path(index + 1))
+        if self.backup_count > 0:
+            os.replace(self.path, self._backup_path(1))
+        else:
+            os.remove(self.path)
+
+    def _backup_path(self, index):
+        return os.path.join(self.directory, "journal.{}.jsonl{}".format(index, self.suffix))
+
+
+def journal_files(directory):
+    """Journal files in the directory, oldest first"""
+    pattern = re.compile(r"^journal(?:\.(\d+))?\.jsonl(?:\.gz)?$")
+    files = []
+    for name in os.listdir(directory):
+        match = pattern.match(name)
+        if match:
+            files.append((int(match.group(1) or 0), os.path.join(directory, name)))
+    return [path for _, path in sorted(files, reverse=True)]
+
+
+def read_journal(directory, app_name=None):
+    """Streams the records back in the order they were written, optionally only the parts about one app"""
+    for path in journal_files(directory):
+        for line in _read_lines(path):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # the last line of a file can be cut short by a crash
+                continue
+            if app_name is not None:
+                if app_name not in entry["apps"]:
+                    continue
+                entry = dict(entry, apps={app_name: entry["apps"][app_name]})
+            yield entry
+
+
+def _read_lines(path):
+    with _open(path, "r") as f:
+        try:
+            yield from f
+        except (EOFError, zlib.error):
+            # a compressed file that is still being written to, or was cut short by a crash, has no end marker yet.
+            # Everything flushed before that point is readable
+            logging.debug("{} ends early, it is still open or was truncated".format(path))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Print or replay the autoscaler decision journal")
+    parser.add_argument("directory")
+    parser.add_argument("--app", help="only show this app")
+    parser.add_argument(
+        "--replay",
+        metavar="APP",
+        help="replay the recorded inputs of APP through the target tracking controller and print both decisions",
+    )
+    args = parser.parse_args(argv)
+
+    if args.replay:
+        from app.controllers import TargetTrackingController
+        from app.simulator import replay
+
+        records = list(read_journal(args.directory, args.replay))
+        if not records:
+            print("No records for {}".format(args.replay), file=sys.stderr)
+            return 1
+        limits = records[-1]["apps"][args.replay]
+        controller = TargetTrackingController(args.replay, limits["min_instances"], limits["max_instances"])
+        result = replay(controller.update, records, args.replay)
+        for entry, new_instance_count in zip(records, result.instances):
+            recorded = entry["apps"][args.replay]
+            print(
+                json.dumps(
+                    {
+                        "timestamp": entry["timestamp"],
+                        "current": recorded["current"],
+                        "desired": recorded["desired"],
+                        "recorded": recorded["new"],
+                        "replayed": new_instance_count,
+                    }
+                )
+            )
+        return 0
+
+    for entry in read_journal(args.directory, args.app):
+        print(json.dumps(entry, sort_keys=True))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
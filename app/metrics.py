@@ -0,0 +1,185 @@
+import hmac
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """In-memory store for the values served on /metrics, in the Prometheus text format.
+
+    Labels are passed as keyword arguments. Collectors are called on every render and return
+    (name, labels, value) tuples, for values that live elsewhere and would be wasteful to copy on every tick.
+    """
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._gauges = defaultdict(dict)
+        self._counters = defaultdict(dict)
+        self._histograms = defaultdict(dict)
+        self._collectors = []
+        self.started_at = clock()
+        self.last_tick_at = None
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[name][tuple(sorted(labels.items()))] = value
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._counters[name][key] = self._counters[name].get(key, 0) + value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            histogram = self._histograms[name].get(key)
+            if histogram is None:
+                histogram = self._histograms[name][key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started, **labels)
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def mark_tick(self):
+        self.last_tick_at = self._clock()
+
+    def seconds_since_last_tick(self):
+        return self._clock() - (self.last_tick_at or self.started_at)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, values in sorted(self._gauges.items()):
+                lines.append("# TYPE {} gauge".format(name))
+                lines.extend("{}{} {}".format(name, _format_labels(key), value) for key, value in values.items())
+            for name, values in sorted(self._counters.items()):
+                lines.append("# TYPE {} counter".format(name))
+                lines.extend("{}{} {}".format(name, _format_labels(key), value) for key, value in values.items())
+            for name, values in sorted(self._histograms.items()):
+                lines.append("# TYPE {} histogram".format(name))
+                for key, histogram in values.items():
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        bucket_labels = key + (("le", bound),)
+                        lines.append("{}_bucket{} {}".format(name, _format_labels(bucket_labels), count))
+                    inf_labels = key + (("le", "+Inf"),)
+                    lines.append("{}_bucket{} {}".format(name, _format_labels(inf_labels), histogram.count))
+                    lines.append("{}_sum{} {}".format(name, _format_labels(key), histogram.sum))
+                    lines.append("{}_count{} {}".format(name, _format_labels(key), histogram.count))
+
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                lines.append("{}{} {}".format(name, _format_labels(tuple(sorted(labels.items()))), value))
+
+        lines.append("# TYPE autoscaler_seconds_since_last_tick gauge")
+        lines.append("autoscaler_seconds_since_last_tick {}".format(self.seconds_since_last_tick()))
+        return "\n".join(lines) + "\n"
+
+
+_metrics_registry = MetricsRegistry()
+
+
+def get_metrics_registry():
+    return _metrics_registry
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            if not self._authorised():
+                # the route is public, without the token there is nothing here
+                self._respond(404, "not found\n")
+                return
+            self._respond(200, self.server.registry.render())
+        elif self.path == "/healthz":
+            age = self.server.registry.seconds_since_last_tick()
+            if age > self.server.max_tick_age_seconds:
+                self._respond(503, "stale: last tick finished {:.0f} seconds ago\n".format(age))
+            else:
+                self._respond(200, "ok\n")
+        else:
+            self._respond(404, "not found\n")
+
+    def _authorised(self):
+        token = self.server.token
+        if not token:
+            return False
+        expected = "Bearer {}".format(token)
+        return hmac.compare_digest(self.headers.get("Authorization", "").encode(), expected.encode())
+
+    def _respond(self, status, body):
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # every scrape and health check would end up in app.log otherwise
+        logging.debug("metrics server: " + format % args)
+
+
+class MetricsServer:
+    """Serves /metrics and /healthz from a daemon thread so scrapes never hold up the scaling loop.
+
+    /healthz is open to the platform's health check, /metrics only answers requests carrying `token` as a bearer token
+    and isn't served at all without one.
+    """
+
+    def __init__(self, port, max_tick_age_seconds, registry=None, host="0.0.0.0", token=None):
+        self.httpd = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.registry = registry or get_metrics_registry()
+        self.httpd.max_tick_age_seconds = max_tick_age_seconds
+        self.httpd.token = token
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="metrics-server", daemon=True)
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -1,74 +1,111 @@
 import logging
 import os
-import time
+from http import HTTPStatus
 
-from cloudfoundry_client.client import CloudFoundryClient
+from cloudfoundry_client.errors import InvalidStatusCode
 
+from app.cf_session import get_cf_session
 from app.config import config
+from app.polling import get_signal_cache
 
 
-class PaasClient:
-    def __init__(self):
-        self.client = None
+def _is_retryable(e):
+    return isinstance(e, InvalidStatusCode) and (
+        e.status_code == HTTPStatus.TOO_MANY_REQUESTS or e.status_code >= HTTPStatus.INTERNAL_SERVER_ERROR
+    )
+
+
+def count_instance_states(stats, ready_after_uptime_seconds=0):
+    """Sorts an app's instances, as returned by the CF stats endpoint, into ready, starting and crashed.
+
+    A RUNNING instance only counts as ready once it has been up for ready_after_uptime_seconds, before that it is still
+    warming up and is counted as starting. Anything that is neither running nor starting (CRASHED, DOWN) is crashed.
+    """
+    counts = {"ready": 0, "starting": 0, "crashed": 0}
+    for instance in stats.values():
+        state = instance.get("state")
+        uptime = (instance.get("stats") or {}).get("uptime") or 0
+        if state == "RUNNING" and uptime >= ready_after_uptime_seconds:
+            counts["ready"] += 1
+        elif state in ("RUNNING", "STARTING"):
+            counts["starting"] += 1
+        else:
+            counts["crashed"] += 1
+    return counts
+
 
-        self.org = config["GENERAL"]["CF_ORG"]
-        self.space = config["GENERAL"]["CF_SPACE"]
+class PaasClient:
+    def __init__(self, org=None, space=None):
+        self.org = org or config["GENERAL"]["CF_ORG"]
+        self.space = space or config["GENERAL"]["CF_SPACE"]
         self.api_url = config["GENERAL"]["CF_API_URL"]
 
         self.username = os.environ["CF_USERNAME"]
         self.password = os.environ["CF_PASSWORD"]
 
+        self.signal_cache = get_signal_cache()
+        self.session = get_cf_session(self.api_url, self.username, self.password)
+
     def update(self, guid, instances):
-        self.client.apps._update(guid, {"instances": instances})
+        client = self.get_cloudfoundry_client()
+        # rate limiting and retries happen per HTTP request, in the session's adapter
+        client.apps._update(guid, {"instances": instances})
+
+    @property
+    def client(self):
+        return self.session.client
 
     def get_cloudfoundry_client(self):
-        if self.client is None:
-            proxy = dict(http=os.environ.get("HTTP_PROXY", ""), https=os.environ.get("HTTPS_PROXY", ""))
-            client = CloudFoundryClient(self.api_url, proxy=proxy)
-            try:
-                client.init_with_user_credentials(self.username, self.password)
-                self.client = client
-            except BaseException as e:
-                msg = "Failed to authenticate: {}, waiting 5 minutes and exiting".format(str(e))
-                logging.error(msg)
-                # The sleep is added to avoid automatically banning the user for too many failed login attempts
-                time.sleep(5 * 60)
-
-        return self.client
+        """The shared logged in client, raises CfAuthUnavailable while logins are backing off"""
+        return self.session.get_client()
 
-    def get_paas_apps(self):
+    def _list_paas_apps(self, client):
         instances = {}
+        for organization in client.organizations:
+            if organization["entity"]["name"] != self.org:
+                continue
+            for space in organization.spaces():
+                if space["entity"]["name"] != self.space:
+                    continue
+                for app in space.apps():
+                    instances[app["entity"]["name"]] = {
+                        "name": app["entity"]["name"],
+                        "guid": app["metadata"]["guid"],
+                        "instances": app["entity"]["instances"],
+                    }
+        return instances
 
-        client = self.get_cloudfoundry_client()
-        if client is not None:
-            try:
-                for organization in self.client.organizations:
-                    if organization["entity"]["name"] != self.org:
-                        continue
-                    for space in organization.spaces():
-                        if space["entity"]["name"] != self.space:
-                            continue
-                        for app in space.apps():
-                            instances[app["entity"]["name"]] = {
-                                "name": app["entity"]["name"],
-                                "guid": app["metadata"]["guid"],
-                                "instances": app["entity"]["instances"],
-                            }
-            except BaseException as e:
-                if "app" not in locals():
-                    msg = "Failed to get instance info: {}".format(str(e))
-                else:
-                    msg = "Failed to get info for app {}: {}".format(app["entity"]["name"], str(e))
-                logging.error(msg)
+    def _fetch_paas_apps(self, client):
+        try:
+            return self._list_paas_apps(client)
+        except BaseException as e:
+            msg = "Failed to get instance info: {}".format(str(e))
+            logging.error(msg)
+            # running out of retries on a throttled or unhealthy API is no reason to log in again
+            if not _is_retryable(e):
                 self.reset_cloudfoundry_client()
 
-        return instances
+    def get_paas_apps(self):
+        # logging in happens out here, so a suspended login reaches the caller as CfAuthUnavailable
+        client = self.get_cloudfoundry_client()
+        key = (self.api_url, self.org, self.space)
+        return self.signal_cache.get("cf_apps", key, lambda: self._fetch_paas_apps(client)) or {}
 
-    def get_app_stats(self, app_name):
+    def _fetch_app_stats(self, client, app_name, guid=None):
+        if guid is not None:
+            # straight to the stats endpoint, no need to look the app up by name first
+            return client.v2.apps.get_stats(guid)
+        app = client.v2.apps.get_first(**{"name": app_name})
+        return app["entity"]["stats"]
+
+    def get_app_stats(self, app_name, guid=None):
         client = self.get_cloudfoundry_client()
-        if client is not None:
-            app = client.v2.apps.get_first(**{"name": app_name})
-            return app["entity"]["stats"]
+        # keyed on the guid when we have it, app names are only unique within a space
+        key = guid or (self.org, self.space, app_name)
+        return self.signal_cache.get("cf_stats", key, lambda: self._fetch_app_stats(client, app_name, guid))
+
+    def invalidate_app_stats(self, guid):
+        self.signal_cache.invalidate("cf_stats", guid)
 
     def reset_cloudfoundry_client(self):
-        self.client = None
+        self.session.invalidate()
@@ -0,0 +1,18 @@
+import graphlib
+
+from app.exceptions import CannotLoadConfig
+
+
+def pipeline_order(apps):
+    """Apps ordered so every app comes after the apps it declares as upstream"""
+    apps_by_key = {app.key: app for app in apps}
+    sorter = graphlib.TopologicalSorter()
+    for app in apps:
+        for upstream_key, _ in app.upstream:
+            if upstream_key not in apps_by_key:
+                raise CannotLoadConfig("{} has unknown upstream app {}".format(app.key, upstream_key))
+        sorter.add(app.key, *(upstream_key for upstream_key, _ in app.upstream))
+    try:
+        return [apps_by_key[key] for key in sorter.static_order()]
+    except graphlib.CycleError as e:
+        raise CannotLoadConfig("Upstream apps form a cycle: {}".format(" -> ".join(e.args[1])))
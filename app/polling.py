@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import defaultdict
+
+from app.circuit_breaker import get_circuit_breaker
+from app.config import config
+from app.metrics import get_metrics_registry
+
+# CloudWatch publishes one datapoint per minute, refreshing in the middle of a minute only returns what we already have
+ALIGNED_SIGNALS = {"cloudwatch"}
+
+
+class SignalCache:
+    """Keeps the last value fetched for each input signal until its polling interval has passed.
+
+    The scheduler ticks at the rate of the fastest signal, every other signal is served from here so slow moving
+    inputs (CloudWatch aggregates, the CF app listing) are not fetched more often than they can change. Signals without
+    a configured interval are never cached. A fetch returning None is treated as a failure and is not cached either.
+    Fetches go through the circuit breaker of the signal and key, a failing or open source raises SourceUnavailable.
+    """
+
+    def __init__(self, intervals, aligned_signals=ALIGNED_SIGNALS, clock=time.time):
+        self.intervals = intervals
+        self.aligned_signals = aligned_signals
+        self._clock = clock
+        self.metrics = get_metrics_registry()
+        self._values = {}
+        self._lock = threading.Lock()
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+
+    def _expires_at(self, signal, now):
+        interval = self.intervals.get(signal, 0)
+        if interval and signal in self.aligned_signals:
+            return (now // interval + 1) * interval
+        return now + interval
+
+    def get(self, signal, key, fetch):
+        now = self._clock()
+        with self._lock:
+            cached = self._values.get((signal, key))
+            if cached is not None and now < cached[0]:
+                self.hits[signal] += 1
+                return cached[1]
+            self.misses[signal] += 1
+
+        with self.metrics.timer("autoscaler_signal_fetch_duration_seconds", signal=signal):
+            value = get_circuit_breaker(signal, key).call(fetch)
+        if value is not None and self.intervals.get(signal):
+            with self._lock:
+                self._values[(signal, key)] = (self._expires_at(signal, now), value)
+        return value
+
+    def invalidate(self, signal, key=None):
+        with self._lock:
+            for cached_signal, cached_key in list(self._values):
+                if cached_signal == signal and key in (None, cached_key):
+                    del self._values[(cached_signal, cached_key)]
+
+    def collect(self):
+        with self._lock:
+            samples = [("autoscaler_signal_cache_hits_total", {"signal": s}, n) for s, n in self.hits.items()]
+            samples += [("autoscaler_signal_cache_misses_total", {"signal": s}, n) for s, n in self.misses.items()]
+            samples.append(("autoscaler_signal_cache_entries", {}, len(self._values)))
+        return samples
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self.hits.clear()
+            self.misses.clear()
+
+
+_signal_cache = SignalCache(config["GENERAL"].get("POLL_INTERVAL_SECONDS") or {})
+get_metrics_registry().add_collector(_signal_cache.collect)
+
+
+def get_signal_cache():
+    return _signal_cache
@@ -0,0 +1,111 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import signal
+import time
+from datetime import datetime
+
+# restrictions passed to pstats, matched against "path/to/file.py:lineno(function)"
+SCALER_FUNCTIONS = r"app/.*scaler.*\.py.*\(_get_desired_instance_count\)"
+EXTERNAL_CALLS = r"(botocore|boto3|cloudfoundry_client|oauth2_client|psycopg2|redis|requests|urllib3)"
+
+REDIS_FLAG_KEY = "autoscaler:profile-ticks"
+
+
+def _parse_ticks(value, source):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        logging.warning("Ignoring the profiling request from {}, {!r} is not a number of ticks".format(source, value))
+        return 0
+
+
+class TickProfiler:
+    """Records cProfile data for the next few ticks when asked to, then switches itself off again.
+
+    Profiling can be requested by sending SIGUSR1 to the process, by starting it with AUTOSCALER_PROFILE_TICKS set or by
+    setting the autoscaler:profile-ticks key in redis to a number of ticks. While it is off a tick only pays for an
+    integer comparison and, every flag_check_seconds, one redis round trip that reads and clears the flag together.
+    """
+
+    def __init__(self, log_dir, top_n=25, default_ticks=5, flag_check_seconds=60, redis_client=None):
+        self.log_dir = log_dir
+        self.top_n = top_n
+        self.default_ticks = default_ticks
+        self.flag_check_seconds = flag_check_seconds
+        self.redis_client = redis_client
+        self.remaining_ticks = 0
+        self.profiled_ticks = 0
+        self.profile = None
+        self.next_flag_check = 0
+
+        env_ticks = os.environ.get("AUTOSCALER_PROFILE_TICKS")
+        if env_ticks:
+            self.request(_parse_ticks(env_ticks, "AUTOSCALER_PROFILE_TICKS"))
+
+    def install_signal_handler(self, signum=signal.SIGUSR1):
+        signal.signal(signum, lambda *args: self.request(self.default_ticks))
+
+    def request(self, ticks):
+        if ticks > 0 and not self.remaining_ticks:
+            logging.info("Profiling the next {} ticks".format(ticks))
+            self.remaining_ticks = ticks
+
+    def _check_redis_flag(self):
+        now = time.monotonic()
+        if self.redis_client is None or now < self.next_flag_check:
+            return
+        self.next_flag_check = now + self.flag_check_seconds
+        try:
+            # in one transaction, so a flag set between reading and clearing it isn't lost
+            pipeline = self.redis_client.pipeline()
+            pipeline.get(REDIS_FLAG_KEY)
+            pipeline.delete(REDIS_FLAG_KEY)
+            ticks, _ = pipeline.execute()
+        except Exception as e:
+            logging.warning("Could not check the profiling flag in redis. Error was {}".format(e))
+            return
+        if ticks:
+            self.request(_parse_ticks(ticks, REDIS_FLAG_KEY))
+
+    def run(self, func):
+        self._check_redis_flag()
+        if not self.remaining_ticks:
+            return func()
+
+        if self.profile is None:
+            self.profile = cProfile.Profile()
+        self.profile.enable()
+        try:
+            return func()
+        finally:
+            self.profile.disable()
+            self.profiled_ticks += 1
+            self.remaining_ticks -= 1
+            if not self.remaining_ticks:
+                self._dump()
+
+    def _dump(self):
+        path = os.path.join(self.log_dir, "profile-{}.txt".format(datetime.utcnow().strftime("%Y%m%dT%H%M%S")))
+        output = io.StringIO()
+        output.write("Profile of {} ticks\n".format(self.profiled_ticks))
+        for title, restrictions in [
+            ("Top functions by cumulative time", ()),
+            ("Scalers", (SCALER_FUNCTIONS,)),
+            ("External calls", (EXTERNAL_CALLS,)),
+        ]:
+            output.write("\n==== {} ====\n".format(title))
+            stats = pstats.Stats(self.profile, stream=output)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(*restrictions, self.top_n)
+
+        try:
+            with open(path, "w") as f:
+                f.write(output.getvalue())
+            logging.info("Wrote profile of {} ticks to {}".format(self.profiled_ticks, path))
+        except OSError as e:
+            logging.error("Could not write profile to {}: {}".format(path, e))
+
+        self.profile = None
+        self.profiled_ticks = 0
@@ -0,0 +1,73 @@
+import threading
+import time
+
+from app.config import config
+
+# Scale updates are allowed to use every token in the bucket, reads have to leave the reserved tokens alone so a burst
+# of stats lookups can never starve the updates that actually apply scaling decisions
+PRIORITY_UPDATE = 0
+PRIORITY_READ = 1
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, reserved_for_updates=0, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.reserved_for_updates = min(float(reserved_for_updates), self.capacity - 1)
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._last_refill = clock()
+        self._blocked_until = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = max(0, now - self._last_refill)
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._last_refill = now
+
+    def _try_acquire(self, priority):
+        """Returns 0 if a token was taken, otherwise how many seconds to wait before trying again"""
+        with self._lock:
+            now = self._clock()
+            if now < self._blocked_until:
+                return self._blocked_until - now
+
+            self._refill(now)
+            floor = 1 if priority == PRIORITY_UPDATE else 1 + self.reserved_for_updates
+            if self._tokens >= floor:
+                self._tokens -= 1
+                return 0
+            return (floor - self._tokens) / self.rate
+
+    def acquire(self, priority=PRIORITY_READ):
+        """Blocks until a token is available and returns the number of seconds spent waiting"""
+        waited = 0
+        while True:
+            wait = self._try_acquire(priority)
+            if wait <= 0:
+                return waited
+            self._sleep(wait)
+            waited += wait
+
+    def block_for(self, seconds):
+        """Stops handing out tokens for the given time, e.g. when the server sent a Retry-After header"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, self._clock() + seconds)
+
+
+_cf_rate_limiter = None
+_cf_rate_limiter_lock = threading.Lock()
+
+
+def get_cf_rate_limiter():
+    # one bucket for the whole process, every PaasClient shares the same CF API allowance
+    global _cf_rate_limiter
+    with _cf_rate_limiter_lock:
+        if _cf_rate_limiter is None:
+            _cf_rate_limiter = TokenBucket(
+                rate=config["GENERAL"].get("CF_API_REQUESTS_PER_SECOND", 10),
+                capacity=config["GENERAL"].get("CF_API_BURST", 20),
+                reserved_for_updates=config["GENERAL"].get("CF_API_RESERVED_FOR_UPDATES", 5),
+            )
+    return _cf_rate_limiter
@@ -0,0 +1,82 @@
+import logging
+import math
+from collections import defaultdict
+
+from redis import Redis
+
+from app.base_scalers import BaseScaler
+from app.config import config
+from app.utils import get_redis_url, is_pattern
+
+# every queue or key pattern any RedisQueueScaler reads, per broker url, so one round trip serves all of them
+_queues_by_url = defaultdict(set)
+# one client, and so one connection pool, per broker
+_clients = {}
+
+
+def get_broker_client(redis_url):
+    if redis_url not in _clients:
+        _clients[redis_url] = Redis.from_url(redis_url)
+    return _clients[redis_url]
+
+
+def reset_broker_clients():
+    _queues_by_url.clear()
+    _clients.clear()
+
+
+class RedisQueueScaler(BaseScaler):
+    """Scales on the length of Celery queues kept in a redis broker, like SqsScaler does for SQS.
+
+    A queue can be a key pattern, e.g. "send-sms-tasks*" to include the per-priority lists Celery creates next to the
+    queue. The lengths of every queue read by any app are fetched together in one pipelined round trip.
+    """
+
+    def __init__(self, app_name, min_instances, max_instances, **kwargs):
+        super().__init__(app_name, min_instances, max_instances)
+        self.queue_length_threshold = kwargs.get("threshold") or kwargs["allowed_queue_backlog_per_worker"]
+        self.queues = kwargs["queues"] if isinstance(kwargs["queues"], list) else [kwargs["queues"]]
+        self.redis_url = kwargs.get("redis_url") or config["SCALERS"].get("BROKER_REDIS_URL") or get_redis_url()
+        _queues_by_url[self.redis_url].update(self.queues)
+
+    def _get_desired_instance_count(self):
+        keys_by_pattern = self._get_keys_by_pattern()
+        lengths = self.signal_cache.get("redis_queues", self.redis_url, lambda: self._fetch_lengths(keys_by_pattern))
+
+        total_message_count = 0
+        for queue in self.queues:
+            keys = keys_by_pattern[queue] if is_pattern(queue) else [queue]
+            message_count = sum(lengths.get(key, 0) for key in keys)
+            self.gauge("{}.queue-length".format(queue), message_count)
+            total_message_count += message_count
+        logging.debug("Total message count: {}".format(total_message_count))
+        return int(math.ceil(total_message_count / float(self.queue_length_threshold)))
+
+    def _get_keys_by_pattern(self):
+        # patterns are looked up with SCAN, which takes a round trip per page, so they get their own polling interval
+        patterns = sorted(queue for queue in _queues_by_url[self.redis_url] if is_pattern(queue))
+        if not patterns:
+            return {}
+        return self.signal_cache.get("redis_keys", self.redis_url, lambda: self._scan_patterns(patterns))
+
+    def _scan_patterns(self, patterns):
+        client = get_broker_client(self.redis_url)
+        return {pattern: sorted(key.decode() for key in client.scan_iter(match=pattern)) for pattern in patterns}
+
+    def _fetch_lengths(self, keys_by_pattern):
+        keys = {queue for queue in _queues_by_url[self.redis_url] if not is_pattern(queue)}
+        for pattern_keys in keys_by_pattern.values():
+            keys.update(pattern_keys)
+        keys = sorted(keys)
+
+        pipeline = get_broker_client(self.redis_url).pipeline(transaction=False)
+        for key in keys:
+            pipeline.llen(key)
+        lengths = {}
+        for key, length in zip(keys, pipeline.execute(raise_on_error=False)):
+            if isinstance(length, Exception):
+                # a key that isn't a list is someone else's, not a queue
+                logging.warning("Could not get the length of {}: {}".format(key, length))
+                continue
+            lengths[key] = length
+        return lengths
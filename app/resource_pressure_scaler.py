@@ -0,0 +1,64 @@
+import logging
+import math
+
+from app.base_scalers import PaasBaseScaler
+from app.exceptions import CannotLoadApp
+
+# usage key and quota key in the CF stats of an instance
+RESOURCES = {
+    "memory": ("mem", "mem_quota"),
+    "disk": ("disk", "disk_quota"),
+}
+
+
+def _percentile(values, percentile):
+    # nearest rank, there are only ever a handful of instances
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percentile / 100.0 * len(ordered)) - 1)]
+
+
+AGGREGATIONS = {
+    "mean": lambda values: sum(values) / len(values),
+    "max": max,
+    "p90": lambda values: _percentile(values, 90),
+}
+
+
+class ResourcePressureScaler(PaasBaseScaler):
+    """Scales so the memory or disk use of the app's instances stays under `threshold` percent of their quota.
+
+    Reads the same cached CF stats response as CpuScaler and the instance state tracking, so it costs no extra calls.
+    """
+
+    def __init__(self, app_name, min_instances, max_instances, **kwargs):
+        super().__init__(app_name, min_instances, max_instances)
+        self.resource = kwargs.get("resource", "memory")
+        self.aggregation = kwargs.get("aggregation", "mean")
+        if self.resource not in RESOURCES:
+            raise CannotLoadApp("Unknown resource {} for {}".format(self.resource, app_name))
+        if self.aggregation not in AGGREGATIONS:
+            raise CannotLoadApp("Unknown aggregation {} for {}".format(self.aggregation, app_name))
+        self.threshold = kwargs.get("threshold", 80)
+
+    def _get_desired_instance_count(self):
+        logging.debug("Processing {}".format(self.app_name))
+        percentages = list(self._get_usage_percentages())
+        if not percentages:
+            return self.min_instances
+
+        usage = AGGREGATIONS[self.aggregation](percentages)
+        logging.debug("{} {} usage: {}%".format(self.aggregation, self.resource, usage))
+        self.gauge("{}.{}-percentage".format(self.app_name, self.resource), usage)
+        # as many instances as it takes to bring the usage back down to the threshold
+        return int(math.ceil(len(percentages) * usage / float(self.threshold)))
+
+    def _get_usage_percentages(self):
+        usage_key, quota_key = RESOURCES[self.resource]
+        paas_app = self._get_app_stats()
+        for instance in (paas_app or {}).values():
+            stats = instance.get("stats") or {}
+            quota = stats.get(quota_key)
+            # only running instances report their usage
+            if "usage" not in stats or not quota:
+                continue
+            yield stats["usage"][usage_key] * 100.0 / quota
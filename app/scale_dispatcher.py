@@ -0,0 +1,90 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from cloudfoundry_client.errors import InvalidStatusCode
+
+from app.metrics import get_metrics_registry
+
+SCALE_DISABLED_DURING_DEPLOYMENT = "CF-ScaleDisabledDuringDeployment"
+
+
+class ScaleRequest:
+    def __init__(self, app, instance_count, on_success=None):
+        self.app = app
+        self.instance_count = instance_count
+        self.on_success = on_success
+
+    @property
+    def guid(self):
+        return self.app.cf_attributes["guid"]
+
+
+class ScaleDispatcher:
+    """Sends scale updates to CF concurrently, once per tick.
+
+    Requests are keyed on the app guid, so a newer request for an app replaces one that hasn't been sent yet. An update
+    CF refuses because the app is being deployed is held and sent again with the next tick's dispatch, however long the
+    deployment takes, until it goes through or is replaced, cancelled or pruned because its app is gone. Nothing checks
+    the deployment in between, a held update costs one refused request per tick. on_success callbacks run on the
+    dispatching thread once CF has accepted the update.
+    """
+
+    def __init__(self, paas_client, max_workers=8):
+        self.paas_client = paas_client
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scale-dispatcher")
+        self.metrics = get_metrics_registry()
+        self.pending = {}
+        self.held = {}
+
+    def submit(self, app, instance_count, on_success=None):
+        request = ScaleRequest(app, instance_count, on_success)
+        self.held.pop(request.guid, None)
+        self.pending[request.guid] = request
+
+    def cancel(self, app):
+        guid = app.cf_attributes["guid"]
+        self.pending.pop(guid, None)
+        if self.held.pop(guid, None) is not None:
+            logging.info("Dropping held scale update for {}, it is no longer needed".format(app.name))
+
+    def prune(self, guids):
+        """Drops updates for apps that are no longer listed in CF, e.g. deleted or recreated with a new guid"""
+        for requests in (self.pending, self.held):
+            for guid in set(requests) - set(guids):
+                logging.info("Dropping scale update for {}, it is no longer in CF".format(requests[guid].app.name))
+                del requests[guid]
+
+    def _send(self, request):
+        self.paas_client.update(request.guid, request.instance_count)
+
+    def dispatch(self):
+        requests = dict(self.held)
+        requests.update(self.pending)
+        self.held = {}
+        self.pending = {}
+
+        futures = [(request, self.executor.submit(self._send, request)) for request in requests.values()]
+        for request, future in futures:
+            app_name = request.app.name
+            try:
+                future.result()
+            except InvalidStatusCode as e:
+                if isinstance(e.body, dict) and e.body.get("error_code") == SCALE_DISABLED_DURING_DEPLOYMENT:
+                    logging.debug("Cannot scale during deployment {}, will retry".format(app_name))
+                    # a newer decision made while we were sending wins over the held one
+                    if request.guid not in self.pending:
+                        self.held[request.guid] = request
+                else:
+                    logging.error("Failed to scale {}: {}".format(app_name, str(e)))
+                    self.metrics.inc("autoscaler_scale_updates_total", app=app_name, result="failed")
+                continue
+            except Exception as e:
+                logging.error("Failed to scale {}: {}".format(app_name, str(e)))
+                self.metrics.inc("autoscaler_scale_updates_total", app=app_name, result="failed")
+                continue
+
+            self.metrics.inc("autoscaler_scale_updates_total", app=app_name, result="ok")
+            if request.on_success is not None:
+                request.on_success()
+
+        self.metrics.set_gauge("autoscaler_scale_updates_held", len(self.held))
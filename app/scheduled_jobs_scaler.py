@@ -1,4 +1,6 @@
+import logging
 import math
+from datetime import timezone
 
 from app.base_scalers import DbQueryScaler
 
@@ -10,19 +12,88 @@ class ScheduledJobsScaler(DbQueryScaler):
 
     def __init__(self, app_name, min_instances, max_instances, **kwargs):
         super().__init__(app_name, min_instances, max_instances)
-        # Use coalesce to avoid null values when nothing is scheduled
-        # https://stackoverflow.com/a/6530371/1477072
-        query = """
+        self.threshold = kwargs["threshold"]
+        self.scheduled_items_factor = kwargs.get("scheduled_items_factor", self.scheduled_items_factor)
+        # with a horizon we look at when in the next horizon_minutes the jobs are due, minute by minute
+        self.horizon_minutes = kwargs.get("horizon_minutes")
+        # how far ahead of a job we ask for its instances, unless we have measured how long ours take to come up
+        self.instance_startup_seconds = kwargs.get("instance_startup_seconds", 120)
+        # a measurement this many times shorter than the configured startup time is more likely wrong than right
+        self.measured_startup_floor_factor = kwargs.get("measured_startup_floor_factor", 4)
+        # jobs stop being scheduled once they start, keep their instances around while they are being sent
+        self.release_after_seconds = kwargs.get("release_after_seconds", 300)
+        # start of the minute -> notifications scheduled in it
+        self.buckets = {}
+
+        if self.horizon_minutes is None:
+            # Use coalesce to avoid null values when nothing is scheduled
+            # https://stackoverflow.com/a/6530371/1477072
+            query = """
         SELECT COALESCE(SUM(notification_count), 0)
         FROM jobs
         WHERE scheduled_for - current_timestamp < interval '{}' AND
         job_status = 'scheduled';
         """
-        self.query = query.format(self.scheduled_job_lookahead)
-        self.threshold = kwargs["threshold"]
+            self.query = query.format(self.scheduled_job_lookahead)
+        else:
+            query = """
+        SELECT EXTRACT(EPOCH FROM date_trunc('minute', scheduled_for))::bigint, SUM(notification_count)
+        FROM jobs
+        WHERE scheduled_for < current_timestamp + interval '{} minutes' AND
+        job_status = 'scheduled'
+        GROUP BY 1;
+        """
+            self.query = query.format(int(self.horizon_minutes))
+
+    def _read_result(self, cursor):
+        if self.horizon_minutes is None:
+            return super()._read_result(cursor)
+        return cursor.fetchall()
 
     def _get_desired_instance_count(self):
-        scheduled_items = self.run_query()
-        scale_items = scheduled_items * self.scheduled_items_factor
-        desired_instance_count = int(math.ceil(scale_items / float(self.threshold)))
-        return desired_instance_count
+        if self.horizon_minutes is None:
+            scheduled_items = self.run_query()
+            scale_items = scheduled_items * self.scheduled_items_factor
+            desired_instance_count = int(math.ceil(scale_items / float(self.threshold)))
+            return desired_instance_count
+
+        histogram = self.run_query()
+        now = self._now().replace(tzinfo=timezone.utc).timestamp()
+        # minutes that are due drop out of the query as their jobs start, remember them until they have been sent.
+        # Future minutes always come from the query, so cancelled or rescheduled jobs are forgotten
+        self.buckets = {
+            minute: count for minute, count in self.buckets.items() if now - self.release_after_seconds <= minute <= now
+        }
+        self.buckets.update({int(minute): int(count) for minute, count in histogram})
+
+        # everything being sent or due before new instances could be up, like the lookahead query without a horizon
+        startup_seconds = self._get_startup_seconds()
+        scheduled_items = sum(
+            count
+            for minute, count in self.buckets.items()
+            if now - self.release_after_seconds <= minute <= now + startup_seconds
+        )
+        self.gauge("{}.scheduled-items".format(self.app_name), scheduled_items)
+        return int(math.ceil(scheduled_items * self.scheduled_items_factor / float(self.threshold)))
+
+    def _get_startup_seconds(self):
+        measured = (self.cf_attributes or {}).get("instance_startup_seconds")
+        if measured is None:
+            return self.instance_startup_seconds
+        if measured < self.instance_startup_seconds / float(self.measured_startup_floor_factor):
+            logging.debug(
+                "Ignoring the measured startup time of {} ({} seconds), using {} seconds".format(
+                    self.app_name, measured, self.instance_startup_seconds
+                )
+            )
+            return self.instance_startup_seconds
+        return measured
+
+    def get_state(self):
+        state = super().get_state()
+        state["buckets"] = sorted(self.buckets.items())
+        return state
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.buckets = {minute: count for minute, count in state.get("buckets", [])}
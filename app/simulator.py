@@ -0,0 +1,83 @@
+import math
+
+
+class SimulationResult:
+    def __init__(self, instances, desired, backlog):
+        self.instances = instances
+        self.desired = desired
+        self.backlog = backlog
+
+    def convergence_tick(self, target, tolerance=0, start=0):
+        """First tick from which the instance count stays within tolerance of target, None if it never settles"""
+        for tick in range(start, len(self.instances)):
+            if all(abs(count - target) <= tolerance for count in self.instances[tick:]):
+                return tick
+        return None
+
+    def overshoot(self, target, start=0):
+        return max(0, max(self.instances[start:]) - target)
+
+    def direction_changes(self, start=0):
+        changes = 0
+        last_direction = 0
+        for previous, count in zip(self.instances[start:], self.instances[start + 1 :]):
+            direction = (count > previous) - (count < previous)
+            if direction and last_direction and direction != last_direction:
+                changes += 1
+            if direction:
+                last_direction = direction
+        return changes
+
+
+def simulate(
+    policy,
+    arrivals,
+    tasks_per_instance_per_tick,
+    backlog_per_instance,
+    min_instances,
+    max_instances,
+    initial_instances=None,
+    startup_ticks=0,
+    tick_seconds=5,
+):
+    """Runs a scaling policy against a simple queue worker model.
+
+    Every tick `arrivals[tick]` tasks are put onto a queue and every running instance takes
+    `tasks_per_instance_per_tick` off it. Instances only start taking tasks `startup_ticks` after they were asked for.
+    The desired count is worked out the same way SqsScaler does it, from throughput plus the backlog, and handed to
+    `policy(current, desired, now)` which returns the instance count to ask for.
+    """
+    requested = [initial_instances or min_instances]
+    backlog = 0
+    result = SimulationResult([], [], [])
+
+    for tick, arrived in enumerate(arrivals):
+        # instances asked for less than startup_ticks ago are not running yet
+        running = min(requested[-(startup_ticks + 1) :])
+        backlog = max(0, backlog + arrived - running * tasks_per_instance_per_tick)
+
+        desired = math.ceil(arrived / tasks_per_instance_per_tick) + math.ceil(backlog / backlog_per_instance)
+        desired = max(min_instances, min(max_instances, desired))
+
+        new_instance_count = policy(requested[-1], desired, tick * tick_seconds)
+        requested.append(new_instance_count)
+
+        result.instances.append(new_instance_count)
+        result.desired.append(desired)
+        result.backlog.append(backlog)
+
+    return result
+
+
+def replay(policy, records, app_name):
+    """Runs a policy over the current and desired counts recorded in the decision journal.
+
+    Unlike simulate this is open loop: every tick starts from the instance count that was actually running, so the
+    result shows what the policy would have asked for at each point rather than where it would have taken the app.
+    """
+    result = SimulationResult([], [], [])
+    for entry in records:
+        recorded = entry["apps"][app_name]
+        result.instances.append(policy(recorded["current"], recorded["desired"], entry["timestamp"]))
+        result.desired.append(recorded["desired"])
+    return result
@@ -0,0 +1,88 @@
+import json
+import logging
+import time
+
+from app.metrics import get_metrics_registry
+
+SNAPSHOT_VERSION = 1
+# the version is part of the key, a process that doesn't understand a newer layout simply won't find it
+REDIS_SNAPSHOT_KEY = "autoscaler_snapshot:v{}".format(SNAPSHOT_VERSION)
+
+
+class StateSnapshotter:
+    """Saves the in-memory state of every app's scalers to redis every so often and restores it on startup.
+
+    Each scaler contributes what it would otherwise lose on a restart through get_state/set_state, so the first tick
+    after a deploy decides the way the old process would have. State is matched back to scalers by position and type,
+    so a scaler that was added, removed or changed in the config starts afresh instead of picking up someone else's.
+    """
+
+    def __init__(self, redis_client, interval_seconds=30, max_age_seconds=600, clock=time.time):
+        self.redis_client = redis_client
+        self.interval_seconds = interval_seconds
+        self.max_age_seconds = max_age_seconds
+        self._clock = clock
+        self.metrics = get_metrics_registry()
+        self.last_saved_at = None
+
+    def _app_state(self, app):
+        return {
+            "version": SNAPSHOT_VERSION,
+            "saved_at": self._clock(),
+            "scalers": [{"type": type(scaler).__name__, "state": scaler.get_state()} for scaler in app.scalers],
+        }
+
+    def save(self, apps):
+        started = time.monotonic()
+        snapshot = {app.key: json.dumps(self._app_state(app), separators=(",", ":")) for app in apps}
+        if not snapshot:
+            return 0
+        try:
+            self.redis_client.hset(REDIS_SNAPSHOT_KEY, mapping=snapshot)
+        except Exception as e:
+            logging.warning("Could not save the state snapshot. Error was {}".format(e))
+            return 0
+
+        self.last_saved_at = self._clock()
+        size = sum(len(state) for state in snapshot.values())
+        self.metrics.set_gauge("autoscaler_snapshot_size_bytes", size)
+        self.metrics.set_gauge("autoscaler_snapshot_save_seconds", time.monotonic() - started)
+        return size
+
+    def maybe_save(self, apps):
+        if self.last_saved_at is None or self._clock() - self.last_saved_at >= self.interval_seconds:
+            self.save(apps)
+
+    def restore(self, apps):
+        """Returns how many apps had their state restored"""
+        started = time.monotonic()
+        try:
+            snapshot = self.redis_client.hgetall(REDIS_SNAPSHOT_KEY)
+        except Exception as e:
+            logging.warning("Could not load the state snapshot. Error was {}".format(e))
+            return 0
+
+        restored = 0
+        now = self._clock()
+        for app in apps:
+            state = snapshot.get(app.key.encode())
+            if not state:
+                continue
+            state = json.loads(state)
+            if state.get("version") != SNAPSHOT_VERSION or now - state["saved_at"] > self.max_age_seconds:
+                continue
+            for scaler, scaler_state in zip(app.scalers, state["scalers"]):
+                if scaler_state["type"] == type(scaler).__name__:
+                    scaler.set_state(scaler_state["state"])
+            restored += 1
+
+        load_seconds = time.monotonic() - started
+        size = sum(len(state) for state in snapshot.values())
+        self.metrics.set_gauge("autoscaler_snapshot_size_bytes", size)
+        self.metrics.set_gauge("autoscaler_snapshot_load_seconds", load_seconds)
+        logging.info(
+            "Restored state for {} of {} apps from a {} byte snapshot in {:.1f}ms".format(
+                restored, len(apps), size, load_seconds * 1000
+            )
+        )
+        return restored
@@ -0,0 +1,68 @@
+import logging
+import math
+from datetime import timedelta
+
+from app.sqs_scaler import SqsScaler
+
+
+class SqsLatencyScaler(SqsScaler):
+    """Scales on how long messages wait on the queue rather than on how many there are.
+
+    Visible and in-flight messages are sized for with the allowed backlog per worker, and the result is scaled up in
+    proportion to how far the age of the oldest message exceeds max_message_age_seconds. SQS does not return the age as
+    a queue attribute, it comes from CloudWatch and is therefore up to a minute old.
+    """
+
+    def __init__(self, app_name, min_instances, max_instances, **kwargs):
+        super().__init__(app_name, min_instances, max_instances, **kwargs)
+        self.max_message_age_seconds = kwargs["max_message_age_seconds"]
+
+    def _get_desired_instance_count(self):
+        logging.debug("Processing {}".format(self.app_name))
+        desired_instance_count = sum(self._get_desired_instance_count_for_queue(queue) for queue in self._get_queues())
+        return desired_instance_count
+
+    def _get_desired_instance_count_for_queue(self, queue):
+        queue_name = self._get_sqs_queue_name(queue)
+        attributes = self._get_sqs_queue_attributes(queue_name)
+        visible = int(attributes["ApproximateNumberOfMessages"])
+        in_flight = int(attributes["ApproximateNumberOfMessagesNotVisible"])
+        oldest_message_age = self._get_age_of_oldest_message(queue_name)
+        logging.debug(
+            "Queue {}: {} visible, {} in flight, oldest message {} seconds".format(
+                queue_name, visible, in_flight, oldest_message_age
+            )
+        )
+        self.gauge("{}.queue-length".format(queue_name), visible)
+        self.gauge("{}.in-flight".format(queue_name), in_flight)
+        self.gauge("{}.oldest-message-age".format(queue_name), oldest_message_age)
+
+        instances_for_backlog = (visible + in_flight) / float(self.queue_length_threshold)
+        latency_factor = max(1.0, oldest_message_age / float(self.max_message_age_seconds))
+        return int(math.ceil(instances_for_backlog * latency_factor))
+
+    def _get_age_of_oldest_message(self, name):
+        self._init_cloudwatch_client()
+        start_time = self._now() - timedelta(**self.request_count_time_range)
+        end_time = self._now()
+        result = self.signal_cache.get(
+            "cloudwatch",
+            ("ApproximateAgeOfOldestMessage", name, str(self.request_count_time_range)),
+            lambda: self.cloudwatch_client.get_metric_statistics(
+                Namespace="AWS/SQS",
+                MetricName="ApproximateAgeOfOldestMessage",
+                Dimensions=[
+                    {"Name": "QueueName", "Value": name},
+                ],
+                StartTime=start_time,
+                EndTime=end_time,
+                Period=60,
+                Statistics=["Maximum"],
+                Unit="Seconds",
+            ),
+        )
+        datapoints = sorted(result["Datapoints"], key=lambda x: x["Timestamp"])
+        if len(datapoints) == 0:
+            return 0
+        # only the latest minute matters, an old spike that has since drained is no reason to scale
+        return datapoints[-1]["Maximum"]
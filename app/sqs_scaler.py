@@ -1,36 +1,178 @@
+import fnmatch
 import logging
 import math
+import threading
+from collections import deque
 from datetime import timedelta
 
 from app.base_scalers import AwsBaseScaler
+from app.calibration import ThroughputCalibrator
 from app.config import config
+from app.exceptions import SourceUnavailable
+from app.utils import get_redis_client, is_pattern
+from app.window_statistics import build_statistic
 
 # calculated by looking at log output of a single instance of delivery-worker-save-api-notifications on production
 # during high load
 THROUGHPUT_OF_TASKS_PER_WORKER_PER_MINUTE = 1000
 
+SQS_QUEUE_ATTRIBUTES = ["ApproximateNumberOfMessages", "ApproximateNumberOfMessagesNotVisible"]
+# the most queue urls a ListQueues page can return
+LIST_QUEUES_PAGE_SIZE = 1000
+
+
+class SqsQueueIndex:
+    """The names of every queue in a region starting with the queue prefix, listed with paginated ListQueues.
+
+    After the first listing a background thread lists them again every refresh_seconds, so matching queue patterns on
+    a tick never waits on ListQueues. `version` goes up whenever the names change.
+    """
+
+    def __init__(self, sqs_client, prefix, refresh_seconds):
+        self.sqs_client = sqs_client
+        self.prefix = prefix
+        self.refresh_seconds = refresh_seconds
+        self.names = None
+        self.version = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        names = set()
+        kwargs = {"MaxResults": LIST_QUEUES_PAGE_SIZE}
+        if self.prefix:
+            kwargs["QueueNamePrefix"] = self.prefix
+        while True:
+            response = self.sqs_client.list_queues(**kwargs)
+            names.update(url.rsplit("/", 1)[-1] for url in response.get("QueueUrls", []))
+            if not response.get("NextToken"):
+                break
+            kwargs["NextToken"] = response["NextToken"]
+
+        names = sorted(names)
+        with self._lock:
+            if names != self.names:
+                logging.info("Found {} SQS queues starting with {!r}".format(len(names), self.prefix))
+                self.names = names
+                self.version += 1
+
+    def _refresh_loop(self):
+        while not self._stopped.wait(self.refresh_seconds):
+            try:
+                self.refresh()
+            except Exception as e:
+                # keep matching against the names we have, new queues are only picked up a little later
+                logging.warning("Could not list SQS queues: {}".format(e))
+
+    def start(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logging.warning("Could not list SQS queues: {}".format(e))
+        self._thread = threading.Thread(target=self._refresh_loop, name="sqs-queue-index", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def match(self, pattern):
+        return [name for name in self.names or [] if fnmatch.fnmatchcase(name, pattern)]
+
+
+# one index per region, shared by every SqsScaler with a queue pattern
+_queue_indexes = {}
+_queue_indexes_lock = threading.Lock()
+
+
+def get_queue_index(aws_region, create_sqs_client):
+    with _queue_indexes_lock:
+        if aws_region not in _queue_indexes:
+            _queue_indexes[aws_region] = SqsQueueIndex(
+                create_sqs_client(),
+                config["SCALERS"]["SQS_QUEUE_PREFIX"],
+                config["SCALERS"].get("SQS_QUEUE_DISCOVERY_INTERVAL_SECONDS", 300),
+            ).start()
+    return _queue_indexes[aws_region]
+
+
+def reset_queue_indexes():
+    with _queue_indexes_lock:
+        for index in _queue_indexes.values():
+            index.stop()
+        _queue_indexes.clear()
+
 
 class SqsScaler(AwsBaseScaler):
+    """Scales on the messages waiting in, and being sent to, a list of SQS queues.
+
+    Queues are named without SQS_QUEUE_PREFIX. A name can be a pattern like "send-*-tasks", which picks up every queue
+    in the region it matches, from an index of queue names kept up to date in the background.
+    """
+
     def __init__(self, app_name, min_instances, max_instances, **kwargs):
         super().__init__(app_name, min_instances, max_instances, kwargs.get("aws_region"))
         self.queue_length_threshold = kwargs.get("threshold") or kwargs["allowed_queue_backlog_per_worker"]
         self.throughput_threshold = kwargs.get("tasks_per_worker_per_minute", THROUGHPUT_OF_TASKS_PER_WORKER_PER_MINUTE)
         self.queues = kwargs["queues"] if isinstance(kwargs["queues"], list) else [kwargs["queues"]]
         self.sqs_queue_prefix = config["SCALERS"]["SQS_QUEUE_PREFIX"]
+        # what the patterns in queues matched, worked out again only when the queue index changes
+        self.matched_queues = None
+        self.matched_version = None
         self.request_count_time_range = kwargs.get("request_count_time_range", {"minutes": 5})
+        # how quickly a backlog should be worked off, instead of a fixed backlog per worker
+        self.backlog_drain_seconds = kwargs.get("backlog_drain_seconds")
+        self.calibrator = ThroughputCalibrator(app_name) if kwargs.get("auto_calibrate") else None
+        self.last_calibration_minute = None
+        # the workers only count as saturated once the backlog has been large or growing for this many minutes
+        self.backlog_history = deque(maxlen=kwargs.get("calibration_minutes", 3))
+        # how far the calibrated throughput may move away from tasks_per_worker_per_minute, either way
+        self.calibration_max_adjustment = kwargs.get("calibration_max_adjustment", 2)
+        # applied to the throughput of tasks put onto each queue, every queue keeps its own state
+        self.statistic_config = kwargs.get("statistic")
+        # a bad statistic should fail when the config is loaded, not on the first tick
+        self.statistic_window = int(timedelta(**self.request_count_time_range).total_seconds() // 60)
+        build_statistic(self.statistic_config, self.statistic_window)
+        self.statistics = {}
         self.sqs_client = None
         self.cloudwatch_client = None
+        self.redis_client = None
 
     def _init_sqs_client(self):
         if self.sqs_client is None:
             self.sqs_client = super()._get_boto3_client("sqs", region_name=self.aws_region)
 
+    def _get_queues(self):
+        patterns = [queue for queue in self.queues if is_pattern(queue)]
+        if not patterns:
+            return self.queues
+
+        index = get_queue_index(self.aws_region, lambda: self._get_boto3_client("sqs", region_name=self.aws_region))
+        if index.names is None:
+            raise SourceUnavailable("No list of SQS queues to match {} against yet".format(patterns))
+        if index.version != self.matched_version:
+            queues = []
+            for queue in self.queues:
+                if not is_pattern(queue):
+                    queues.append(queue)
+                    continue
+                for name in index.match(self._get_sqs_queue_name(queue)):
+                    queues.append(name[len(self.sqs_queue_prefix) :])
+            # a queue matched by more than one pattern only counts once
+            self.matched_queues = list(dict.fromkeys(queues))
+            self.matched_version = index.version
+            logging.debug("Queues for {}: {}".format(self.app_name, self.matched_queues))
+        return self.matched_queues
+
     def _init_cloudwatch_client(self):
         if self.cloudwatch_client is None:
             self.cloudwatch_client = super()._get_boto3_client("cloudwatch", region_name=self.aws_region)
 
     def _get_desired_instance_count(self):
         logging.debug("Processing {}".format(self.app_name))
+        if self.calibrator is not None:
+            self._update_calibration()
         instance_count_throughput = self._get_desired_instance_count_based_on_throughput_of_tasks_put_onto_queues()
         instance_count_queue_length = self._get_desired_instance_count_based_on_current_queue_length()
 
@@ -45,30 +187,122 @@ class SqsScaler(AwsBaseScaler):
         return instance_count_throughput + instance_count_queue_length
 
     def _get_desired_instance_count_based_on_current_queue_length(self):
-        total_message_count = self._get_total_message_count(self.queues)
+        total_message_count = self._get_total_message_count(self._get_queues())
         logging.debug("Total message count: {}".format(total_message_count))
-        desired_instance_count = int(math.ceil(total_message_count / float(self.queue_length_threshold)))
+        if self.backlog_drain_seconds:
+            backlog_per_worker = self._get_tasks_per_worker_per_minute() * self.backlog_drain_seconds / 60.0
+        else:
+            backlog_per_worker = self.queue_length_threshold
+        desired_instance_count = int(math.ceil(total_message_count / float(backlog_per_worker)))
         return desired_instance_count
 
     def _get_desired_instance_count_based_on_throughput_of_tasks_put_onto_queues(self):
-        total_throughput = self._get_total_throughput_of_tasks_put_onto_queues(self.queues)
+        total_throughput = self._get_total_throughput_of_tasks_put_onto_queues(self._get_queues())
         logging.debug("Total throughput: {}".format(total_throughput))
-        desired_instance_count = int(math.ceil(total_throughput / float(self.throughput_threshold)))
+        desired_instance_count = int(math.ceil(total_throughput / float(self._get_tasks_per_worker_per_minute())))
         return desired_instance_count
 
+    def _get_tasks_per_worker_per_minute(self):
+        if self.calibrator is not None and self.calibrator.estimate is not None:
+            lowest = self.throughput_threshold / float(self.calibration_max_adjustment)
+            highest = self.throughput_threshold * self.calibration_max_adjustment
+            return min(highest, max(lowest, self.calibrator.estimate))
+        return self.throughput_threshold
+
+    def _get_statistic(self, queue_name):
+        if queue_name not in self.statistics:
+            self.statistics[queue_name] = build_statistic(self.statistic_config, self.statistic_window)
+        return self.statistics[queue_name]
+
+    def get_state(self):
+        state = super().get_state()
+        state["statistics"] = {name: statistic.get_state() for name, statistic in self.statistics.items()}
+        if self.calibrator is not None:
+            state["calibration_samples"] = list(self.calibrator.samples)
+        return state
+
+    def set_state(self, state):
+        super().set_state(state)
+        for name, statistic_state in state.get("statistics", {}).items():
+            self._get_statistic(name).set_state(statistic_state)
+        if self.calibrator is not None and "calibration_samples" in state:
+            self.calibrator.samples.clear()
+            self.calibrator.samples.extend(state["calibration_samples"])
+            self.calibrator.state_loaded = True
+
+    def _get_redis_client(self):
+        if self.redis_client is None:
+            self.redis_client = get_redis_client()
+        return self.redis_client
+
+    def _update_calibration(self):
+        if not self.calibrator.state_loaded:
+            self.calibrator.load_state(self._get_redis_client())
+
+        # CloudWatch gives us one datapoint a minute, more than one sample per minute would only repeat it
+        minute = self._now().replace(second=0, microsecond=0)
+        if minute == self.last_calibration_minute:
+            return
+        self.last_calibration_minute = minute
+
+        # instances that are still starting aren't taking work off the queue yet
+        cf_attributes = self.cf_attributes or {}
+        running_instances = cf_attributes.get("ready_instances", cf_attributes.get("instances"))
+        if not running_instances:
+            return
+
+        queue_names = [self._get_sqs_queue_name(queue) for queue in self._get_queues()]
+        self.backlog_history.append(sum(self._get_sqs_message_count(name) for name in queue_names))
+        # with a small, steady backlog the workers keep up with the traffic, what they receive is only what is sent
+        # and says nothing about what they could do
+        if not self._workers_saturated(running_instances):
+            return
+
+        received = 0
+        for name in queue_names:
+            datapoints = self._get_sqs_throughput_of_tasks_pulled_from_queue(name)
+            # the newest datapoint is often a minute still in progress, sample the last complete one
+            received += datapoints[-2] if len(datapoints) > 1 else 0
+        if received == 0:
+            return
+
+        self.calibrator.add_sample(received / float(running_instances))
+        self.calibrator.save_state(self._get_redis_client())
+        if self.calibrator.estimate is not None:
+            estimate = self._get_tasks_per_worker_per_minute()
+            logging.debug(
+                "Calibrated throughput for {}: {} tasks per worker per minute".format(self.app_name, estimate)
+            )
+            self.gauge("{}.calibrated-tasks-per-worker-per-minute".format(self.app_name), estimate)
+
+    def _workers_saturated(self, running_instances):
+        history = list(self.backlog_history)
+        if len(history) < self.backlog_history.maxlen:
+            return False
+        over_threshold = all(backlog >= self.queue_length_threshold * running_instances for backlog in history)
+        growing = all(later > earlier for earlier, later in zip(history, history[1:]))
+        return over_threshold or growing
+
     def _get_sqs_queue_name(self, name):
         return "{}{}".format(self.sqs_queue_prefix, name)
 
     def _get_sqs_queue_url(self, name):
         return "https://sqs.{}.amazonaws.com/{}/{}".format(self.aws_region, self.aws_account_id, name)
 
-    def _get_sqs_message_count(self, name):
-        # Number of visible messages waiting in the queue to be picked up
+    def _get_sqs_queue_attributes(self, name):
+        # Every scaler reading a queue asks for the same attributes, so one cached response serves all of them
         self._init_sqs_client()
-        response = self.sqs_client.get_queue_attributes(
-            QueueUrl=self._get_sqs_queue_url(name), AttributeNames=["ApproximateNumberOfMessages"]
+        queue_url = self._get_sqs_queue_url(name)
+        response = self.signal_cache.get(
+            "sqs",
+            queue_url,
+            lambda: self.sqs_client.get_queue_attributes(QueueUrl=queue_url, AttributeNames=SQS_QUEUE_ATTRIBUTES),
         )
-        result = int(response["Attributes"]["ApproximateNumberOfMessages"])
+        return response["Attributes"]
+
+    def _get_sqs_message_count(self, name):
+        # Number of visible messages waiting in the queue to be picked up
+        result = int(self._get_sqs_queue_attributes(name)["ApproximateNumberOfMessages"])
         logging.debug("Messages in {}: {}".format(name, result))
         return result
 
@@ -85,33 +319,36 @@ class SqsScaler(AwsBaseScaler):
         self._init_cloudwatch_client()
         start_time = self._now() - timedelta(**self.request_count_time_range)
         end_time = self._now()
-        result = self.cloudwatch_client.get_metric_statistics(
-            Namespace="AWS/SQS",
-            MetricName="NumberOfMessagesSent",
-            Dimensions=[
-                {"Name": "QueueName", "Value": name},
-            ],
-            StartTime=start_time,
-            EndTime=end_time,
-            Period=60,
-            Statistics=["Sum"],
-            Unit="Count",
+        result = self.signal_cache.get(
+            "cloudwatch",
+            ("NumberOfMessagesSent", name, str(self.request_count_time_range)),
+            lambda: self.cloudwatch_client.get_metric_statistics(
+                Namespace="AWS/SQS",
+                MetricName="NumberOfMessagesSent",
+                Dimensions=[
+                    {"Name": "QueueName", "Value": name},
+                ],
+                StartTime=start_time,
+                EndTime=end_time,
+                Period=60,
+                Statistics=["Sum"],
+                Unit="Count",
+            ),
         )
         datapoints = result["Datapoints"]
         datapoints = sorted(datapoints, key=lambda x: x["Timestamp"])
-        return [row["Sum"] for row in datapoints]
+        return [(row["Timestamp"], row["Sum"]) for row in datapoints]
 
     def _get_throughput_of_tasks_put_onto_queue(self, queue):
         queue_name = self._get_sqs_queue_name(queue)
-        past_5_mins_of_throughput = self._get_sqs_throughput_of_tasks_put_onto_queue(queue_name)
-
-        if len(past_5_mins_of_throughput) == 0:
-            past_5_mins_of_throughput = [0]
+        datapoints = self._get_sqs_throughput_of_tasks_put_onto_queue(queue_name)
+        past_5_mins_of_throughput = [value for _, value in datapoints] or [0]
         logging.debug("Throughput of tasks put onto queue: {}".format(past_5_mins_of_throughput))
 
-        # Keep the highest throughput over the specified time range
-        highest_throughput = max(past_5_mins_of_throughput)
-        logging.debug("Highest throughput of tasks put onto queue: {}".format(highest_throughput))
+        # Keep the highest throughput over the specified time range, unless another statistic is configured
+        statistic = self._get_statistic(queue_name)
+        highest_throughput = statistic.summarise(datapoints)
+        logging.debug("Throughput of tasks put onto queue ({}): {}".format(statistic.name, highest_throughput))
 
         self.gauge("{}.queue-throughput".format(queue_name), past_5_mins_of_throughput[-1])
         return highest_throughput
@@ -123,17 +360,21 @@ class SqsScaler(AwsBaseScaler):
         self._init_cloudwatch_client()
         start_time = self._now() - timedelta(**self.request_count_time_range)
         end_time = self._now()
-        result = self.cloudwatch_client.get_metric_statistics(
-            Namespace="AWS/SQS",
-            MetricName="NumberOfMessagesReceived",
-            Dimensions=[
-                {"Name": "QueueName", "Value": name},
-            ],
-            StartTime=start_time,
-            EndTime=end_time,
-            Period=60,
-            Statistics=["Sum"],
-            Unit="Count",
+        result = self.signal_cache.get(
+            "cloudwatch",
+            ("NumberOfMessagesReceived", name, str(self.request_count_time_range)),
+            lambda: self.cloudwatch_client.get_metric_statistics(
+                Namespace="AWS/SQS",
+                MetricName="NumberOfMessagesReceived",
+                Dimensions=[
+                    {"Name": "QueueName", "Value": name},
+                ],
+                StartTime=start_time,
+                EndTime=end_time,
+                Period=60,
+                Statistics=["Sum"],
+                Unit="Count",
+            ),
         )
         datapoints = result["Datapoints"]
         datapoints = sorted(datapoints, key=lambda x: x["Timestamp"])
@@ -155,5 +396,5 @@ class SqsScaler(AwsBaseScaler):
         return highest_throughput
 
     def _publish_metrics_for_throughput_of_tasks_pulled_from_queues(self):
-        for queue in self.queues:
+        for queue in self._get_queues():
             self._get_throughput_of_tasks_pulled_from_queue(queue)
@@ -0,0 +1,97 @@
+import logging
+
+from app.exceptions import CannotLoadConfig
+
+
+class AdaptiveTickInterval:
+    """Works out how long to wait before the next tick from how much the last ones saw change.
+
+    Any scaler input (queue depth, request count, CPU...) rising by more than `rise_threshold` of its previous value per
+    second, or any app being scaled, brings the interval straight down to `min_seconds` so a burst is followed closely.
+    After `stable_ticks` ticks in a row where no input moved by more than `min_change` and no desired count changed, the
+    interval grows by `growth_factor` up to `max_seconds`, so an idle night costs far fewer API calls. Anything in
+    between goes back to the base interval.
+    """
+
+    def __init__(
+        self,
+        base_seconds,
+        min_seconds,
+        max_seconds,
+        stable_ticks=3,
+        growth_factor=1.5,
+        rise_threshold=0.1,
+        min_change=1,
+    ):
+        if not 0 < min_seconds <= base_seconds <= max_seconds:
+            raise CannotLoadConfig(
+                "Tick interval bounds must satisfy 0 < min ({}) <= base ({}) <= max ({})".format(
+                    min_seconds, base_seconds, max_seconds
+                )
+            )
+        if growth_factor <= 1:
+            raise CannotLoadConfig("The tick interval growth factor must be more than 1")
+        self.base_seconds = base_seconds
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self.stable_ticks = stable_ticks
+        self.growth_factor = growth_factor
+        self.rise_threshold = rise_threshold
+        self.min_change = min_change
+        self.interval_seconds = base_seconds
+        self.stable_for = 0
+        self.last_inputs = {}
+        self.last_desired = {}
+        self.last_tick_at = None
+
+    def _rising_fast(self, inputs, elapsed):
+        for key, value in inputs.items():
+            previous = self.last_inputs.get(key)
+            if previous is None or value - previous <= self.min_change:
+                continue
+            # relative to where it was, a queue going from 10 to 100 matters as much as one from 1000 to 10000
+            if (value - previous) / max(abs(previous), self.min_change) / elapsed > self.rise_threshold:
+                logging.debug("{} rose from {} to {} in {:.1f} seconds".format(key, previous, value, elapsed))
+                return True
+        return False
+
+    def _unchanged(self, inputs, desired):
+        if desired != self.last_desired or inputs.keys() != self.last_inputs.keys():
+            return False
+        return all(abs(value - self.last_inputs[key]) <= self.min_change for key, value in inputs.items())
+
+    def next_interval(self, inputs, desired, scaled, now):
+        """inputs maps each numeric scaler input to what it read this tick, desired each app to its desired count"""
+        elapsed = max(now - self.last_tick_at, 1e-3) if self.last_tick_at is not None else self.interval_seconds
+
+        if scaled or self._rising_fast(inputs, elapsed):
+            self.stable_for = 0
+            self.interval_seconds = self.min_seconds
+        elif self._unchanged(inputs, desired):
+            self.stable_for += 1
+            if self.stable_for >= self.stable_ticks:
+                self.interval_seconds = min(
+                    self.max_seconds, max(self.base_seconds, self.interval_seconds) * self.growth_factor
+                )
+        else:
+            self.stable_for = 0
+            self.interval_seconds = self.base_seconds
+
+        self.last_inputs = inputs
+        self.last_desired = desired
+        self.last_tick_at = now
+        return self.interval_seconds
+
+
+def build_tick_interval(base_seconds, settings):
+    if not settings:
+        return None
+    return AdaptiveTickInterval(
+        base_seconds,
+        settings.get("MIN_SECONDS", base_seconds),
+        settings.get("MAX_SECONDS", base_seconds),
+        stable_ticks=settings.get("STABLE_TICKS", 3),
+        growth_factor=settings.get("GROWTH_FACTOR", 1.5),
+        rise_threshold=settings.get("RISE_THRESHOLD", 0.1),
+        min_change=settings.get("MIN_CHANGE", 1),
+    )
@@ -1,4 +1,6 @@
+import importlib.util
 import os
+import sys
 
 from notifications_utils.clients.statsd.statsd_client import StatsdClient
 
@@ -26,3 +28,46 @@ _statsd_wrapper = _StatsdWrapper()
 
 def get_statsd_client():
     return _statsd_wrapper.statsd_client
+
+
+def get_redis_url():
+    if "REDIS_URL" in os.environ:
+        return os.environ["REDIS_URL"]
+    return "redis://redis.local"
+
+
+_redis_client = None
+
+
+def get_redis_client():
+    # shared by the scalers that keep state in redis, created on first use so nothing connects at import time
+    global _redis_client
+    if _redis_client is None:
+        from redis import Redis
+
+        _redis_client = Redis.from_url(get_redis_url())
+    return _redis_client
+
+
+PATTERN_CHARACTERS = set("*?[")
+
+
+def is_pattern(name):
+    """Whether a configured queue name is a glob style pattern rather than the name of one queue"""
+    return bool(PATTERN_CHARACTERS & set(name))
+
+
+def lazy_import(name):
+    """Returns a module that is only actually imported the first time one of its attributes is used.
+
+    For heavy SDKs that only some scalers need, so a deployment that doesn't use them doesn't pay for loading them.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,179 @@
+from array import array
+from bisect import bisect_left, insort
+
+from app.exceptions import CannotLoadApp
+
+
+class WindowStatistic:
+    """Boils a window of per-minute (timestamp, value) datapoints, oldest first, down to the value a scaler sizes for.
+
+    The window is fetched again on every tick. Stateful statistics take each datapoint once, going by its timestamp,
+    after seeding themselves with the whole window on first use. The newest datapoint can be a minute still in progress
+    whose value grows until it is over, so it is only taken once a later one shows up and until then only counts
+    provisionally. An empty window (nothing published yet) adds nothing. State is kept in fixed-size fields, so memory
+    doesn't grow with the length of the history.
+    """
+
+    name = None
+
+    def __init__(self):
+        self.last_timestamp = None
+        # restored state already covers everything but the newest datapoint of the next window
+        self.restored = False
+
+    def summarise(self, datapoints):
+        if self.restored and self.last_timestamp is None and len(datapoints) > 1:
+            self.last_timestamp = datapoints[-2][0]
+        for timestamp, value in datapoints[:-1]:
+            if self._is_new(timestamp):
+                self.add(value)
+                self.last_timestamp = timestamp
+        pending = [value for timestamp, value in datapoints[-1:] if self._is_new(timestamp)]
+        return self.value([value for _, value in datapoints], pending)
+
+    def _is_new(self, timestamp):
+        return self.last_timestamp is None or timestamp > self.last_timestamp
+
+    def add(self, value):
+        pass
+
+    def value(self, values, pending):
+        raise NotImplementedError
+
+    def get_state(self):
+        return {}
+
+    def set_state(self, state):
+        pass
+
+
+class MaxStatistic(WindowStatistic):
+    name = "max"
+
+    def value(self, values, pending):
+        return max(values, default=0)
+
+
+class TrimmedMaxStatistic(WindowStatistic):
+    """The highest value once the `trim` highest ones have been dropped, so a single spiky minute is ignored"""
+
+    name = "trimmed_max"
+
+    def __init__(self, trim=1):
+        super().__init__()
+        self.trim = trim
+
+    def value(self, values, pending):
+        if len(values) <= self.trim:
+            return max(values, default=0)
+        return sorted(values)[-(self.trim + 1)]
+
+
+class EwmaStatistic(WindowStatistic):
+    name = "ewma"
+
+    def __init__(self, alpha=0.3):
+        super().__init__()
+        self.alpha = float(alpha)
+        self.average = None
+
+    def _blend(self, average, value):
+        if average is None:
+            return float(value)
+        return self.alpha * value + (1 - self.alpha) * average
+
+    def add(self, value):
+        self.average = self._blend(self.average, value)
+
+    def value(self, values, pending):
+        average = self.average
+        for value in pending:
+            average = self._blend(average, value)
+        return average if average is not None else 0
+
+    def get_state(self):
+        return {"average": self.average}
+
+    def set_state(self, state):
+        self.average = state.get("average")
+        self.restored = True
+
+
+class PercentileStatistic(WindowStatistic):
+    """Nearest rank percentile over the last `window` per-minute datapoints.
+
+    The datapoints are kept in arrival order in a ring buffer, and also in a sorted array that is updated as datapoints
+    come and go, so a tick doesn't sort the window again.
+    """
+
+    name = "percentile"
+
+    def __init__(self, percentile=90, window=5):
+        super().__init__()
+        self.percentile = percentile
+        self.buffer = array("d", [0.0] * window)
+        self.ordered = array("d")
+        self.count = 0
+        self.position = 0
+
+    def add(self, value):
+        if self.count == len(self.buffer):
+            del self.ordered[bisect_left(self.ordered, self.buffer[self.position])]
+        insort(self.ordered, value)
+        self.buffer[self.position] = value
+        self.position = (self.position + 1) % len(self.buffer)
+        self.count = min(self.count + 1, len(self.buffer))
+
+    def _values(self):
+        # oldest first
+        if self.count < len(self.buffer):
+            return list(self.buffer[: self.count])
+        return list(self.buffer[self.position :]) + list(self.buffer[: self.position])
+
+    def value(self, values, pending):
+        ordered = self.ordered
+        if pending:
+            # the minute in progress counts in place of the oldest one, without being taken yet
+            ordered = array("d", ordered)
+            if self.count == len(self.buffer):
+                del ordered[bisect_left(ordered, self.buffer[self.position])]
+            insort(ordered, pending[-1])
+        if not ordered:
+            return 0
+        rank = max(1, -(-self.percentile * len(ordered) // 100))
+        return ordered[int(rank) - 1]
+
+    def get_state(self):
+        return {"values": self._values()}
+
+    def set_state(self, state):
+        for value in state.get("values", [])[-len(self.buffer) :]:
+            self.add(value)
+        self.restored = True
+
+
+STATISTICS = {
+    statistic.name: statistic for statistic in [MaxStatistic, TrimmedMaxStatistic, EwmaStatistic, PercentileStatistic]
+}
+
+
+def build_statistic(statistic_config=None, window=5):
+    """From the scaler's `statistic` option, either a name or a dict with a `type` and its parameters.
+
+    `window` is how many per-minute datapoints the scaler fetches, statistics that keep a history keep that many.
+    """
+    if not statistic_config:
+        # what scalers have always done
+        return MaxStatistic()
+    if isinstance(statistic_config, str):
+        statistic_config = {"type": statistic_config}
+    statistic_config = dict(statistic_config)
+    statistic_type = statistic_config.pop("type")
+    if statistic_type not in STATISTICS:
+        raise CannotLoadApp("Unknown statistic {}".format(statistic_type))
+    if statistic_type == PercentileStatistic.name:
+        statistic_config["window"] = window
+    try:
+        return STATISTICS[statistic_type](**statistic_config)
+    except TypeError as e:
+        raise CannotLoadApp("Bad parameters for the {} statistic: {}".format(statistic_type, e)) from e
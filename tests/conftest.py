@@ -0,0 +1,30 @@
+import pytest
+
+from app.base_scalers import reset_aws_account_ids
+from app.cf_session import reset_cf_sessions
+from app.circuit_breaker import reset_circuit_breakers
+from app.polling import get_signal_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_signal_cache():
+    # the cache is shared by the whole process, don't let values fetched in one test leak into another
+    get_signal_cache().clear()
+    yield
+    get_signal_cache().clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_circuit_breakers():
+    reset_circuit_breakers()
+    yield
+    reset_circuit_breakers()
+
+
+@pytest.fixture(autouse=True)
+def clear_sessions():
+    reset_cf_sessions()
+    reset_aws_account_ids()
+    yield
+    reset_cf_sessions()
+    reset_aws_account_ids()
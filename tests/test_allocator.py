@@ -0,0 +1,97 @@
+from unittest.mock import patch
+
+import pytest
+
+from app.allocator import BudgetAllocator, BudgetRequest, water_fill
+from app.app import App
+from app.exceptions import CannotLoadApp
+
+
+class TestWaterFill:
+    def test_everyone_satisfied_when_there_is_enough(self):
+        assert water_fill([(3, 1, 1), (5, 1, 1)], 10) == [3, 5]
+
+    def test_split_by_weight(self):
+        assert water_fill([(10, 1, 1), (10, 3, 1)], 8) == [2, 6]
+
+    def test_small_demands_are_met_and_the_rest_shared(self):
+        assert water_fill([(1, 1, 1), (10, 1, 1), (10, 1, 1)], 9) == [1, 4, 4]
+
+    def test_cost_per_instance(self):
+        # same level for both, the second app's instances use twice as much of the budget
+        assert water_fill([(10, 1, 1), (10, 1, 2)], 9) == [3, 3]
+
+    def test_nothing_available(self):
+        assert water_fill([(3, 1, 1)], 0) == [0]
+
+
+@patch("app.allocator.get_metrics_registry")
+class TestBudgetAllocator:
+    def test_everyone_gets_what_they_want_within_budget(self, _):
+        allocator = BudgetAllocator(20)
+        requests = [BudgetRequest("app-1", 5, 5, 2), BudgetRequest("app-2", 6, 6, 2)]
+        assert allocator.allocate(requests) == {"app-1": 5, "app-2": 6}
+
+    def test_min_instances_are_guaranteed(self, _):
+        allocator = BudgetAllocator(4)
+        requests = [BudgetRequest("app-1", 5, 3, 3), BudgetRequest("app-2", 6, 3, 3)]
+        assert allocator.allocate(requests) == {"app-1": 3, "app-2": 3}
+
+    def test_higher_priority_is_served_first(self, _):
+        allocator = BudgetAllocator(10)
+        requests = [
+            BudgetRequest("low", 8, 1, 1, priority=0),
+            BudgetRequest("high", 8, 1, 1, priority=5),
+        ]
+        assert allocator.allocate(requests) == {"low": 2, "high": 8}
+
+    def test_same_priority_split_by_weight_in_whole_instances(self, _):
+        allocator = BudgetAllocator(11)
+        requests = [
+            BudgetRequest("app-1", 20, 1, 1, weight=1),
+            BudgetRequest("app-2", 20, 1, 1, weight=2),
+        ]
+        allocations = allocator.allocate(requests)
+        assert sum(allocations.values()) == 11
+        assert allocations == {"app-1": 4, "app-2": 7}
+
+    def test_budget_an_expensive_app_cannot_use_goes_to_cheaper_ones(self, _):
+        allocator = BudgetAllocator(10)
+        requests = [
+            BudgetRequest("a", 8, 1, 1, cost=5),
+            BudgetRequest("b", 8, 1, 1, cost=1),
+        ]
+        # another instance of a would cost 5 but only 4 are left, b takes all of them
+        assert allocator.allocate(requests) == {"a": 1, "b": 5}
+
+    def test_connection_budget(self, _):
+        allocator = BudgetAllocator(100)
+        requests = [
+            BudgetRequest("api", 20, 1, 1, cost=10),
+            BudgetRequest("frontend", 20, 1, 1, cost=0),
+        ]
+        assert allocator.allocate(requests) == {"api": 10, "frontend": 20}
+
+    def test_growth_waits_for_budget_held_by_apps_scaling_down(self, _):
+        allocator = BudgetAllocator(10)
+        requests = [
+            BudgetRequest("high", 8, 2, 1, priority=5),
+            # still running 7, it gives them back one cooldown at a time
+            BudgetRequest("low", 7, 7, 1, priority=0),
+        ]
+        assert allocator.allocate(requests) == {"high": 3, "low": 2}
+
+    def test_exports_allocations_and_denied_demand(self, mock_get_metrics_registry):
+        allocator = BudgetAllocator(6)
+        allocator.allocate([BudgetRequest("app-1", 10, 6, 2)])
+
+        metrics = mock_get_metrics_registry.return_value
+        metrics.set_gauge.assert_any_call("autoscaler_budget_allocation", 6, app="app-1")
+        metrics.set_gauge.assert_any_call("autoscaler_budget_denied_instances", 4, app="app-1")
+        metrics.set_gauge.assert_any_call("autoscaler_budget_allocated", 6)
+
+
+@pytest.mark.parametrize("budget", [{"weight": 0}, {"cost": -1}])
+def test_app_rejects_invalid_budget(budget):
+    with pytest.raises(CannotLoadApp):
+        App("app-1", 1, 2, [], budget=budget)
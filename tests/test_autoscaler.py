@@ -5,14 +5,22 @@ from http import HTTPStatus
 from unittest.mock import Mock, patch
 
 import fakeredis
+import pytest
 import yaml
 from cloudfoundry_client.errors import InvalidStatusCode
 from freezegun import freeze_time
 
+from app.allocator import BudgetAllocator
 from app.app import App
 from app.autoscaler import Autoscaler
 from app.base_scalers import AwsBaseScaler
+from app.config import config
 from app.elb_scaler import ElbScaler
+from app.exceptions import CannotLoadConfig, CfAuthUnavailable
+from app.journal import DecisionJournal, read_journal
+from app.paas_client import PaasClient
+from app.polling import get_signal_cache
+from app.scale_dispatcher import ScaleRequest
 
 SCALEUP_COOLDOWN_SECONDS = 300
 SCALEDOWN_COOLDOWN_SECONDS = 60
@@ -30,7 +38,12 @@ class TestScale:
     def _get_mock_app(self, name, paas_client_attributes):
         app = Mock()
         app.name = name
+        app.key = name
+        app.org, app.space = "govuk-notify", "test"
         app.cf_attributes = paas_client_attributes
+        app.controller = None
+        app.inputs_stale = False
+        app.upstream = []
 
         return app
 
@@ -43,6 +56,7 @@ class TestScale:
 
         autoscaler = Autoscaler()
         autoscaler.scale(app)
+        autoscaler.scale_dispatcher.dispatch()
         mock_get_statsd_client.return_value.gauge.assert_called_once_with("{}.instance-count".format(app_name), 4)
         mock_paas_client.return_value.assert_not_called()
 
@@ -55,9 +69,11 @@ class TestScale:
 
         autoscaler = Autoscaler()
         autoscaler.scale(app)
+        autoscaler.scale_dispatcher.dispatch()
         assert float(autoscaler.redis_client.hget("last_scale_up", app_name)) == self._now()
         mock_get_statsd_client.return_value.gauge.assert_called_once_with("{}.instance-count".format(app_name), 6)
         mock_paas_client.return_value.update.assert_called_once_with(app_guid, 6)
+        assert cf_info["instances"] == 6
 
     def test_scale_paas_app_much_fewer_instances(self, mock_get_statsd_client, mock_paas_client, *args):
         """We don't scale down more than 1 instance at a time"""
@@ -75,6 +91,7 @@ class TestScale:
         autoscaler._set_last_scale("last_scale_down", app_name, (self._now() - SCALEDOWN_COOLDOWN_SECONDS * 10))
         autoscaler._set_last_scale("last_scale_up", app_name, (self._now() - (SCALEUP_COOLDOWN_SECONDS + 25)))
         autoscaler.scale(app)
+        autoscaler.scale_dispatcher.dispatch()
         assert float(autoscaler.redis_client.hget("last_scale_down", app_name)) == self._now()
         mock_get_statsd_client.return_value.gauge.assert_called_once_with("{}.instance-count".format(app_name), 3)
         mock_paas_client.return_value.update.assert_called_once_with(app_guid, 3)
@@ -95,6 +112,7 @@ class TestScale:
         autoscaler._set_last_scale("last_scale_down", app_name, (self._now() - SCALEDOWN_COOLDOWN_SECONDS * 10))
         autoscaler._set_last_scale("last_scale_up", app_name, (self._now() - 100))
         autoscaler.scale(app)
+        autoscaler.scale_dispatcher.dispatch()
         mock_get_statsd_client.return_value.gauge.assert_called_once_with("{}.instance-count".format(app_name), 4)
         mock_paas_client.return_value.update.assert_not_called()
 
@@ -114,6 +132,7 @@ class TestScale:
         autoscaler._set_last_scale("last_scale_up", app_name, (self._now() - 600))
 
         autoscaler.scale(app)
+        autoscaler.scale_dispatcher.dispatch()
         mock_get_statsd_client.return_value.gauge.assert_called_once_with("{}.instance-count".format(app_name), 4)
         mock_paas_client.return_value.assert_not_called()
 
@@ -130,9 +149,206 @@ class TestScale:
         autoscaler.cooldown_seconds_after_scale_up = SCALEUP_COOLDOWN_SECONDS
         autoscaler.cooldown_seconds_after_scale_down = SCALEDOWN_COOLDOWN_SECONDS
         autoscaler.scale(app)
+        autoscaler.scale_dispatcher.dispatch()
         mock_get_statsd_client.return_value.gauge.assert_called_once_with("{}.instance-count".format(app_name), 4)
         mock_paas_client.return_value.assert_not_called()
 
+    def test_scale_paas_app_does_not_scale_down_on_stale_inputs(self, mock_get_statsd_client, mock_paas_client, *args):
+        app_guid = "11111-11111-11111111-1111"
+        app_name = "app-name-1"
+        cf_info = {"name": app_name, "instances": 4, "guid": app_guid}
+        app = self._get_mock_app(app_name, cf_info)
+        app.get_desired_instance_count = Mock(return_value=1)
+        app.inputs_stale = True
+
+        autoscaler = Autoscaler()
+        autoscaler._set_last_scale("last_scale_down", app_name, (self._now() - SCALEDOWN_COOLDOWN_SECONDS * 10))
+        autoscaler._set_last_scale("last_scale_up", app_name, (self._now() - (SCALEUP_COOLDOWN_SECONDS * 10)))
+        autoscaler.scale(app)
+        autoscaler.scale_dispatcher.dispatch()
+        mock_get_statsd_client.return_value.gauge.assert_called_once_with("{}.instance-count".format(app_name), 4)
+        mock_paas_client.return_value.update.assert_not_called()
+
+    def test_scale_paas_app_still_scales_up_on_stale_inputs(self, mock_get_statsd_client, mock_paas_client, *args):
+        app_guid = "11111-11111-11111111-1111"
+        app_name = "app-name-1"
+        cf_info = {"name": app_name, "instances": 4, "guid": app_guid}
+        app = self._get_mock_app(app_name, cf_info)
+        app.get_desired_instance_count = Mock(return_value=6)
+        app.inputs_stale = True
+
+        autoscaler = Autoscaler()
+        autoscaler.scale(app)
+        autoscaler.scale_dispatcher.dispatch()
+        mock_paas_client.return_value.update.assert_called_once_with(app_guid, 6)
+
+    def test_scale_paas_app_fewer_instances_missing_scale_information_after_warm_start(
+        self, mock_get_statsd_client, mock_paas_client, *args
+    ):
+        """A previous process was running and never scaled this app, so there is no cooldown to wait for"""
+        app_guid = "11111-11111-11111111-1111"
+        app_name = "app-name-never-scaled"
+        cf_info = {"name": app_name, "instances": 4, "guid": app_guid}
+        app = self._get_mock_app(app_name, cf_info)
+        app.get_desired_instance_count = Mock(return_value=3)
+
+        autoscaler = Autoscaler()
+        autoscaler.redis_client.delete("last_scale_up", "last_scale_down")
+        autoscaler.warm_started = True
+        autoscaler.scale(app)
+        autoscaler.scale_dispatcher.dispatch()
+        mock_paas_client.return_value.update.assert_called_once_with(app_guid, 3)
+
+    def test_scale_paas_app_holds_scale_up_while_instances_are_starting(
+        self, mock_get_statsd_client, mock_paas_client, *args
+    ):
+        app_guid = "11111-11111-11111111-1111"
+        app_name = "app-name-1"
+        cf_info = {"name": app_name, "instances": 4, "guid": app_guid}
+        app = self._get_mock_app(app_name, cf_info)
+        app.get_desired_instance_count = Mock(return_value=8)
+        mock_paas_client.return_value.get_app_stats.return_value = {
+            "0": {"state": "RUNNING", "stats": {"uptime": 600}},
+            "1": {"state": "RUNNING", "stats": {"uptime": 600}},
+            "2": {"state": "STARTING", "stats": {"uptime": 0}},
+            "3": {"state": "STARTING", "stats": {"uptime": 0}},
+        }
+
+        autoscaler = Autoscaler()
+        autoscaler.scale(app)
+        autoscaler.scale_dispatcher.dispatch()
+        mock_paas_client.return_value.get_app_stats.assert_called_once_with(app_name, app_guid)
+        mock_paas_client.return_value.update.assert_not_called()
+        assert cf_info["ready_instances"] == 2
+
+        # the capacity that was on its way is up now
+        mock_paas_client.return_value.get_app_stats.return_value = {
+            str(i): {"state": "RUNNING", "stats": {"uptime": 600}} for i in range(4)
+        }
+        autoscaler.scale(app)
+        autoscaler.scale_dispatcher.dispatch()
+        mock_paas_client.return_value.update.assert_called_once_with(app_guid, 8)
+
+    def test_scale_paas_app_holds_on_fresh_stats_after_a_scale_up(
+        self, mock_get_statsd_client, mock_paas_client, *args
+    ):
+        app_guid = "11111-11111-11111111-1111"
+        app_name = "app-name-1"
+        cf_info = {"name": app_name, "instances": 4, "guid": app_guid}
+        app = self._get_mock_app(app_name, cf_info)
+        app.get_desired_instance_count = Mock(return_value=8)
+        running = {"state": "RUNNING", "stats": {"uptime": 600}}
+
+        with patch.dict(os.environ, {"CF_USERNAME": "user", "CF_PASSWORD": "password"}), patch(
+            "app.cf_session.CloudFoundryClient"
+        ) as mock_client:
+            # the real client, so stats go through the signal cache
+            mock_paas_client.return_value = PaasClient()
+            get_stats = mock_client.return_value.v2.apps.get_stats
+            get_stats.return_value = {str(i): running for i in range(4)}
+            autoscaler = Autoscaler()
+
+            with patch.dict(get_signal_cache().intervals, {"cf_stats": 5}):
+                autoscaler.scale(app)
+                autoscaler.scale_dispatcher.dispatch()
+                mock_client.return_value.apps._update.assert_called_once_with(app_guid, {"instances": 8})
+
+                # the next tick, well within the cache interval. Two of the new instances aren't even listed yet
+                get_stats.return_value = dict({str(i): running for i in range(4)}, **{"4": {"state": "STARTING"}})
+                app.get_desired_instance_count.return_value = 12
+                autoscaler.scale(app)
+                autoscaler.scale_dispatcher.dispatch()
+
+        assert get_stats.call_count == 2
+        mock_client.return_value.apps._update.assert_called_once()
+        assert app_name in autoscaler.awaiting_ready
+
+    def test_scale_paas_app_does_not_wait_on_starting_instances_forever(
+        self, mock_get_statsd_client, mock_paas_client, *args
+    ):
+        app_guid = "11111-11111-11111111-1111"
+        app_name = "app-name-1"
+        cf_info = {"name": app_name, "instances": 4, "guid": app_guid}
+        app = self._get_mock_app(app_name, cf_info)
+        app.get_desired_instance_count = Mock(return_value=8)
+        mock_paas_client.return_value.get_app_stats.return_value = {"0": {"state": "STARTING"}}
+
+        autoscaler = Autoscaler()
+        autoscaler.scale_up_hold_max_seconds = 300
+        autoscaler.scale_up_held_since[app_name] = self._now() - 300
+        autoscaler.scale(app)
+        autoscaler.scale_dispatcher.dispatch()
+        mock_paas_client.return_value.update.assert_called_once_with(app_guid, 8)
+
+    def test_scale_paas_app_tracks_new_instances_until_ready(self, mock_get_statsd_client, mock_paas_client, *args):
+        app_guid = "11111-11111-11111111-1111"
+        app_name = "app-name-1"
+        cf_info = {"name": app_name, "instances": 4, "guid": app_guid}
+        app = self._get_mock_app(app_name, cf_info)
+        app.get_desired_instance_count = Mock(return_value=6)
+        mock_paas_client.return_value.get_app_stats.return_value = {}
+
+        autoscaler = Autoscaler()
+        autoscaler.scale(app)
+        autoscaler.scale_dispatcher.dispatch()
+        assert app_name in autoscaler.awaiting_ready
+
+        # scalers see the ready count before they are asked for a desired count
+        mock_paas_client.return_value.get_app_stats.return_value = {
+            "0": {"state": "RUNNING", "stats": {"uptime": 600}},
+            "1": {"state": "STARTING"},
+        }
+        app.get_desired_instance_count.side_effect = lambda: cf_info["ready_instances"] + 5
+        autoscaler.scale(app)
+        assert cf_info["ready_instances"] == 1
+
+        mock_paas_client.return_value.get_app_stats.return_value = {
+            str(i): {"state": "RUNNING", "stats": {"uptime": 600}} for i in range(6)
+        }
+        autoscaler.scale(app)
+        assert app_name not in autoscaler.awaiting_ready
+
+    def test_scale_paas_app_measures_instance_startup(self, mock_get_statsd_client, mock_paas_client, *args):
+        app_name = "app-name-1"
+        cf_info = {"name": app_name, "instances": 4, "guid": "11111-11111-11111111-1111"}
+        app = self._get_mock_app(app_name, cf_info)
+        app.get_desired_instance_count = Mock(return_value=6)
+        mock_paas_client.return_value.get_app_stats.return_value = {}
+
+        with freeze_time("2018-05-31 06:00:00") as frozen_time:
+            autoscaler = Autoscaler()
+            autoscaler.scale(app)
+            autoscaler.scale_dispatcher.dispatch()
+
+            frozen_time.tick(90)
+            mock_paas_client.return_value.get_app_stats.return_value = {
+                str(i): {"state": "RUNNING", "stats": {"uptime": 60}} for i in range(6)
+            }
+            autoscaler.scale(app)
+            assert autoscaler.measured_startup_seconds == {app_name: 90}
+
+            autoscaler.scale(app)
+            assert cf_info["instance_startup_seconds"] == 90
+
+    def test_measured_startup_is_the_median_of_the_latest_scale_ups(
+        self, mock_get_statsd_client, mock_paas_client, *args
+    ):
+        autoscaler = Autoscaler()
+        autoscaler.startup_sample_count = 3
+
+        autoscaler._record_startup("app-name-1", 90)
+        assert autoscaler.measured_startup_seconds == {"app-name-1": 90}
+
+        # a stray fast measurement doesn't drag the estimate down
+        autoscaler._record_startup("app-name-1", 2)
+        autoscaler._record_startup("app-name-1", 100)
+        assert autoscaler.measured_startup_seconds == {"app-name-1": 90}
+
+        # only the latest samples count
+        autoscaler._record_startup("app-name-1", 120)
+        autoscaler._record_startup("app-name-1", 110)
+        assert autoscaler.measured_startup_seconds == {"app-name-1": 110}
+
     def test_scale_paas_app_handles_deployments(self, mock_get_statsd_client, mock_paas_client, _, caplog):
         caplog.set_level(logging.DEBUG)
         app_name = "app-name-1"
@@ -151,12 +367,48 @@ class TestScale:
         )
 
         autoscaler = Autoscaler()
+        autoscaler._set_last_scale("last_scale_up", app_name, self._now() - 600)
         autoscaler.scale(app)
+        autoscaler.scale_dispatcher.dispatch()
         mock_paas_client.return_value.update.assert_called_once_with(app_guid, 6)
         assert caplog.record_tuples == [
             ("root", logging.INFO, "Scaling app-name-1 from 4 to 6"),
-            ("root", logging.DEBUG, "Cannot scale during deployment app-name-1"),
+            ("root", logging.DEBUG, "Cannot scale during deployment app-name-1, will retry"),
         ]
+        # the cooldown only starts once cf has taken the new count
+        assert float(autoscaler.redis_client.hget("last_scale_up", app_name)) == self._now() - 600
+        assert cf_info["instances"] == 4
+        assert autoscaler.tick_scaled is False
+
+        # the deployment has finished, the held update goes out on the next dispatch
+        mock_paas_client.return_value.update.side_effect = None
+        autoscaler.scale_dispatcher.dispatch()
+        assert mock_paas_client.return_value.update.call_count == 2
+        assert autoscaler.tick_scaled is True
+        assert float(autoscaler.redis_client.hget("last_scale_up", app_name)) == self._now()
+        assert cf_info["instances"] == 6
+
+    def test_scale_paas_app_drops_held_update_when_no_longer_needed(self, mock_get_statsd_client, mock_paas_client, _):
+        app_name = "app-name-1"
+        app_guid = "11111-11111-11111111-1111"
+        cf_info = {"name": app_name, "instances": 4, "guid": app_guid}
+        app = self._get_mock_app(app_name, cf_info)
+        app.get_desired_instance_count = Mock(return_value=6)
+
+        mock_paas_client.return_value.update.side_effect = InvalidStatusCode(
+            status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
+            body={"error_code": "CF-ScaleDisabledDuringDeployment"},
+        )
+
+        autoscaler = Autoscaler()
+        autoscaler.scale(app)
+        autoscaler.scale_dispatcher.dispatch()
+
+        app.get_desired_instance_count.return_value = 4
+        autoscaler.scale(app)
+        autoscaler.scale_dispatcher.dispatch()
+        assert mock_paas_client.return_value.update.call_count == 1
+        assert autoscaler.scale_dispatcher.held == {}
 
     def test_scale_paas_app_handles_unexpected_errors(self, mock_get_statsd_client, mock_paas_client, _, caplog):
         caplog.set_level(logging.INFO)
@@ -172,12 +424,133 @@ class TestScale:
 
         autoscaler = Autoscaler()
         autoscaler.scale(app)
+        autoscaler.scale_dispatcher.dispatch()
         mock_paas_client.return_value.update.assert_called_once_with(app_guid, 6)
         assert caplog.record_tuples == [
             ("root", logging.INFO, "Scaling app-name-1 from 4 to 6"),
             ("root", logging.ERROR, 'Failed to scale app-name-1: BAD_REQUEST = {"description": "something bad"}'),
         ]
 
+    def test_tick_splits_instance_budget_between_apps(self, mock_get_statsd_client, mock_paas_client, *args):
+        apps = []
+        for name, priority in [("app-1", 1), ("app-2", 0)]:
+            app = self._get_mock_app(name, {"name": name, "instances": 2, "guid": name + "-guid"})
+            app.get_desired_instance_count = Mock(return_value=8)
+            app.min_instances, app.priority, app.weight, app.budget_cost = 2, priority, 1, 1
+            apps.append(app)
+        mock_paas_client.return_value.get_paas_apps.return_value = {app.name: app.cf_attributes for app in apps}
+
+        autoscaler = Autoscaler()
+        autoscaler.allocator = BudgetAllocator(12)
+        autoscaler.autoscaler_apps = apps
+        autoscaler._run_tick()
+
+        # both get their minimum, the higher priority app gets what it wants and the other app the rest
+        assert sorted(call.args for call in mock_paas_client.return_value.update.call_args_list) == [
+            ("app-1-guid", 8),
+            ("app-2-guid", 4),
+        ]
+
+    def test_tick_scales_downstream_apps_with_their_upstream(self, mock_get_statsd_client, mock_paas_client, *args):
+        api = self._get_mock_app("api", {"name": "api", "instances": 2, "guid": "api-guid"})
+        api.get_desired_instance_count = Mock(return_value=8)
+        api.get_load_instance_count = Mock(return_value=7)
+        sender = self._get_mock_app("sender", {"name": "sender", "instances": 2, "guid": "sender-guid"})
+        # its own queue is still empty
+        sender.get_desired_instance_count = Mock(return_value=2)
+        sender.upstream = [("api", 0.5)]
+        sender.get_upstream_instance_count = Mock(return_value=4)
+        mock_paas_client.return_value.get_paas_apps.return_value = {
+            "api": api.cf_attributes,
+            "sender": sender.cf_attributes,
+        }
+
+        autoscaler = Autoscaler()
+        # listed before its upstream app, it is still evaluated after it
+        autoscaler.autoscaler_apps = [sender, api]
+        autoscaler._run_tick()
+
+        # follows the load on api, not its desired count
+        assert sender.get_upstream_instance_count.call_args.args[0]["api"] == 7
+        assert sorted(call.args for call in mock_paas_client.return_value.update.call_args_list) == [
+            ("api-guid", 8),
+            ("sender-guid", 4),
+        ]
+
+    def test_tick_prunes_held_updates_of_deleted_apps(self, mock_get_statsd_client, mock_paas_client, *args):
+        api = self._get_mock_app("api", {"name": "api", "instances": 2, "guid": "api-guid"})
+        api.get_desired_instance_count = Mock(return_value=2)
+        deleted = self._get_mock_app("deleted", {"name": "deleted", "instances": 2, "guid": "deleted-guid"})
+        mock_paas_client.return_value.get_paas_apps.return_value = {"api": api.cf_attributes}
+
+        autoscaler = Autoscaler()
+        autoscaler.autoscaler_apps = [api]
+        autoscaler.scale_dispatcher.held["deleted-guid"] = ScaleRequest(deleted, 4)
+        autoscaler._run_tick()
+
+        assert autoscaler.scale_dispatcher.held == {}
+        mock_paas_client.return_value.update.assert_not_called()
+
+    def test_tick_keeps_held_updates_when_a_listing_comes_back_empty(
+        self, mock_get_statsd_client, mock_paas_client, *args
+    ):
+        api = self._get_mock_app("api", {"name": "api", "instances": 2, "guid": "api-guid"})
+        mock_paas_client.return_value.get_paas_apps.return_value = {}
+
+        autoscaler = Autoscaler()
+        autoscaler.autoscaler_apps = [api]
+        autoscaler.scale_dispatcher.held["api-guid"] = ScaleRequest(api, 4)
+        autoscaler._run_tick()
+
+        mock_paas_client.return_value.update.assert_called_once_with("api-guid", 4)
+
+    def test_tick_keeps_deciding_while_cf_logins_are_suspended(
+        self, mock_get_statsd_client, mock_paas_client, _, tmp_path
+    ):
+        app = self._get_mock_app("app-1", {"name": "app-1", "instances": 2, "guid": "app-1-guid"})
+        app.get_desired_instance_count = Mock(return_value=6)
+        app.min_instances, app.max_instances, app.scalers = 1, 10, []
+        mock_paas_client.return_value.get_paas_apps.side_effect = CfAuthUnavailable("Login failed")
+
+        autoscaler = Autoscaler()
+        autoscaler.journal = DecisionJournal(str(tmp_path)).start()
+        autoscaler.autoscaler_apps = [app]
+        autoscaler._run_tick()
+        autoscaler.journal.close()
+
+        # still worked out on the last known instance count, just not sent
+        app.get_desired_instance_count.assert_called_once_with()
+        mock_paas_client.return_value.update.assert_not_called()
+        [record] = list(read_journal(str(tmp_path)))
+        assert record["apps"]["app-1"]["desired"] == 6
+        assert record["apps"]["app-1"]["new"] == 2
+
+    def test_tick_scales_apps_in_every_space(self, mock_get_statsd_client, mock_paas_client, *args):
+        apps = []
+        for space in ["test", "staging"]:
+            app = self._get_mock_app("api", {"name": "api", "instances": 2, "guid": "api-guid-" + space})
+            app.space = space
+            app.key = "api" if space == "test" else "govuk-notify.staging.api"
+            app.get_desired_instance_count = Mock(return_value=5 if space == "test" else 3)
+            apps.append(app)
+        default_client = Mock(org="govuk-notify", space="test")
+        default_client.get_paas_apps.return_value = {"api": apps[0].cf_attributes}
+        staging_client = Mock(org="govuk-notify", space="staging")
+        staging_client.get_paas_apps.return_value = {"api": apps[1].cf_attributes}
+        mock_paas_client.side_effect = [default_client, staging_client]
+
+        autoscaler = Autoscaler()
+        autoscaler.autoscaler_apps = apps
+        autoscaler._run_tick()
+
+        mock_paas_client.assert_called_with("govuk-notify", "staging")
+        assert sorted(call.args for call in default_client.update.call_args_list) == [
+            ("api-guid-staging", 3),
+            ("api-guid-test", 5),
+        ]
+        # each keeps its own cooldown
+        assert sorted(autoscaler.last_scale_up) == ["api", "govuk-notify.staging.api"]
+
 
 class TestAutoscalerAlmostEndToEnd:
     def test_scale_up(self, mocker):
@@ -206,7 +579,8 @@ scale_factor: 0.8
         mocker.patch.object(AwsBaseScaler, "_get_boto3_client")
         mocker.patch.object(ElbScaler, "_get_boto3_client")
         mocker.patch.object(ElbScaler, "gauge")
-        mocker.patch.object(ElbScaler, "_get_request_counts", return_value=[1300, 1500, 1600, 1700, 1700])
+        request_counts = list(enumerate([1300, 1500, 1600, 1700, 1700]))
+        mocker.patch.object(ElbScaler, "_get_request_counts", return_value=request_counts)
         mock_paas_client = mocker.patch("app.autoscaler.PaasClient")
         mocker.patch("app.autoscaler.Redis", fakeredis.FakeRedis)
         mock_get_statsd_client = mocker.patch("app.autoscaler.get_statsd_client")
@@ -215,6 +589,7 @@ scale_factor: 0.8
         mock_paas_client.return_value.get_paas_apps.return_value = {
             app_name: {"name": app_name, "instances": 5, "guid": app_name + "-guid"},
         }
+        mock_paas_client.return_value.get_app_stats.return_value = {}
 
         with freeze_time("Thursday 31 May 2018 06:00:00") as frozen_time:
             # to trigger a scale up we need at least one value greater than min_instances * threshold
@@ -241,3 +616,72 @@ scale_factor: 0.8
 
             mock_get_statsd_client.return_value.gauge.assert_called_once_with("{}.instance-count".format(app_name), 8)
             mock_paas_client.return_value.update.assert_called_once_with(app_name + "-guid", 8)
+
+    def test_tick_interval_adapts_to_scaling(self, mocker):
+        mocker.patch("app.autoscaler.PaasClient")
+        mocker.patch("app.autoscaler.Redis", fakeredis.FakeRedis)
+        mocker.patch("app.autoscaler.get_statsd_client")
+        settings = {"MIN_SECONDS": 1, "MAX_SECONDS": 30}
+
+        general = config["GENERAL"]
+
+        with patch.dict("app.autoscaler.config", {"APPS": []}):
+            with patch.dict(general, {"ADAPTIVE_TICK_INTERVAL": settings}):
+                autoscaler = Autoscaler()
+                with pytest.raises(CannotLoadConfig, match="HEALTHZ_MAX_TICK_AGE_SECONDS"):
+                    with patch.dict(general, {"HEALTHZ_MAX_TICK_AGE_SECONDS": 30}):
+                        Autoscaler()
+        autoscaler._schedule = Mock()
+
+        autoscaler.tick_scaled = True
+        autoscaler._update_interval()
+        assert autoscaler.interval_seconds == 1
+        assert "autoscaler_tick_interval_seconds 1" in autoscaler.metrics.render()
+
+    def test_loads_apps_from_every_target(self, mocker):
+        mocker.patch("app.autoscaler.PaasClient")
+        mocker.patch("app.autoscaler.Redis", fakeredis.FakeRedis)
+        mocker.patch("app.autoscaler.get_statsd_client")
+        apps = [{"name": "api", "min_instances": 1, "max_instances": 2, "scalers": []}]
+        targets = [{"space": "staging", "apps": apps}]
+
+        with patch.dict("app.autoscaler.config", {"APPS": apps, "TARGETS": targets}):
+            autoscaler = Autoscaler()
+        assert [app.key for app in autoscaler.autoscaler_apps] == ["api", "govuk-notify.staging.api"]
+
+        with patch.dict("app.autoscaler.config", {"APPS": apps + apps, "TARGETS": []}):
+            with pytest.raises(CannotLoadConfig, match="more than once: api"):
+                Autoscaler()
+
+    def test_tick_is_journaled(self, mocker, tmp_path):
+        app_name = "test-api-app"
+        mocker.patch.object(AwsBaseScaler, "_get_boto3_client")
+        mocker.patch.object(ElbScaler, "_get_boto3_client")
+        mocker.patch.object(ElbScaler, "_get_request_counts", return_value=[(1, 1300), (2, 1700)])
+        mock_paas_client = mocker.patch("app.autoscaler.PaasClient")
+        mocker.patch("app.autoscaler.Redis", fakeredis.FakeRedis)
+        mocker.patch("app.autoscaler.get_statsd_client")
+        mocker.patch.object(Autoscaler, "_load_autoscaler_apps")
+        mock_paas_client.return_value.get_paas_apps.return_value = {
+            app_name: {"name": app_name, "instances": 5, "guid": app_name + "-guid"},
+        }
+
+        with freeze_time("Thursday 31 May 2018 06:00:00"):
+            app = App(app_name, 5, 10, [{"type": "ElbScaler", "elb_name": "my-elb", "threshold": 300}])
+            autoscaler = Autoscaler()
+            autoscaler._schedule = Mock()
+            autoscaler.autoscaler_apps = [app]
+            autoscaler.journal = DecisionJournal(str(tmp_path)).start()
+
+            autoscaler.run_task()
+            autoscaler.journal.close()
+
+        [record] = list(read_journal(str(tmp_path)))
+        assert record["timestamp"] == datetime.datetime(2018, 5, 31, 6).timestamp()
+        entry = record["apps"][app_name]
+        assert (entry["current"], entry["desired"], entry["new"]) == (5, 6, 6)
+        assert entry["cooldown"]["last_scale_up"] is None
+        [scaler] = entry["scalers"]
+        assert scaler["type"] == "ElbScaler"
+        assert scaler["inputs"] == {"test-api-app.request-count": 1700}
+        assert scaler["latency"] >= 0
@@ -1,12 +1,14 @@
 import os
 from datetime import datetime, timedelta
-from unittest.mock import patch
+from unittest.mock import ANY, patch
 
 import psycopg2
 import pytest
 from freezegun import freeze_time
 
 from app.base_scalers import AwsBaseScaler, BaseScaler, DbQueryScaler
+from app.circuit_breaker import OPEN
+from app.exceptions import SourceUnavailable
 
 app_name = "test-app"
 min_instances = 1
@@ -43,6 +45,39 @@ class TestBaseScaler:
         with patch.object(base_scaler, "_get_desired_instance_count", side_effect=[desired_instances]):
             assert base_scaler.get_desired_instance_count() == expected_instances
 
+    def test_load_is_kept_before_normalizing(self):
+        base_scaler = BaseScaler(app_name, 2, 5)
+        with patch.object(base_scaler, "_get_desired_instance_count", side_effect=[0]):
+            assert base_scaler.get_desired_instance_count() == 2
+        assert base_scaler.last_load_instance_count == 0
+
+
+@freeze_time("2018-01-01 12:00")
+class TestBaseScalerStaleInputs:
+    def test_uses_last_good_value_while_source_unavailable(self):
+        base_scaler = BaseScaler(app_name, 1, 10)
+        with patch.object(base_scaler, "_get_desired_instance_count", side_effect=[5, SourceUnavailable("down")]):
+            assert base_scaler.get_desired_instance_count() == 5
+            assert base_scaler.stale is False
+            assert base_scaler.get_desired_instance_count() == 5
+            assert base_scaler.stale is True
+
+    def test_holds_current_count_once_last_good_value_is_too_old(self):
+        base_scaler = BaseScaler(app_name, 1, 10)
+        base_scaler.refresh_cf_info({"instances": 7})
+        base_scaler.last_good_instance_count = 2
+        base_scaler.last_good_at = datetime.utcnow() - base_scaler.staleness_budget - timedelta(seconds=1)
+        with patch.object(base_scaler, "_get_desired_instance_count", side_effect=SourceUnavailable("down")):
+            assert base_scaler.get_desired_instance_count() == 7
+            assert base_scaler.stale is True
+
+    def test_recovers_once_source_is_back(self):
+        base_scaler = BaseScaler(app_name, 1, 10)
+        with patch.object(base_scaler, "_get_desired_instance_count", side_effect=[SourceUnavailable("down"), 3]):
+            base_scaler.get_desired_instance_count()
+            assert base_scaler.get_desired_instance_count() == 3
+            assert base_scaler.stale is False
+
 
 @patch("app.base_scalers.boto3")
 class TestAwsBaseScaler:
@@ -76,7 +111,24 @@ class TestAwsBaseScaler:
         aws_base_scaler = AwsBaseScaler(app_name, min_instances, max_instances)
         assert aws_base_scaler.aws_region == "eu-west-1"
         assert aws_base_scaler.aws_account_id == 123456
-        mock_client.assert_called_with("sts", region_name="eu-west-1")
+        mock_client.assert_called_with("sts", config=ANY, region_name="eu-west-1")
+
+    def test_aws_account_id_is_looked_up_once_per_region(self, mock_boto3):
+        mock_boto3.client.return_value.get_caller_identity.return_value = {"Account": 123456}
+
+        AwsBaseScaler(app_name, min_instances, max_instances)
+        AwsBaseScaler("another-app", min_instances, max_instances)
+        AwsBaseScaler(app_name, min_instances, max_instances, aws_region="us-east-1")
+
+        assert mock_boto3.client.return_value.get_caller_identity.call_count == 2
+
+    def test_boto3_clients_use_tight_timeouts(self, mock_boto3):
+        AwsBaseScaler(app_name, min_instances, max_instances)
+
+        boto_config = mock_boto3.client.call_args.kwargs["config"]
+        assert boto_config.connect_timeout == 2
+        assert boto_config.read_timeout == 5
+        assert boto_config.retries == {"max_attempts": 2, "mode": "standard"}
 
 
 @pytest.fixture
@@ -95,29 +147,40 @@ class TestDbQueryScaler:
     def test_db_uri_is_loaded(self):
         assert self.db_query_scaler.db_uri == "test-db-uri"
 
-    def test_sets_last_failure_and_returns_0_if_exception(self, mock_db_connection):
-        assert self.db_query_scaler.last_db_error == datetime.min
-
+    def test_raises_source_unavailable_if_exception(self, mock_db_connection):
         mock_db_connection.side_effect = psycopg2.OperationalError
-        res = self.db_query_scaler.run_query()
 
-        assert res == 0
-        assert self.db_query_scaler.last_db_error == datetime.utcnow()
+        with pytest.raises(SourceUnavailable):
+            self.db_query_scaler.run_query()
 
-    def test_skips_execution_if_recently_failed(self, mock_db_connection):
-        self.db_query_scaler.last_db_error = datetime.utcnow() - timedelta(seconds=59)
+    def test_connects_with_timeouts(self, mock_db_connection):
+        connection = mock_db_connection.return_value.__enter__.return_value
+        connection.cursor.return_value.__enter__.return_value.fetchone.return_value = [42]
 
-        res = self.db_query_scaler.run_query()
+        assert self.db_query_scaler.run_query() == 42
+        mock_db_connection.assert_called_once_with(
+            "test-db-uri", connect_timeout=2, options="-c statement_timeout=5000"
+        )
 
-        assert mock_db_connection.called is False
-        assert res == 0
+    def test_query_is_cached_for_its_poll_interval(self, mock_db_connection):
+        connection = mock_db_connection.return_value.__enter__.return_value
+        connection.cursor.return_value.__enter__.return_value.fetchone.return_value = [42]
 
-    def test_runs_query_if_failure_is_old(self, mock_db_connection):
-        self.db_query_scaler.last_db_error = datetime.utcnow() - timedelta(seconds=61)
+        assert self.db_query_scaler.run_query() == 42
+        assert self.db_query_scaler.run_query() == 42
+        assert mock_db_connection.call_count == 1
 
-        self.db_query_scaler.run_query()
-
-        assert mock_db_connection.called is True
+    def test_skips_execution_while_circuit_is_open(self, mock_db_connection):
+        mock_db_connection.side_effect = psycopg2.OperationalError
+        for _ in range(self.db_query_scaler.circuit_breaker.failure_threshold):
+            with pytest.raises(SourceUnavailable):
+                self.db_query_scaler.run_query()
+        assert self.db_query_scaler.circuit_breaker.state == OPEN
+        mock_db_connection.reset_mock()
+
+        with pytest.raises(SourceUnavailable):
+            self.db_query_scaler.run_query()
+        assert mock_db_connection.called is False
 
 
 @freeze_time("2018-01-01 12:00")
@@ -0,0 +1,43 @@
+import fakeredis
+
+from app.calibration import REDIS_CALIBRATION_KEY, ThroughputCalibrator
+
+
+class TestThroughputCalibrator:
+    def test_no_estimate_until_enough_samples(self):
+        calibrator = ThroughputCalibrator("test-app", min_samples=3)
+        calibrator.add_sample(100)
+        calibrator.add_sample(200)
+
+        assert calibrator.estimate is None
+
+        calibrator.add_sample(300)
+        assert calibrator.estimate == 200
+
+    def test_estimate_ignores_outliers(self):
+        calibrator = ThroughputCalibrator("test-app", min_samples=3)
+        for sample in [1000, 1100, 5, 1050, 90000]:
+            calibrator.add_sample(sample)
+
+        assert calibrator.estimate == 1050
+
+    def test_only_keeps_the_window(self):
+        calibrator = ThroughputCalibrator("test-app", window=3, min_samples=1)
+        for sample in [1, 2, 3, 10, 11, 12]:
+            calibrator.add_sample(sample)
+
+        assert list(calibrator.samples) == [10, 11, 12]
+
+    def test_state_round_trips_through_redis(self):
+        redis_client = fakeredis.FakeRedis()
+        calibrator = ThroughputCalibrator("test-app")
+        for sample in [10, 20, 30]:
+            calibrator.add_sample(sample)
+        calibrator.save_state(redis_client)
+
+        restored = ThroughputCalibrator("test-app")
+        restored.load_state(redis_client)
+
+        assert redis_client.hexists(REDIS_CALIBRATION_KEY, "test-app")
+        assert restored.estimate == 20
+        assert restored.state_loaded
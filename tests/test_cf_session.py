@@ -0,0 +1,214 @@
+import base64
+import json
+import threading
+from unittest.mock import Mock, patch
+
+import pytest
+
+from app.cf_session import CfApiAdapter, CfSession, get_cf_session
+from app.exceptions import CfAuthUnavailable
+from app.rate_limiter import PRIORITY_READ, PRIORITY_UPDATE
+
+CONFIG = {
+    "GENERAL": {
+        "CF_TOKEN_REFRESH_MARGIN_SECONDS": 60,
+        "CF_AUTH_BACKOFF_BASE_SECONDS": 300,
+        "CF_AUTH_BACKOFF_MAX_SECONDS": 1000,
+    }
+}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000
+
+    def __call__(self):
+        return self.now
+
+
+def _token(expires_at):
+    payload = base64.urlsafe_b64encode(json.dumps({"exp": expires_at}).encode()).decode().rstrip("=")
+    return "header.{}.signature".format(payload)
+
+
+@patch.dict("app.config.config", CONFIG)
+@patch("app.cf_session.CloudFoundryClient")
+class TestCfSession:
+    def _session(self):
+        self.clock = FakeClock()
+        session = CfSession("https://api.test.cf.com", "user", "password", clock=self.clock)
+        session.rate_limiter = Mock()
+        return session
+
+    def test_logs_in_once(self, mock_client):
+        mock_client.return_value._access_token = _token(2000)
+        session = self._session()
+
+        assert session.get_client() is mock_client.return_value
+        assert session.get_client() is mock_client.return_value
+
+        mock_client.return_value.init_with_user_credentials.assert_called_once_with("user", "password")
+        assert session.expires_at == 2000
+
+    def test_refreshes_the_token_before_it_expires(self, mock_client):
+        mock_client.return_value._access_token = _token(2000)
+        session = self._session()
+        session.get_client()
+
+        self.clock.now = 1939
+        session.get_client()
+        mock_client.return_value._refresh_token.assert_not_called()
+
+        mock_client.return_value._access_token = _token(3000)
+        self.clock.now = 1940
+        session.get_client()
+        mock_client.return_value._refresh_token.assert_called_once_with()
+        assert session.expires_at == 3000
+        mock_client.return_value.init_with_user_credentials.assert_called_once()
+
+    def test_logs_in_again_when_the_refresh_fails(self, mock_client):
+        mock_client.return_value._access_token = _token(2000)
+        mock_client.return_value._refresh_token.side_effect = Exception("refresh token expired")
+        session = self._session()
+        session.get_client()
+
+        self.clock.now = 1990
+        assert session.get_client() is mock_client.return_value
+        assert mock_client.return_value.init_with_user_credentials.call_count == 2
+
+    def test_failed_logins_back_off_exponentially(self, mock_client):
+        login = mock_client.return_value.init_with_user_credentials
+        login.side_effect = Exception("Login failed")
+        session = self._session()
+
+        for suspended_for in [300, 600, 1000, 1000]:
+            with pytest.raises(CfAuthUnavailable, match="Login failed"):
+                session.get_client()
+            assert session.suspended_for() == suspended_for
+            self.clock.now += suspended_for - 1
+            with pytest.raises(CfAuthUnavailable, match="Not logging in"):
+                session.get_client()
+            self.clock.now += 1
+        assert login.call_count == 4
+
+        login.side_effect = None
+        assert session.get_client() is mock_client.return_value
+        assert session.failed_logins == 0
+
+    def test_threads_share_one_login(self, mock_client):
+        barrier = threading.Barrier(5)
+        session = self._session()
+        clients = []
+
+        def get_client():
+            barrier.wait()
+            clients.append(session.get_client())
+
+        threads = [threading.Thread(target=get_client) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert clients == [mock_client.return_value] * 5
+        mock_client.return_value.init_with_user_credentials.assert_called_once()
+
+    def test_retry_after_header_blocks_the_rate_limiter(self, mock_client):
+        session = self._session()
+        response = Mock(status_code=429, headers={"Retry-After": "12"})
+
+        session._record_retry_after(response)
+
+        session.rate_limiter.block_for.assert_called_once_with(12)
+
+    def test_retry_after_is_capped(self, mock_client):
+        session = self._session()
+        session.retry_after_max_seconds = 60
+        response = Mock(status_code=503, headers={"Retry-After": "3600"})
+
+        session._record_retry_after(response)
+
+        session.rate_limiter.block_for.assert_called_once_with(60)
+
+    def test_sessions_are_shared_per_api(self, mock_client):
+        session = get_cf_session("https://api.test.cf.com", "user", "password")
+
+        assert get_cf_session("https://api.test.cf.com", "user", "password") is session
+        assert get_cf_session("https://api.other.cf.com", "user", "password") is not session
+
+
+def _response(status_code):
+    return Mock(status_code=status_code, headers={})
+
+
+@patch("app.cf_session.HTTPAdapter.send")
+class TestCfApiAdapter:
+    def _adapter(self, **kwargs):
+        self.sleep = Mock()
+        self.rate_limiter = Mock()
+        self.rate_limiter.acquire.return_value = 0
+        return CfApiAdapter(self.rate_limiter, timeout=(5, 30), sleep=self.sleep, **kwargs)
+
+    def test_takes_a_token_per_request(self, mock_send):
+        mock_send.return_value = _response(200)
+        adapter = self._adapter()
+
+        adapter.send(Mock(method="GET"))
+        adapter.send(Mock(method="PUT"))
+
+        assert [call.args for call in self.rate_limiter.acquire.call_args_list] == [
+            (PRIORITY_READ,),
+            (PRIORITY_UPDATE,),
+        ]
+
+    def test_sets_a_default_timeout(self, mock_send):
+        mock_send.return_value = _response(200)
+        adapter = self._adapter()
+
+        adapter.send(Mock(method="GET"))
+        adapter.send(Mock(method="GET"), timeout=1)
+
+        assert [call.kwargs["timeout"] for call in mock_send.call_args_list] == [(5, 30), 1]
+
+    def test_retries_throttled_requests_on_their_own(self, mock_send):
+        mock_send.side_effect = [_response(429), _response(502), _response(200)]
+        adapter = self._adapter()
+
+        assert adapter.send(Mock(method="GET")).status_code == 200
+        assert mock_send.call_count == 3
+        assert self.rate_limiter.acquire.call_count == 3
+        assert self.sleep.call_count == 2
+
+    def test_does_not_retry_client_errors(self, mock_send):
+        mock_send.return_value = _response(400)
+        adapter = self._adapter()
+
+        assert adapter.send(Mock(method="PUT")).status_code == 400
+        assert mock_send.call_count == 1
+        self.sleep.assert_not_called()
+
+    def test_gives_up_after_max_retries(self, mock_send):
+        mock_send.return_value = _response(503)
+        adapter = self._adapter(retries=3)
+
+        assert adapter.send(Mock(method="GET")).status_code == 503
+        assert mock_send.call_count == 4
+
+    def test_waits_are_bounded(self, mock_send):
+        mock_send.return_value = _response(503)
+        adapter = self._adapter(retries=10, backoff_base_seconds=1, backoff_max_seconds=4, retry_budget_seconds=10)
+
+        adapter.send(Mock(method="GET"))
+
+        delays = [call.args[0] for call in self.sleep.call_args_list]
+        assert max(delays) <= 4
+        assert sum(delays) <= 10
+
+    def test_every_response_is_reported(self, mock_send):
+        mock_send.side_effect = [_response(429), _response(200)]
+        on_response = Mock()
+        adapter = self._adapter(on_response=on_response)
+
+        adapter.send(Mock(method="GET"))
+
+        assert [call.args[0].status_code for call in on_response.call_args_list] == [429, 200]
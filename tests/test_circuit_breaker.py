@@ -0,0 +1,141 @@
+import pytest
+
+from app.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    get_circuit_breaker,
+)
+from app.exceptions import SourceUnavailable
+from app.metrics import get_metrics_registry
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def _fail():
+    raise TimeoutError("read timed out")
+
+
+class FakeClientError(Exception):
+    def __init__(self, status_code):
+        super().__init__("returned {}".format(status_code))
+        self.response = {"Error": {"Code": "QueueDoesNotExist"}, "ResponseMetadata": {"HTTPStatusCode": status_code}}
+
+
+class TestCircuitBreaker:
+    def setup_method(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker("test-source", failure_threshold=2, reset_timeout_seconds=30, clock=self.clock)
+
+    def test_passes_results_through(self):
+        assert self.breaker.call(lambda: 42) == 42
+        assert self.breaker.state == CLOSED
+
+    def test_wraps_failures(self):
+        with pytest.raises(SourceUnavailable, match="read timed out"):
+            self.breaker.call(_fail)
+        assert self.breaker.state == CLOSED
+
+    def test_opens_after_consecutive_failures(self):
+        for _ in range(2):
+            with pytest.raises(SourceUnavailable):
+                self.breaker.call(_fail)
+        assert self.breaker.state == OPEN
+
+        calls = []
+        with pytest.raises(SourceUnavailable, match="is open"):
+            self.breaker.call(lambda: calls.append(1))
+        assert calls == []
+
+    def test_success_resets_failure_count(self):
+        with pytest.raises(SourceUnavailable):
+            self.breaker.call(_fail)
+        self.breaker.call(lambda: 1)
+        with pytest.raises(SourceUnavailable):
+            self.breaker.call(_fail)
+        assert self.breaker.state == CLOSED
+
+    def test_probes_once_reset_timeout_has_passed(self):
+        for _ in range(2):
+            with pytest.raises(SourceUnavailable):
+                self.breaker.call(_fail)
+
+        self.clock.now = 30
+        assert self.breaker.call(lambda: 42) == 42
+        assert self.breaker.state == CLOSED
+
+    def test_failed_probe_opens_again(self):
+        for _ in range(2):
+            with pytest.raises(SourceUnavailable):
+                self.breaker.call(_fail)
+
+        self.clock.now = 30
+        with pytest.raises(SourceUnavailable, match="read timed out"):
+            self.breaker.call(_fail)
+        assert self.breaker.state == OPEN
+        assert self.breaker.opened_at == 30
+
+    def test_client_errors_are_not_failures(self):
+        def _missing():
+            raise FakeClientError(400)
+
+        for _ in range(3):
+            with pytest.raises(SourceUnavailable, match="returned 400"):
+                self.breaker.call(_missing)
+        assert self.breaker.state == CLOSED
+        assert self.breaker.failures == 0
+
+    def test_throttling_is_a_failure(self):
+        def _throttled():
+            raise FakeClientError(429)
+
+        for _ in range(2):
+            with pytest.raises(SourceUnavailable):
+                self.breaker.call(_throttled)
+        assert self.breaker.state == OPEN
+
+    def test_only_one_probe_at_a_time(self):
+        self.breaker.state = HALF_OPEN
+        self.breaker._before_call()
+        with pytest.raises(SourceUnavailable):
+            self.breaker._before_call()
+
+    def test_exports_state(self):
+        for _ in range(2):
+            with pytest.raises(SourceUnavailable):
+                self.breaker.call(_fail)
+
+        rendered = get_metrics_registry().render()
+        assert 'autoscaler_circuit_breaker_state{source="test-source"} 2' in rendered
+        assert 'autoscaler_circuit_breaker_trips_total{source="test-source"}' in rendered
+
+
+def test_get_circuit_breaker_shares_one_breaker_per_source():
+    assert get_circuit_breaker("sqs") is get_circuit_breaker("sqs")
+    assert get_circuit_breaker("sqs") is not get_circuit_breaker("cloudwatch")
+
+
+def test_get_circuit_breaker_shares_one_breaker_per_resource():
+    queue_url = "https://sqs.eu-west-1.amazonaws.com/123456/notify-db-sms"
+    breaker = get_circuit_breaker("sqs", queue_url)
+
+    assert breaker is get_circuit_breaker("sqs", queue_url)
+    assert breaker is not get_circuit_breaker("sqs", "https://sqs.eu-west-1.amazonaws.com/123456/notify-db-email")
+    assert breaker is not get_circuit_breaker("sqs")
+
+
+def test_exports_state_per_resource():
+    breaker = get_circuit_breaker("sqs", "notify-db-sms")
+    for _ in range(breaker.failure_threshold):
+        with pytest.raises(SourceUnavailable, match="sqs notify-db-sms failed"):
+            breaker.call(_fail)
+
+    rendered = get_metrics_registry().render()
+    assert 'autoscaler_circuit_breaker_state{resource="notify-db-sms",source="sqs"} 2' in rendered
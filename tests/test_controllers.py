@@ -0,0 +1,112 @@
+import fakeredis
+import pytest
+
+from app.controllers import REDIS_STATE_KEY, TargetTrackingController, build_controller
+from app.exceptions import CannotLoadApp
+
+app_name = "test-app"
+min_instances = 2
+max_instances = 20
+
+
+class TestTargetTrackingController:
+    def _get_controller(self, **kwargs):
+        return TargetTrackingController(app_name, min_instances, max_instances, **kwargs)
+
+    def test_holds_steady_when_on_target(self):
+        controller = self._get_controller()
+
+        assert [controller.update(5, 5, now) for now in range(0, 60, 5)] == [5] * 12
+
+    def test_first_update_reacts_proportionally_to_a_step(self):
+        controller = self._get_controller(kp=0.5)
+
+        # bumpless start: integral holds the 5 instances we already have, kp * 10 on top of it
+        assert controller.update(5, 15, 0) == 10
+
+    def test_converges_to_target_after_a_step(self):
+        controller = self._get_controller()
+        current = 5
+        for now in range(0, 600, 5):
+            current = controller.update(current, 15, now)
+
+        assert current == 15
+
+    def test_setpoint_leaves_headroom(self):
+        controller = self._get_controller(setpoint=0.5)
+        current = 4
+        for now in range(0, 600, 5):
+            current = controller.update(current, 5, now)
+
+        assert current == 10
+
+    def test_ignores_changes_within_deadband(self):
+        controller = self._get_controller(kp=0.3, deadband=1)
+
+        assert controller.update(5, 6, 0) == 5
+
+    def test_integral_does_not_wind_up_at_max_instances(self):
+        controller = self._get_controller()
+        current = 20
+        # far more load than we can ever scale for, for a long time
+        for now in range(0, 3600, 5):
+            current = controller.update(current, 100, now)
+        assert current == max_instances
+        assert controller.ki * controller.integral <= max_instances
+
+        # once load drops we come down straight away instead of unwinding an hour of integral first
+        assert controller.update(current, 5, 3600) < max_instances
+
+    def test_stale_state_is_reset(self):
+        controller = self._get_controller(max_state_age_seconds=60)
+        controller.update(5, 5, 0)
+
+        controller.update(10, 10, 1000)
+
+        assert controller.integral * controller.ki == 10
+
+    def test_state_is_persisted_in_redis(self):
+        redis_client = fakeredis.FakeRedis()
+        controller = self._get_controller()
+        controller.get_new_instance_count(5, 15, 0, redis_client)
+
+        restarted = self._get_controller()
+        restarted.load_state(redis_client)
+
+        assert redis_client.hget(REDIS_STATE_KEY, app_name) is not None
+        assert restarted.integral == controller.integral
+        assert restarted.updated_at == controller.updated_at
+
+    def test_keeps_working_without_redis(self):
+        controller = self._get_controller()
+
+        class BrokenRedis:
+            def hget(self, *args):
+                raise ConnectionError("no redis")
+
+            hset = hget
+
+        assert controller.get_new_instance_count(5, 5, 0, BrokenRedis()) == 5
+
+
+class TestBuildController:
+    def test_no_config_means_default_policy(self):
+        assert build_controller(app_name, min_instances, max_instances, None) is None
+
+    def test_target_tracking(self):
+        controller = build_controller(
+            app_name, min_instances, max_instances, {"type": "TargetTracking", "setpoint": 0.8, "kp": 0.4}
+        )
+
+        assert isinstance(controller, TargetTrackingController)
+        assert controller.setpoint == 0.8
+        assert controller.kp == 0.4
+
+    def test_unknown_type(self):
+        with pytest.raises(CannotLoadApp):
+            build_controller(app_name, min_instances, max_instances, {"type": "Magic"})
+
+    @pytest.mark.parametrize("settings", [{"ki": 0}, {"ki": -0.5}, {"setpoint": 0}])
+    def test_rejects_gains_it_would_divide_by(self, settings):
+        with pytest.raises(CannotLoadApp):
+            build_controller(app_name, min_instances, max_instances, dict(settings, type="TargetTracking"))
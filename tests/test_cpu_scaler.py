@@ -9,7 +9,7 @@ min_instances = 1
 max_instances = 4
 
 
-@patch("app.base_scalers.PaasClient")
+@patch("app.paas_client.PaasClient")
 class TestCpuScaler:
     @pytest.mark.parametrize(
         "input_attrs,expected_cpu",
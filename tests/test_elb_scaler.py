@@ -1,9 +1,12 @@
 import datetime
-from unittest.mock import Mock, patch
+from unittest.mock import ANY, Mock, patch
 
+import pytest
 from freezegun import freeze_time
 
-from app.elb_scaler import ElbScaler
+from app.elb_scaler import ElbScaler, reset_metric_queries
+from app.exceptions import CannotLoadApp
+from app.polling import get_signal_cache
 
 app_name = "test-app"
 min_instances = 1
@@ -36,7 +39,7 @@ class TestElbScaler:
         assert elb_scaler.cloudwatch_client is None
         elb_scaler.get_desired_instance_count()
         assert elb_scaler.cloudwatch_client == mock_client.return_value
-        mock_client.assert_called_with("cloudwatch", region_name="eu-west-1")
+        mock_client.assert_called_with("cloudwatch", config=ANY, region_name="eu-west-1")
 
     @freeze_time("2018-03-15 15:10:00")
     def test_get_desired_instance_count(self, mock_boto3):
@@ -70,3 +73,198 @@ class TestElbScaler:
             Unit="Count",
         )
         elb_scaler.statsd_client.gauge.assert_called_once_with("{}.request-count".format(elb_scaler.app_name), 5500)
+
+    @freeze_time("2018-03-15 15:10:00")
+    def test_get_desired_instance_count_with_trimmed_max(self, mock_boto3):
+        cloudwatch_client = mock_boto3.client.return_value
+        cloudwatch_client.get_metric_statistics.return_value = {
+            "Datapoints": [
+                {"Sum": 1500, "Timestamp": 111111110},
+                {"Sum": 5500, "Timestamp": 111111112},
+                {"Sum": 1400, "Timestamp": 111111113},
+            ]
+        }
+
+        elb_scaler = ElbScaler(app_name, 1, 5, statistic="trimmed_max", **self.input_attrs)
+        elb_scaler.statsd_client = Mock()
+
+        # the single 5500 minute is ignored
+        assert elb_scaler.get_desired_instance_count() == 1
+        elb_scaler.statsd_client.gauge.assert_called_once_with("{}.request-count".format(app_name), 1500)
+
+
+def _metric_data_result(query_id, values, start=datetime.datetime(2018, 3, 15, 15, 5)):
+    timestamps = [start + datetime.timedelta(minutes=i) for i in range(len(values))]
+    return {"Id": query_id, "Timestamps": timestamps, "Values": values}
+
+
+@pytest.fixture
+def metric_queries():
+    reset_metric_queries()
+    yield
+    reset_metric_queries()
+
+
+@freeze_time("2018-03-15 15:10:00")
+@pytest.mark.usefixtures("metric_queries")
+@patch("app.base_scalers.boto3")
+class TestElbScalerLoadBalancers:
+    load_balancer = "app/notify-api/50dc6c495c0c9188"
+    target_group = "targetgroup/notify-api/943f017f100becff"
+
+    def _get_scaler(self, name=app_name, **kwargs):
+        attrs = {"load_balancer": self.load_balancer, "threshold": 1000}
+        attrs.update(kwargs)
+        scaler = ElbScaler(name, 1, 20, **attrs)
+        scaler.statsd_client = Mock()
+        scaler.cf_attributes = {"instances": 4}
+        return scaler
+
+    def test_needs_a_load_balancer(self, mock_boto3):
+        with pytest.raises(CannotLoadApp):
+            ElbScaler(app_name, 1, 20, threshold=1000)
+
+    @pytest.mark.parametrize(
+        "attrs",
+        [
+            {"load_balancer_type": "gateway"},
+            {"load_balancer_type": "network", "response_time_target": 0.5},
+            {"response_time_target": 0.5, "response_time_percentile": "p50"},
+        ],
+    )
+    def test_rejects_invalid_options(self, mock_boto3, attrs):
+        with pytest.raises(CannotLoadApp):
+            self._get_scaler(**attrs)
+
+    def test_alb_target_group_request_counts(self, mock_boto3):
+        cloudwatch_client = mock_boto3.client.return_value
+        cloudwatch_client.get_metric_data.return_value = {
+            "MetricDataResults": [_metric_data_result("m0", [1500, 2500, 1800])]
+        }
+        scaler = self._get_scaler(target_group=self.target_group)
+
+        assert scaler.get_desired_instance_count() == 3
+        cloudwatch_client.get_metric_data.assert_called_once_with(
+            MetricDataQueries=[
+                {
+                    "Id": "m0",
+                    "MetricStat": {
+                        "Metric": {
+                            "Namespace": "AWS/ApplicationELB",
+                            "MetricName": "RequestCount",
+                            "Dimensions": [
+                                {"Name": "LoadBalancer", "Value": self.load_balancer},
+                                {"Name": "TargetGroup", "Value": self.target_group},
+                            ],
+                        },
+                        "Period": 60,
+                        "Stat": "Sum",
+                    },
+                    "ReturnData": True,
+                }
+            ],
+            StartTime=datetime.datetime(2018, 3, 15, 15, 5),
+            EndTime=datetime.datetime(2018, 3, 15, 15, 10),
+            ScanBy="TimestampAscending",
+        )
+
+    def test_nlb_scales_on_new_flows(self, mock_boto3):
+        cloudwatch_client = mock_boto3.client.return_value
+        cloudwatch_client.get_metric_data.return_value = {"MetricDataResults": [_metric_data_result("m0", [4200])]}
+        scaler = self._get_scaler(load_balancer="net/notify-api/50dc6c495c0c9188", load_balancer_type="network")
+
+        assert scaler.get_desired_instance_count() == 5
+        [query] = cloudwatch_client.get_metric_data.call_args.kwargs["MetricDataQueries"]
+        assert query["MetricStat"]["Metric"]["Namespace"] == "AWS/NetworkELB"
+        assert query["MetricStat"]["Metric"]["MetricName"] == "NewFlowCount"
+
+    @pytest.mark.parametrize(
+        "response_times,expected",
+        [
+            # requests alone need 2 instances
+            ([0.2, 0.3], 2),
+            # 4 instances at twice the target p99
+            ([0.6, 1.0], 8),
+            # only the latest minute counts, the slow one before it has been dealt with
+            ([1.0, 0.4], 2),
+        ],
+    )
+    def test_combined_requests_and_response_time(self, mock_boto3, response_times, expected):
+        cloudwatch_client = mock_boto3.client.return_value
+        scaler = self._get_scaler(response_time_target=0.5, response_time_percentile="p99")
+        cloudwatch_client.get_metric_data.return_value = {
+            "MetricDataResults": [
+                # queries are sorted, RequestCount comes before TargetResponseTime
+                _metric_data_result("m0", [1200, 1500]),
+                _metric_data_result("m1", response_times),
+            ]
+        }
+
+        assert scaler.get_desired_instance_count() == expected
+        stats = [
+            q["MetricStat"]["Stat"] for q in cloudwatch_client.get_metric_data.call_args.kwargs["MetricDataQueries"]
+        ]
+        assert stats == ["Sum", "p99"]
+
+    def test_response_times_do_not_compound_scale_ups(self, mock_boto3):
+        cloudwatch_client = mock_boto3.client.return_value
+        scaler = self._get_scaler(response_time_target=0.5)
+        cloudwatch_client.get_metric_data.return_value = {
+            "MetricDataResults": [
+                _metric_data_result("m0", [100], start=datetime.datetime(2018, 3, 15, 15, 9)),
+                _metric_data_result("m1", [1.0], start=datetime.datetime(2018, 3, 15, 15, 9)),
+            ]
+        }
+
+        with freeze_time("2018-03-15 15:10:00") as frozen_time:
+            assert scaler.get_desired_instance_count() == 8
+
+            # the scale up went through, the slow minute was measured on the 4 instances from before it
+            frozen_time.tick(30)
+            scaler.cf_attributes = {"instances": 8}
+            assert scaler.get_desired_instance_count() == 8
+
+            # a minute measured on the 8 instances that is still a bit slow
+            frozen_time.tick(90)
+            get_signal_cache().clear()
+            cloudwatch_client.get_metric_data.return_value = {
+                "MetricDataResults": [
+                    _metric_data_result("m0", [100, 100, 100], start=datetime.datetime(2018, 3, 15, 15, 9)),
+                    _metric_data_result("m1", [1.0, 0.6, 0.6], start=datetime.datetime(2018, 3, 15, 15, 9)),
+                ]
+            }
+            assert scaler.get_desired_instance_count() == 10
+
+    def test_classic_elbs_have_no_response_times(self, mock_boto3):
+        with pytest.raises(CannotLoadApp, match="response_time_target"):
+            ElbScaler(app_name, 1, 20, elb_name="notify-api", threshold=1000, response_time_target=0.5)
+
+    def test_every_scaler_is_served_by_one_call(self, mock_boto3):
+        cloudwatch_client = mock_boto3.client.return_value
+        api_scaler = self._get_scaler(name="api", target_group="targetgroup/api/1")
+        admin_scaler = self._get_scaler(name="admin", target_group="targetgroup/admin/2")
+        cloudwatch_client.get_metric_data.return_value = {
+            "MetricDataResults": [_metric_data_result("m0", [2500]), _metric_data_result("m1", [5500])]
+        }
+
+        with patch.dict(api_scaler.signal_cache.intervals, {"cloudwatch": 60}):
+            # admin sorts first
+            assert api_scaler.get_desired_instance_count() == 6
+            assert admin_scaler.get_desired_instance_count() == 3
+
+        cloudwatch_client.get_metric_data.assert_called_once()
+
+    def test_follows_pagination(self, mock_boto3):
+        cloudwatch_client = mock_boto3.client.return_value
+        cloudwatch_client.get_metric_data.side_effect = [
+            {"MetricDataResults": [_metric_data_result("m0", [1500])], "NextToken": "next"},
+            {
+                "MetricDataResults": [
+                    _metric_data_result("m0", [3500], start=datetime.datetime(2018, 3, 15, 15, 6)),
+                ]
+            },
+        ]
+        scaler = self._get_scaler()
+
+        assert scaler.get_desired_instance_count() == 4
+        assert cloudwatch_client.get_metric_data.call_args.kwargs["NextToken"] == "next"
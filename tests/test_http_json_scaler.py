@@ -0,0 +1,126 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import Mock, patch
+
+import pytest
+
+from app.exceptions import SourceUnavailable
+from app.http_json_scaler import HttpJsonScaler, find_json_path, reset_http_session
+
+app_name = "test-app"
+min_instances = 1
+max_instances = 10
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, dict(self.headers), self.client_address))
+        if self.path not in server.payloads:
+            self._respond(404, b"{}")
+            return
+        etag = '"{}"'.format(hash(json.dumps(server.payloads[self.path])))
+        if self.headers.get("If-None-Match") == etag:
+            self._respond(304, b"", etag)
+            return
+        self._respond(200, json.dumps(server.payloads[self.path]).encode(), etag)
+
+    def _respond(self, status, body, etag=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if etag:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    reset_http_session()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.payloads = {}
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    server.url = "http://127.0.0.1:{}".format(server.server_address[1])
+    yield server
+    server.shutdown()
+    server.server_close()
+    reset_http_session()
+
+
+def _get_scaler(url, json_path="queues.inflight", threshold=10, name=app_name):
+    scaler = HttpJsonScaler(name, min_instances, max_instances, url=url, json_path=json_path, threshold=threshold)
+    scaler.statsd_client = Mock()
+    return scaler
+
+
+class TestHttpJsonScaler:
+    def test_desired_instance_count_from_json_path(self, stub_server):
+        stub_server.payloads["/_status"] = {"queues": {"inflight": 45}}
+        scaler = _get_scaler(stub_server.url + "/_status")
+
+        assert scaler.get_desired_instance_count() == 5
+        scaler.statsd_client.gauge.assert_called_once_with("test-app.queues.inflight", 45)
+
+    def test_fetches_every_apps_url_at_once(self, stub_server):
+        stub_server.payloads["/a"] = {"queues": {"inflight": 30}}
+        stub_server.payloads["/b"] = {"queues": {"inflight": 70}}
+        scaler_a = _get_scaler(stub_server.url + "/a", name="app-a")
+        scaler_b = _get_scaler(stub_server.url + "/b", name="app-b")
+
+        with patch.dict(scaler_a.signal_cache.intervals, {"http": 10}):
+            assert scaler_a.get_desired_instance_count() == 3
+            assert scaler_b.get_desired_instance_count() == 7
+            assert scaler_a.get_desired_instance_count() == 3
+
+        assert sorted(path for path, _, _ in stub_server.requests) == ["/a", "/b"]
+
+    def test_conditional_requests_reuse_unchanged_payload(self, stub_server):
+        stub_server.payloads["/_status"] = {"queues": {"inflight": 45}}
+        scaler = _get_scaler(stub_server.url + "/_status")
+
+        assert scaler.get_desired_instance_count() == 5
+        scaler.signal_cache.clear()
+        assert scaler.get_desired_instance_count() == 5
+
+        first, second = stub_server.requests
+        assert "If-None-Match" not in first[1]
+        assert second[1]["If-None-Match"] == '"{}"'.format(hash(json.dumps({"queues": {"inflight": 45}})))
+
+    def test_connections_are_kept_alive(self, stub_server):
+        stub_server.payloads["/_status"] = {"queues": {"inflight": 45}}
+        scaler = _get_scaler(stub_server.url + "/_status")
+
+        for _ in range(3):
+            scaler.signal_cache.clear()
+            scaler.get_desired_instance_count()
+
+        assert len({client_address for _, _, client_address in stub_server.requests}) == 1
+
+    def test_failing_endpoint_does_not_affect_others(self, stub_server):
+        stub_server.payloads["/a"] = {"queues": {"inflight": 30}}
+        scaler_a = _get_scaler(stub_server.url + "/a", name="app-a")
+        scaler_b = _get_scaler(stub_server.url + "/missing", name="app-b")
+
+        assert scaler_a.get_desired_instance_count() == 3
+        with pytest.raises(SourceUnavailable):
+            scaler_b._get_desired_instance_count()
+
+    def test_missing_json_path_is_unavailable(self, stub_server):
+        stub_server.payloads["/_status"] = {"queues": {}}
+        scaler = _get_scaler(stub_server.url + "/_status")
+
+        with pytest.raises(SourceUnavailable):
+            scaler._get_desired_instance_count()
+
+
+def test_find_json_path():
+    assert find_json_path({"queues": [{"inflight": 3}]}, "queues.0.inflight") == 3
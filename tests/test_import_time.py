@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+
+# only the scalers that need them should load these, building an app that doesn't use them must not
+HEAVY_MODULES = {"boto3", "botocore", "psycopg2", "cloudfoundry_client", "redis"}
+
+LOADED_MODULES = """
+import sys
+from importlib.util import _LazyModule
+print("\\n".join(name for name, module in sys.modules.items() if not isinstance(module, _LazyModule)))
+"""
+
+
+def _run(args):
+    return subprocess.run([sys.executable] + args, capture_output=True, text=True, env=os.environ.copy(), check=True)
+
+
+def _imported_modules(code):
+    """Imports done by code in a fresh interpreter, as reported by -X importtime"""
+    stderr = _run(["-X", "importtime", "-c", code]).stderr
+    # lines look like "import time:       298 |      92104 |   app.circuit_breaker"
+    return {line.rsplit("|", 1)[1].strip() for line in stderr.splitlines() if line.startswith("import time:")}
+
+
+def _loaded_modules(code):
+    """Modules actually loaded once code has run, leaving out lazy ones nothing has touched yet"""
+    return set(_run(["-c", code + LOADED_MODULES]).stdout.split())
+
+
+def _top_level(modules):
+    return {module.split(".")[0] for module in modules}
+
+
+class TestImportTime:
+    def test_importing_app_loads_no_scaler_backends(self):
+        modules = _imported_modules("import app")
+
+        assert not _top_level(modules) & HEAVY_MODULES
+        assert "app.sqs_scaler" not in modules
+
+    def test_importing_base_scalers_loads_no_sdks(self):
+        modules = _imported_modules("import app.base_scalers")
+
+        assert "app.base_scalers" in modules
+        assert not _top_level(modules) & HEAVY_MODULES
+
+    def test_schedule_only_app_loads_no_sdks(self):
+        modules = _loaded_modules(
+            "from app.app import App; App('test-app', 1, 2, [{'type': 'ScheduleScaler', 'schedule': {}}])"
+        )
+
+        assert "app.schedule_scaler" in modules
+        assert "app.sqs_scaler" not in modules
+        assert not _top_level(modules) & HEAVY_MODULES
+
+    def test_sdk_is_loaded_once_used(self):
+        modules = _loaded_modules("from app.base_scalers import boto3; boto3.client")
+
+        assert "boto3" in modules
@@ -0,0 +1,149 @@
+import json
+import os
+
+from app.journal import DecisionJournal, journal_files, main, read_journal
+
+
+def _entry(timestamp, current=2, desired=4, new=4, app_name="test-app"):
+    return {
+        "timestamp": timestamp,
+        "apps": {
+            app_name: {
+                "current": current,
+                "desired": desired,
+                "new": new,
+                "min_instances": 1,
+                "max_instances": 10,
+                "stale": False,
+                "cooldown": {"last_scale_up": None, "last_scale_down": None},
+                "scalers": [{"type": "SqsScaler", "desired": desired, "inputs": {"queue-length": 40}, "latency": 0.1}],
+            }
+        },
+    }
+
+
+def _write(journal, entries):
+    journal.start()
+    for entry in entries:
+        journal.record(entry)
+    journal.close()
+
+
+class TestDecisionJournal:
+    def test_records_are_read_back_in_order(self, tmp_path):
+        entries = [_entry(t) for t in range(5)]
+        _write(DecisionJournal(str(tmp_path)), entries)
+
+        assert list(read_journal(str(tmp_path))) == entries
+
+    def test_records_are_compact_json_lines(self, tmp_path):
+        _write(DecisionJournal(str(tmp_path)), [_entry(1)])
+
+        with open(os.path.join(str(tmp_path), "journal.jsonl")) as f:
+            line = f.readline()
+        assert ", " not in line and ": " not in line
+        assert json.loads(line) == _entry(1)
+
+    def test_appends_across_restarts(self, tmp_path):
+        _write(DecisionJournal(str(tmp_path)), [_entry(1)])
+        _write(DecisionJournal(str(tmp_path)), [_entry(2)])
+
+        assert [entry["timestamp"] for entry in read_journal(str(tmp_path))] == [1, 2]
+
+    def test_rotates_and_keeps_backup_count_files(self, tmp_path):
+        line_length = len(json.dumps(_entry(100), separators=(",", ":"), sort_keys=True)) + 1
+        journal = DecisionJournal(str(tmp_path), max_bytes=line_length * 2, backup_count=2)
+        _write(journal, [_entry(100 + t) for t in range(7)])
+
+        assert [os.path.basename(path) for path in journal_files(str(tmp_path))] == [
+            "journal.2.jsonl",
+            "journal.1.jsonl",
+            "journal.jsonl",
+        ]
+        # the oldest file was rotated away, what is left is still in order
+        assert [entry["timestamp"] for entry in read_journal(str(tmp_path))] == [102, 103, 104, 105, 106]
+
+    def test_compressed_journal(self, tmp_path):
+        entries = [_entry(t) for t in range(3)]
+        _write(DecisionJournal(str(tmp_path), compress=True), entries)
+
+        assert os.path.exists(os.path.join(str(tmp_path), "journal.jsonl.gz"))
+        assert list(read_journal(str(tmp_path))) == entries
+
+    def test_reads_a_compressed_journal_that_is_still_being_written(self, tmp_path):
+        journal = DecisionJournal(str(tmp_path), compress=True)
+        entries = [_entry(t) for t in range(3)]
+        for entry in entries:
+            journal._write(entry)
+
+        try:
+            assert list(read_journal(str(tmp_path))) == entries
+        finally:
+            journal._file.close()
+
+    def test_reads_a_truncated_compressed_journal(self, tmp_path):
+        _write(DecisionJournal(str(tmp_path), compress=True), [_entry(t) for t in range(3)])
+        path = os.path.join(str(tmp_path), "journal.jsonl.gz")
+        with open(path, "rb") as f:
+            data = f.read()
+        with open(path, "wb") as f:
+            # cut into the end of stream marker
+            f.write(data[:-4])
+
+        assert [entry["timestamp"] for entry in read_journal(str(tmp_path))] == [0, 1, 2]
+
+    def test_compressed_journal_rotates_on_its_size_on_disk(self, tmp_path):
+        journal = DecisionJournal(str(tmp_path), compress=True)
+        journal._write(_entry(1))
+        journal._write(_entry(2))
+
+        try:
+            assert journal._bytes_written == os.path.getsize(os.path.join(str(tmp_path), "journal.jsonl.gz"))
+        finally:
+            journal._file.close()
+
+    def test_drops_records_instead_of_blocking_when_writer_is_behind(self, tmp_path):
+        journal = DecisionJournal(str(tmp_path), queue_size=2)
+        # not started, nothing takes records off the queue
+        for t in range(5):
+            journal.record(_entry(t))
+
+        assert journal._queue.qsize() == 2
+
+    def test_skips_truncated_last_line(self, tmp_path):
+        _write(DecisionJournal(str(tmp_path)), [_entry(1)])
+        with open(os.path.join(str(tmp_path), "journal.jsonl"), "a") as f:
+            f.write('{"timestamp": 2, "ap')
+
+        assert [entry["timestamp"] for entry in read_journal(str(tmp_path))] == [1]
+
+    def test_filters_on_app(self, tmp_path):
+        entry = _entry(1)
+        entry["apps"].update(_entry(1, app_name="other-app")["apps"])
+        _write(DecisionJournal(str(tmp_path)), [entry, _entry(2, app_name="other-app")])
+
+        records = list(read_journal(str(tmp_path), "test-app"))
+        assert [list(record["apps"]) for record in records] == [["test-app"]]
+
+
+class TestJournalCli:
+    def test_prints_records(self, tmp_path, capsys):
+        _write(DecisionJournal(str(tmp_path)), [_entry(1), _entry(2)])
+
+        assert main([str(tmp_path)]) == 0
+        lines = capsys.readouterr().out.splitlines()
+        assert [json.loads(line)["timestamp"] for line in lines] == [1, 2]
+
+    def test_replays_into_the_controller(self, tmp_path, capsys):
+        _write(DecisionJournal(str(tmp_path)), [_entry(t * 60, current=2, desired=6, new=6) for t in range(3)])
+
+        assert main([str(tmp_path), "--replay", "test-app"]) == 0
+        lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+        assert [line["recorded"] for line in lines] == [6, 6, 6]
+        # the recorded count never moves in an open loop replay, so the controller's integral keeps on growing
+        assert [line["replayed"] for line in lines] == [3, 5, 7]
+
+    def test_replay_of_unknown_app(self, tmp_path, capsys):
+        _write(DecisionJournal(str(tmp_path)), [_entry(1)])
+
+        assert main([str(tmp_path), "--replay", "other-app"]) == 1
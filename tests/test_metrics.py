@@ -0,0 +1,125 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from app.metrics import MetricsRegistry, MetricsServer
+
+
+class FakeClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestMetricsRegistry:
+    def test_render_gauges_with_labels(self):
+        registry = MetricsRegistry()
+        registry.set_gauge("autoscaler_app_instances", 4, app="notify-api", kind="current")
+
+        assert '# TYPE autoscaler_app_instances gauge\nautoscaler_app_instances{app="notify-api",kind="current"} 4' in (
+            registry.render()
+        )
+
+    def test_render_counters(self):
+        registry = MetricsRegistry()
+        registry.inc("autoscaler_errors_total", source="sqs")
+        registry.inc("autoscaler_errors_total", source="sqs")
+
+        assert 'autoscaler_errors_total{source="sqs"} 2' in registry.render()
+
+    def test_render_histogram(self):
+        registry = MetricsRegistry()
+        registry.observe("autoscaler_tick_duration_seconds", 0.3, buckets=(0.1, 0.5, 1))
+        registry.observe("autoscaler_tick_duration_seconds", 0.7, buckets=(0.1, 0.5, 1))
+
+        rendered = registry.render()
+        assert 'autoscaler_tick_duration_seconds_bucket{le="0.1"} 0' in rendered
+        assert 'autoscaler_tick_duration_seconds_bucket{le="0.5"} 1' in rendered
+        assert 'autoscaler_tick_duration_seconds_bucket{le="1"} 2' in rendered
+        assert 'autoscaler_tick_duration_seconds_bucket{le="+Inf"} 2' in rendered
+        assert "autoscaler_tick_duration_seconds_sum 1.0" in rendered
+        assert "autoscaler_tick_duration_seconds_count 2" in rendered
+
+    def test_render_escapes_label_values(self):
+        registry = MetricsRegistry()
+        registry.set_gauge("some_gauge", 1, metric='a"b')
+
+        assert 'some_gauge{metric="a\\"b"} 1' in registry.render()
+
+    def test_render_includes_collectors(self):
+        registry = MetricsRegistry()
+        registry.add_collector(lambda: [("autoscaler_signal_cache_hits_total", {"signal": "sqs"}, 3)])
+
+        assert 'autoscaler_signal_cache_hits_total{signal="sqs"} 3' in registry.render()
+
+    def test_seconds_since_last_tick(self):
+        clock = FakeClock(100)
+        registry = MetricsRegistry(clock=clock)
+
+        clock.now = 130
+        assert registry.seconds_since_last_tick() == 30
+
+        registry.mark_tick()
+        clock.now = 135
+        assert registry.seconds_since_last_tick() == 5
+
+
+class TestMetricsServer:
+    @pytest.fixture
+    def server(self):
+        self.clock = FakeClock(100)
+        self.registry = MetricsRegistry(clock=self.clock)
+        server = MetricsServer(0, max_tick_age_seconds=60, registry=self.registry, host="127.0.0.1", token="secret")
+        server.start()
+        yield server
+        server.stop()
+
+    def _get(self, server, path, token=None):
+        request = urllib.request.Request("http://127.0.0.1:{}{}".format(server.port, path))
+        if token is not None:
+            request.add_header("Authorization", "Bearer {}".format(token))
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return response.status, response.read().decode()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read().decode()
+
+    def test_metrics(self, server):
+        self.registry.set_gauge("autoscaler_app_instances", 2, app="notify-api", kind="new")
+
+        status, body = self._get(server, "/metrics", token="secret")
+
+        assert status == 200
+        assert 'autoscaler_app_instances{app="notify-api",kind="new"} 2' in body
+
+    def test_metrics_needs_the_token(self, server):
+        assert self._get(server, "/metrics")[0] == 404
+        assert self._get(server, "/metrics", token="wrong")[0] == 404
+
+    def test_metrics_is_not_served_without_a_token(self):
+        server = MetricsServer(0, max_tick_age_seconds=60, registry=MetricsRegistry(), host="127.0.0.1")
+        server.start()
+        try:
+            assert self._get(server, "/metrics", token="")[0] == 404
+        finally:
+            server.stop()
+
+    def test_healthz_ok(self, server):
+        self.registry.mark_tick()
+        self.clock.now += 59
+
+        assert self._get(server, "/healthz") == (200, "ok\n")
+
+    def test_healthz_stale(self, server):
+        self.registry.mark_tick()
+        self.clock.now += 61
+
+        status, body = self._get(server, "/healthz")
+        assert status == 503
+        assert body.startswith("stale")
+
+    def test_unknown_path(self, server):
+        assert self._get(server, "/nope")[0] == 404
@@ -1,8 +1,14 @@
 # flake8: noqa
 
-from unittest.mock import MagicMock, PropertyMock, patch
+from http import HTTPStatus
+from unittest.mock import MagicMock, Mock, PropertyMock, patch
 
-from app.paas_client import PaasClient
+import pytest
+from cloudfoundry_client.errors import InvalidStatusCode
+
+from app.cf_session import CfApiAdapter
+from app.exceptions import CfAuthUnavailable
+from app.paas_client import PaasClient, count_instance_states
 
 ENV = {
     "CF_USERNAME": "test_username",
@@ -131,14 +137,19 @@ MockOrgs = [
 
 @patch.dict("app.config.config", CONFIG)
 @patch.dict("os.environ", ENV)
-@patch("app.paas_client.CloudFoundryClient")
+@patch("app.cf_session.CloudFoundryClient")
 class TestPaasClient:
-    def test_paas_client_login_fails_waits_5_minutes(self, mock_paas_client_client, *args):
+    def test_paas_client_login_fails_without_blocking(self, mock_paas_client_client, *args):
         mock_paas_client_client.return_value.init_with_user_credentials.side_effect = Exception("Login failed")
-        with patch("app.paas_client.time") as mock_time:
+        with patch("app.cf_session.time") as mock_time:
             paas_client = PaasClient()
-            paas_client.get_cloudfoundry_client()
-            mock_time.sleep.assert_called_once_with(5 * 60)
+            with pytest.raises(CfAuthUnavailable):
+                paas_client.get_paas_apps()
+            # the next call doesn't try again until the backoff is over
+            with pytest.raises(CfAuthUnavailable, match="Not logging in"):
+                paas_client.get_paas_apps()
+            mock_time.sleep.assert_not_called()
+        mock_paas_client_client.return_value.init_with_user_credentials.assert_called_once()
 
     def test_get_paas_apps(self, mock_paas_client_client, *args):
         logged_in_mock_client = mock_paas_client_client.return_value
@@ -170,3 +181,94 @@ class TestPaasClient:
             "app8": {"name": "app8", "instances": 4, "guid": "notify-test-app8"},
             "app9": {"name": "app9", "instances": 5, "guid": "notify-test-app9"},
         }
+
+    def test_get_paas_apps_in_another_space(self, mock_paas_client_client, *args):
+        mock_paas_client_client.return_value.organizations = MockOrgs
+
+        instances = PaasClient(space="another-space").get_paas_apps()
+
+        assert sorted(instances) == ["app10", "app11", "app12"]
+
+    def test_clients_share_one_login_per_api(self, mock_paas_client_client, *args):
+        mock_paas_client_client.return_value.organizations = MockOrgs
+
+        PaasClient().get_paas_apps()
+        PaasClient(space="another-space").get_paas_apps()
+
+        mock_paas_client_client.return_value.init_with_user_credentials.assert_called_once_with(
+            "test_username", "test_password"
+        )
+
+    def test_get_app_stats_by_guid(self, mock_paas_client_client, *args):
+        stats = {"0": {"state": "RUNNING", "stats": {"uptime": 10}}}
+        mock_paas_client_client.return_value.v2.apps.get_stats.return_value = stats
+        paas_client = PaasClient()
+
+        assert paas_client.get_app_stats("app7", "notify-test-app7") == stats
+        mock_paas_client_client.return_value.v2.apps.get_stats.assert_called_once_with("notify-test-app7")
+        mock_paas_client_client.return_value.v2.apps.get_first.assert_not_called()
+
+    def test_app_stats_are_cached_per_guid(self, mock_paas_client_client, *args):
+        get_stats = mock_paas_client_client.return_value.v2.apps.get_stats
+        get_stats.side_effect = lambda guid: {"0": {"guid": guid}}
+        paas_client = PaasClient()
+
+        with patch.dict(paas_client.signal_cache.intervals, {"cf_stats": 5}):
+            assert paas_client.get_app_stats("app7", "guid-in-test") == {"0": {"guid": "guid-in-test"}}
+            assert paas_client.get_app_stats("app7", "guid-in-staging") == {"0": {"guid": "guid-in-staging"}}
+            assert paas_client.get_app_stats("app7", "guid-in-test") == {"0": {"guid": "guid-in-test"}}
+
+        assert get_stats.call_count == 2
+
+
+class TestCountInstanceStates:
+    def test_counts_states(self):
+        stats = {
+            "0": {"state": "RUNNING", "stats": {"uptime": 600}},
+            "1": {"state": "RUNNING", "stats": {"uptime": 600}},
+            "2": {"state": "STARTING", "stats": {"uptime": 0}},
+            "3": {"state": "CRASHED", "stats": {}},
+            "4": {"state": "DOWN"},
+        }
+
+        assert count_instance_states(stats) == {"ready": 2, "starting": 1, "crashed": 2}
+
+    def test_running_instances_warm_up_before_they_count_as_ready(self):
+        stats = {
+            "0": {"state": "RUNNING", "stats": {"uptime": 600}},
+            "1": {"state": "RUNNING", "stats": {"uptime": 20}},
+        }
+
+        assert count_instance_states(stats, ready_after_uptime_seconds=30) == {"ready": 1, "starting": 1, "crashed": 0}
+
+
+@patch.dict("app.config.config", CONFIG)
+@patch.dict("os.environ", ENV)
+@patch("app.cf_session.CloudFoundryClient")
+class TestPaasClientThrottling:
+    def test_requests_go_through_the_session_adapter(self, mock_paas_client_client):
+        session = mock_paas_client_client.return_value._session
+        PaasClient().get_cloudfoundry_client()
+
+        adapters = {call.args[0]: call.args[1] for call in session.mount.call_args_list}
+        assert set(adapters) == {"https://", "http://"}
+        assert isinstance(adapters["https://"], CfApiAdapter)
+
+    def test_update_is_not_retried_on_top_of_the_adapter(self, mock_paas_client_client):
+        logged_in_mock_client = mock_paas_client_client.return_value
+        logged_in_mock_client.apps._update.side_effect = InvalidStatusCode(HTTPStatus.SERVICE_UNAVAILABLE, {})
+        paas_client = PaasClient()
+        paas_client.get_cloudfoundry_client()
+
+        with pytest.raises(InvalidStatusCode):
+            paas_client.update("some-guid", 5)
+
+        logged_in_mock_client.apps._update.assert_called_once_with("some-guid", {"instances": 5})
+
+    def test_get_paas_apps_keeps_client_when_throttled(self, mock_paas_client_client):
+        orgs_mock = PropertyMock(side_effect=InvalidStatusCode(HTTPStatus.TOO_MANY_REQUESTS, {}))
+        type(mock_paas_client_client.return_value).organizations = orgs_mock
+        paas_client = PaasClient()
+
+        assert paas_client.get_paas_apps() == {}
+        assert paas_client.client is not None
@@ -0,0 +1,85 @@
+from unittest.mock import Mock
+
+import pytest
+
+from app.app import App
+from app.exceptions import CannotLoadConfig
+from app.pipeline import pipeline_order
+
+
+def _app(name, *upstream, min_instances=1, max_instances=20):
+    return App(name, min_instances, max_instances, [], upstream=[{"app": u, "fan_out": 0.5} for u in upstream])
+
+
+class TestPipelineOrder:
+    def test_upstream_apps_come_first(self):
+        sender = _app("sender", "api", "jobs")
+        jobs = _app("jobs", "api")
+        api = _app("api")
+
+        names = [app.name for app in pipeline_order([sender, jobs, api])]
+
+        assert names.index("api") < names.index("jobs") < names.index("sender")
+
+    def test_unknown_upstream_app(self):
+        with pytest.raises(CannotLoadConfig, match="unknown upstream app api"):
+            pipeline_order([_app("sender", "api")])
+
+    def test_cycle(self):
+        with pytest.raises(CannotLoadConfig, match="cycle"):
+            pipeline_order([_app("a", "b"), _app("b", "a")])
+
+
+class TestUpstreamInstanceCount:
+    def test_highest_of_the_upstream_apps_times_fan_out(self):
+        app = App("sender", 1, 20, [], upstream=[{"app": "api", "fan_out": 0.5}, {"app": "jobs", "fan_out": 2}])
+        assert app.get_upstream_instance_count({"api": 9, "jobs": 2}) == 5
+
+    def test_clamped_to_instance_limits(self):
+        app = _app("sender", "api", min_instances=2, max_instances=4)
+        assert app.get_upstream_instance_count({"api": 1}) == 2
+        assert app.get_upstream_instance_count({"api": 20}) == 4
+
+    def test_none_without_upstream_counts(self):
+        assert _app("sender", "api").get_upstream_instance_count({}) is None
+
+
+class TestLoadInstanceCount:
+    def _with_scaler_load(self, app, load):
+        app.scalers = [Mock(last_load_instance_count=load)]
+        return app
+
+    def test_idle_app_is_not_held_at_its_floor(self):
+        api = self._with_scaler_load(_app("api", min_instances=6), 0)
+        sender = _app("sender", "api")
+
+        assert api.get_load_instance_count() == 0
+        assert sender.get_upstream_instance_count({"api": api.get_load_instance_count()}) == 1
+
+    def test_capped_at_max_instances(self):
+        api = self._with_scaler_load(_app("api", max_instances=10), 30)
+
+        assert api.get_load_instance_count() == 10
+
+    def test_includes_the_share_of_upstream_load(self):
+        sender = self._with_scaler_load(_app("sender", "api"), 1)
+
+        # passed on down the pipeline, api -> sender -> the apps following sender
+        assert sender.get_load_instance_count({"api": 12}) == 6
+
+    def test_scalers_that_have_not_run_are_skipped(self):
+        api = self._with_scaler_load(_app("api"), None)
+
+        assert api.get_load_instance_count() == 0
+
+
+class TestAppKey:
+    def test_apps_in_the_default_space_are_keyed_by_name(self):
+        assert App("api", 1, 2, []).key == "api"
+
+    def test_apps_in_other_spaces_include_org_and_space(self):
+        app = App("api", 1, 2, [], space="staging", upstream=[{"app": "jobs"}])
+
+        assert app.key == "govuk-notify.staging.api"
+        # upstream apps are looked for in the same space
+        assert app.upstream == [("govuk-notify.staging.jobs", 1.0)]
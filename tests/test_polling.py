@@ -0,0 +1,98 @@
+from unittest.mock import Mock
+
+import pytest
+
+from app.circuit_breaker import CLOSED, OPEN, get_circuit_breaker
+from app.exceptions import SourceUnavailable
+from app.polling import SignalCache
+
+
+class FakeClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestSignalCache:
+    def setup_method(self, method):
+        self.clock = FakeClock(1000.0)
+        self.cache = SignalCache({"sqs": 2, "cloudwatch": 60}, aligned_signals={"cloudwatch"}, clock=self.clock)
+
+    def test_value_is_reused_within_interval(self):
+        fetch = Mock(side_effect=[1, 2])
+
+        assert self.cache.get("sqs", "queue", fetch) == 1
+        self.clock.now += 1
+        assert self.cache.get("sqs", "queue", fetch) == 1
+        assert fetch.call_count == 1
+        assert self.cache.hits["sqs"] == 1
+        assert self.cache.misses["sqs"] == 1
+
+    def test_failing_fetch_goes_through_the_signal_breaker(self):
+        fetch = Mock(side_effect=ConnectionError("timed out"))
+
+        for _ in range(get_circuit_breaker("sqs", "queue").failure_threshold):
+            with pytest.raises(SourceUnavailable):
+                self.cache.get("sqs", "queue", fetch)
+        assert get_circuit_breaker("sqs", "queue").state == OPEN
+
+        fetch.reset_mock()
+        with pytest.raises(SourceUnavailable):
+            self.cache.get("sqs", "queue", fetch)
+        fetch.assert_not_called()
+
+    def test_one_failing_key_does_not_cut_off_the_others(self):
+        failing = Mock(side_effect=ConnectionError("timed out"))
+        for _ in range(get_circuit_breaker("sqs", "deleted-queue").failure_threshold):
+            with pytest.raises(SourceUnavailable):
+                self.cache.get("sqs", "deleted-queue", failing)
+
+        assert self.cache.get("sqs", "queue", Mock(return_value=1)) == 1
+        assert get_circuit_breaker("sqs", "queue").state == CLOSED
+
+    def test_value_is_refetched_after_interval(self):
+        fetch = Mock(side_effect=[1, 2])
+
+        self.cache.get("sqs", "queue", fetch)
+        self.clock.now += 2
+
+        assert self.cache.get("sqs", "queue", fetch) == 2
+
+    def test_aligned_signal_expires_on_the_boundary(self):
+        fetch = Mock(side_effect=[1, 2])
+
+        # 1000 is 40 seconds into a minute, the value is only good until 1020
+        self.cache.get("cloudwatch", "metric", fetch)
+        self.clock.now = 1019
+        assert self.cache.get("cloudwatch", "metric", fetch) == 1
+        self.clock.now = 1020
+        assert self.cache.get("cloudwatch", "metric", fetch) == 2
+
+    def test_keys_are_cached_separately(self):
+        assert self.cache.get("sqs", "queue-1", Mock(return_value=1)) == 1
+        assert self.cache.get("sqs", "queue-2", Mock(return_value=2)) == 2
+
+    def test_unknown_signal_is_never_cached(self):
+        fetch = Mock(side_effect=[1, 2])
+
+        self.cache.get("cf_apps", "key", fetch)
+
+        assert self.cache.get("cf_apps", "key", fetch) == 2
+
+    def test_none_is_not_cached(self):
+        fetch = Mock(side_effect=[None, 2])
+
+        assert self.cache.get("sqs", "queue", fetch) is None
+        assert self.cache.get("sqs", "queue", fetch) == 2
+
+    def test_invalidate(self):
+        fetch = Mock(side_effect=[1, 2, 3])
+        self.cache.get("sqs", "queue-1", fetch)
+        self.cache.get("sqs", "queue-2", fetch)
+
+        self.cache.invalidate("sqs", "queue-1")
+
+        assert self.cache.get("sqs", "queue-1", fetch) == 3
+        assert self.cache.get("sqs", "queue-2", fetch) == 2
@@ -0,0 +1,91 @@
+import fakeredis
+import pytest
+
+from app.profiler import REDIS_FLAG_KEY, TickProfiler
+
+
+def _tick():
+    return sum(i * i for i in range(1000))
+
+
+class TestTickProfiler:
+    @pytest.fixture(autouse=True)
+    def no_env_flag(self, monkeypatch):
+        monkeypatch.delenv("AUTOSCALER_PROFILE_TICKS", raising=False)
+
+    def test_off_by_default(self, tmp_path):
+        profiler = TickProfiler(str(tmp_path))
+
+        assert profiler.run(_tick) == _tick()
+        assert profiler.profile is None
+        assert list(tmp_path.iterdir()) == []
+
+    def test_profiles_requested_ticks_then_switches_off(self, tmp_path):
+        profiler = TickProfiler(str(tmp_path))
+        profiler.request(2)
+
+        profiler.run(_tick)
+        assert list(tmp_path.iterdir()) == []
+        profiler.run(_tick)
+
+        reports = list(tmp_path.iterdir())
+        assert len(reports) == 1
+        report = reports[0].read_text()
+        assert report.startswith("Profile of 2 ticks")
+        assert "==== Scalers ====" in report
+        assert "==== External calls ====" in report
+        assert "_tick" in report
+
+        assert profiler.remaining_ticks == 0
+        assert profiler.profile is None
+
+    def test_request_does_not_extend_a_running_profile(self, tmp_path):
+        profiler = TickProfiler(str(tmp_path))
+        profiler.request(2)
+        profiler.run(_tick)
+
+        profiler.request(10)
+
+        assert profiler.remaining_ticks == 1
+
+    def test_enabled_from_env_var(self, tmp_path, monkeypatch):
+        monkeypatch.setenv("AUTOSCALER_PROFILE_TICKS", "3")
+
+        assert TickProfiler(str(tmp_path)).remaining_ticks == 3
+
+    def test_enabled_from_redis_flag(self, tmp_path):
+        redis_client = fakeredis.FakeRedis()
+        redis_client.set(REDIS_FLAG_KEY, 1)
+        profiler = TickProfiler(str(tmp_path), redis_client=redis_client)
+
+        profiler.run(_tick)
+
+        assert len(list(tmp_path.iterdir())) == 1
+        # the flag is consumed so the next check doesn't start another profile
+        assert redis_client.get(REDIS_FLAG_KEY) is None
+
+    def test_bad_env_var_is_ignored(self, tmp_path, monkeypatch, caplog):
+        monkeypatch.setenv("AUTOSCALER_PROFILE_TICKS", "yes")
+
+        assert TickProfiler(str(tmp_path)).remaining_ticks == 0
+        assert "AUTOSCALER_PROFILE_TICKS" in caplog.text
+
+    def test_bad_redis_flag_is_ignored_and_cleared(self, tmp_path, caplog):
+        redis_client = fakeredis.FakeRedis()
+        redis_client.set(REDIS_FLAG_KEY, "lots")
+        profiler = TickProfiler(str(tmp_path), redis_client=redis_client)
+
+        assert profiler.run(_tick) == _tick()
+
+        assert profiler.remaining_ticks == 0
+        assert redis_client.get(REDIS_FLAG_KEY) is None
+        assert "'lots'" in caplog.text
+
+    def test_errors_writing_the_report_are_logged(self, tmp_path, caplog):
+        profiler = TickProfiler(str(tmp_path / "missing"))
+        profiler.request(1)
+
+        profiler.run(_tick)
+
+        assert "Could not write profile" in caplog.text
+        assert profiler.profile is None
@@ -0,0 +1,58 @@
+from app.rate_limiter import PRIORITY_READ, PRIORITY_UPDATE, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestTokenBucket:
+    def setup_method(self, method):
+        self.clock = FakeClock()
+
+    def _get_bucket(self, rate=1, capacity=5, reserved_for_updates=0):
+        return TokenBucket(rate, capacity, reserved_for_updates, clock=self.clock, sleep=self.clock.sleep)
+
+    def test_acquire_does_not_wait_within_capacity(self):
+        bucket = self._get_bucket(capacity=3)
+
+        assert [bucket.acquire() for _ in range(3)] == [0, 0, 0]
+        assert self.clock.now == 0
+
+    def test_acquire_waits_for_refill_once_empty(self):
+        bucket = self._get_bucket(rate=2, capacity=1)
+
+        assert bucket.acquire() == 0
+        assert bucket.acquire() == 0.5
+        assert self.clock.now == 0.5
+
+    def test_reads_leave_reserved_tokens_for_updates(self):
+        bucket = self._get_bucket(rate=1, capacity=3, reserved_for_updates=2)
+
+        assert bucket.acquire(PRIORITY_READ) == 0
+        # only the reserved tokens are left, reads have to wait but updates do not
+        assert bucket.acquire(PRIORITY_UPDATE) == 0
+        assert bucket.acquire(PRIORITY_UPDATE) == 0
+        assert bucket.acquire(PRIORITY_READ) == 3
+
+    def test_block_for_delays_every_priority(self):
+        bucket = self._get_bucket(capacity=5)
+
+        bucket.block_for(7)
+
+        assert bucket.acquire(PRIORITY_UPDATE) == 7
+        assert bucket.acquire(PRIORITY_READ) == 0
+
+    def test_block_for_never_shortens_an_existing_block(self):
+        bucket = self._get_bucket()
+
+        bucket.block_for(10)
+        bucket.block_for(2)
+
+        assert bucket.acquire() == 10
@@ -0,0 +1,99 @@
+from unittest.mock import Mock, patch
+
+import fakeredis
+import pytest
+
+from app.exceptions import SourceUnavailable
+from app.redis_queue_scaler import (
+    RedisQueueScaler,
+    get_broker_client,
+    reset_broker_clients,
+)
+
+REDIS_URL = "redis://broker.local"
+app_name = "test-app"
+min_instances = 1
+max_instances = 10
+
+
+@pytest.fixture(autouse=True)
+def broker():
+    reset_broker_clients()
+    with patch("app.redis_queue_scaler.Redis", fakeredis.FakeRedis):
+        client = get_broker_client(REDIS_URL)
+        client.flushall()
+        yield client
+    reset_broker_clients()
+
+
+def _get_scaler(queues, name=app_name, threshold=100):
+    scaler = RedisQueueScaler(
+        name, min_instances, max_instances, queues=queues, threshold=threshold, redis_url=REDIS_URL
+    )
+    scaler.statsd_client = Mock()
+    return scaler
+
+
+class TestRedisQueueScaler:
+    def test_init_assigns_basic_values(self):
+        scaler = _get_scaler("send-sms-tasks")
+
+        assert scaler.queues == ["send-sms-tasks"]
+        assert scaler.queue_length_threshold == 100
+        assert scaler.redis_url == REDIS_URL
+
+    def test_desired_instance_count_from_queue_lengths(self, broker):
+        broker.rpush("send-sms-tasks", *range(250))
+        broker.rpush("send-email-tasks", *range(100))
+        scaler = _get_scaler(["send-sms-tasks", "send-email-tasks"])
+
+        assert scaler.get_desired_instance_count() == 4
+        scaler.statsd_client.gauge.assert_any_call("send-sms-tasks.queue-length", 250)
+        scaler.statsd_client.gauge.assert_any_call("send-email-tasks.queue-length", 100)
+
+    def test_missing_queue_is_empty(self):
+        assert _get_scaler(["send-sms-tasks"]).get_desired_instance_count() == min_instances
+
+    def test_key_patterns_include_priority_queues(self, broker):
+        broker.rpush("send-sms-tasks", *range(100))
+        broker.rpush("send-sms-tasks\x06\x163", *range(100))
+        broker.rpush("send-sms-tasks\x06\x169", *range(100))
+        broker.rpush("send-email-tasks", *range(500))
+        scaler = _get_scaler(["send-sms-tasks*"])
+
+        assert scaler.get_desired_instance_count() == 3
+
+    def test_keys_that_are_not_lists_are_skipped(self, broker):
+        broker.set("send-sms-tasks-lock", "1")
+        broker.rpush("send-sms-tasks", *range(200))
+
+        assert _get_scaler(["send-sms-tasks*"]).get_desired_instance_count() == 2
+
+    def test_one_round_trip_for_every_app(self, broker):
+        broker.rpush("send-sms-tasks", *range(300))
+        broker.rpush("send-email-tasks", *range(500))
+        sms_scaler = _get_scaler(["send-sms-tasks"], name="sms-app")
+        email_scaler = _get_scaler(["send-email-tasks"], name="email-app")
+
+        with patch.dict(sms_scaler.signal_cache.intervals, {"redis_queues": 2}):
+            with patch.object(broker, "pipeline", wraps=broker.pipeline) as pipeline:
+                assert sms_scaler.get_desired_instance_count() == 3
+                assert email_scaler.get_desired_instance_count() == 5
+
+        pipeline.assert_called_once_with(transaction=False)
+
+    def test_broker_down_falls_back_to_last_good_value(self, broker):
+        broker.rpush("send-sms-tasks", *range(300))
+        scaler = _get_scaler(["send-sms-tasks"])
+        assert scaler.get_desired_instance_count() == 3
+        scaler.signal_cache.clear()
+
+        with patch.object(broker, "pipeline", side_effect=ConnectionError("connection refused")):
+            assert scaler.get_desired_instance_count() == 3
+        assert scaler.stale
+
+    def test_broker_down_without_good_value(self, broker):
+        scaler = _get_scaler(["send-sms-tasks"])
+        with patch.object(broker, "pipeline", side_effect=ConnectionError("connection refused")):
+            with pytest.raises(SourceUnavailable):
+                scaler._get_desired_instance_count()
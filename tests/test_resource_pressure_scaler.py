@@ -0,0 +1,82 @@
+from unittest.mock import patch
+
+import pytest
+
+from app.exceptions import CannotLoadApp
+from app.resource_pressure_scaler import ResourcePressureScaler
+
+app_name = "test-app"
+min_instances = 1
+max_instances = 10
+GB = 1024**3
+
+
+@patch("app.paas_client.PaasClient")
+class TestResourcePressureScaler:
+    def test_init_assigns_relevant_values(self, mock_paas_client):
+        scaler = ResourcePressureScaler(app_name, min_instances, max_instances)
+
+        assert scaler.resource == "memory"
+        assert scaler.aggregation == "mean"
+        assert scaler.threshold == 80
+
+    @pytest.mark.parametrize("attrs", [{"resource": "cpu"}, {"aggregation": "median"}])
+    def test_init_rejects_unknown_options(self, mock_paas_client, attrs):
+        with pytest.raises(CannotLoadApp):
+            ResourcePressureScaler(app_name, min_instances, max_instances, **attrs)
+
+    @pytest.mark.parametrize(
+        "aggregation,expected",
+        [
+            # 4 instances at 50%, 50%, 50% and 100% of their memory
+            ("mean", 4),
+            ("max", 6),
+            ("p90", 6),
+        ],
+    )
+    def test_get_desired_instance_count(self, mock_paas_client, aggregation, expected):
+        scaler = ResourcePressureScaler(
+            app_name, min_instances, max_instances, resource="memory", aggregation=aggregation, threshold=70
+        )
+        mock_paas_client.return_value.get_app_stats.return_value = _get_app_stats(mem=[1, 1, 1, 2], mem_quota=2)
+
+        assert scaler.get_desired_instance_count() == expected
+
+    def test_disk(self, mock_paas_client):
+        scaler = ResourcePressureScaler(app_name, min_instances, max_instances, resource="disk", threshold=50)
+        mock_paas_client.return_value.get_app_stats.return_value = _get_app_stats(disk=[3, 3], disk_quota=4)
+
+        assert scaler.get_desired_instance_count() == 3
+
+    def test_instances_without_usage_are_skipped(self, mock_paas_client):
+        scaler = ResourcePressureScaler(app_name, min_instances, max_instances, threshold=50)
+        stats = _get_app_stats(mem=[2], mem_quota=2)
+        stats["1"] = {"state": "STARTING", "stats": {}}
+        mock_paas_client.return_value.get_app_stats.return_value = stats
+
+        assert scaler.get_desired_instance_count() == 2
+
+    def test_reads_the_same_stats_as_cpu_scaler(self, mock_paas_client):
+        scaler = ResourcePressureScaler(app_name, min_instances, max_instances)
+        scaler.refresh_cf_info({"name": app_name, "guid": "app-guid", "instances": 1})
+        mock_paas_client.return_value.get_app_stats.return_value = _get_app_stats(mem=[1], mem_quota=2)
+
+        scaler.get_desired_instance_count()
+
+        mock_paas_client.return_value.get_app_stats.assert_called_once_with(app_name, "app-guid")
+
+
+# matches the schema of the CF `stats` endpoint, sizes in GB
+def _get_app_stats(mem=None, mem_quota=1, disk=None, disk_quota=1):
+    count = len(mem or disk)
+    return {
+        str(idx): {
+            "state": "RUNNING",
+            "stats": {
+                "usage": {"cpu": 0.1, "mem": (mem or [0] * count)[idx] * GB, "disk": (disk or [0] * count)[idx] * GB},
+                "mem_quota": mem_quota * GB,
+                "disk_quota": disk_quota * GB,
+            },
+        }
+        for idx in range(count)
+    }
@@ -0,0 +1,124 @@
+import threading
+from http import HTTPStatus
+from unittest.mock import Mock
+
+from cloudfoundry_client.errors import InvalidStatusCode
+
+from app.scale_dispatcher import ScaleDispatcher
+
+
+def _get_mock_app(name):
+    app = Mock()
+    app.name = name
+    app.cf_attributes = {"name": name, "guid": name + "-guid", "instances": 2}
+    return app
+
+
+def _deployment_in_flight():
+    return InvalidStatusCode(
+        status_code=HTTPStatus.UNPROCESSABLE_ENTITY, body={"error_code": "CF-ScaleDisabledDuringDeployment"}
+    )
+
+
+class TestScaleDispatcher:
+    def test_coalesces_updates_for_the_same_app(self):
+        paas_client = Mock()
+        dispatcher = ScaleDispatcher(paas_client)
+        app = _get_mock_app("app-1")
+
+        dispatcher.submit(app, 4)
+        dispatcher.submit(app, 5)
+        dispatcher.dispatch()
+
+        paas_client.update.assert_called_once_with("app-1-guid", 5)
+
+    def test_sends_updates_concurrently(self):
+        apps = [_get_mock_app("app-{}".format(i)) for i in range(3)]
+        barrier = threading.Barrier(len(apps), timeout=5)
+        paas_client = Mock()
+        # every update waits for the others, so this only gets through if they are in flight at the same time
+        paas_client.update.side_effect = lambda guid, instances: barrier.wait()
+        dispatcher = ScaleDispatcher(paas_client, max_workers=len(apps))
+        on_success = Mock()
+
+        for app in apps:
+            dispatcher.submit(app, 3, on_success)
+        dispatcher.dispatch()
+
+        assert paas_client.update.call_count == 3
+        assert on_success.call_count == 3
+
+    def test_holds_updates_blocked_by_a_deployment(self):
+        paas_client = Mock()
+        paas_client.update.side_effect = _deployment_in_flight()
+        dispatcher = ScaleDispatcher(paas_client)
+        app = _get_mock_app("app-1")
+        on_success = Mock()
+
+        dispatcher.submit(app, 4, on_success)
+        dispatcher.dispatch()
+        on_success.assert_not_called()
+        assert list(dispatcher.held) == ["app-1-guid"]
+
+        paas_client.update.side_effect = None
+        dispatcher.dispatch()
+        on_success.assert_called_once_with()
+        assert paas_client.update.call_count == 2
+        assert dispatcher.held == {}
+
+    def test_newer_update_replaces_held_one(self):
+        paas_client = Mock()
+        paas_client.update.side_effect = _deployment_in_flight()
+        dispatcher = ScaleDispatcher(paas_client)
+        app = _get_mock_app("app-1")
+
+        dispatcher.submit(app, 4)
+        dispatcher.dispatch()
+        paas_client.update.side_effect = None
+        dispatcher.submit(app, 6)
+        dispatcher.dispatch()
+
+        assert paas_client.update.call_args_list[-1].args == ("app-1-guid", 6)
+        assert paas_client.update.call_count == 2
+
+    def test_other_errors_are_not_retried(self):
+        paas_client = Mock()
+        paas_client.update.side_effect = InvalidStatusCode(status_code=HTTPStatus.BAD_REQUEST, body={})
+        dispatcher = ScaleDispatcher(paas_client)
+        on_success = Mock()
+
+        dispatcher.submit(_get_mock_app("app-1"), 4, on_success)
+        dispatcher.dispatch()
+        dispatcher.dispatch()
+
+        assert paas_client.update.call_count == 1
+        on_success.assert_not_called()
+
+    def test_cancel_drops_held_update(self):
+        paas_client = Mock()
+        paas_client.update.side_effect = _deployment_in_flight()
+        dispatcher = ScaleDispatcher(paas_client)
+        app = _get_mock_app("app-1")
+
+        dispatcher.submit(app, 4)
+        dispatcher.dispatch()
+        dispatcher.cancel(app)
+        dispatcher.dispatch()
+
+        assert paas_client.update.call_count == 1
+
+    def test_prune_drops_updates_for_apps_no_longer_listed(self):
+        paas_client = Mock()
+        paas_client.update.side_effect = _deployment_in_flight()
+        dispatcher = ScaleDispatcher(paas_client)
+        deleted, kept = _get_mock_app("app-1"), _get_mock_app("app-2")
+
+        dispatcher.submit(deleted, 4)
+        dispatcher.submit(kept, 4)
+        dispatcher.dispatch()
+        dispatcher.prune({"app-2-guid"})
+
+        assert list(dispatcher.held) == ["app-2-guid"]
+        paas_client.update.reset_mock()
+        dispatcher.dispatch()
+        paas_client.update.assert_called_once_with("app-2-guid", 4)
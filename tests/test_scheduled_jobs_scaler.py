@@ -1,6 +1,10 @@
+import json
 import os
+from datetime import datetime, timezone
 from unittest.mock import Mock, patch
 
+from freezegun import freeze_time
+
 from app.scheduled_jobs_scaler import ScheduledJobsScaler
 
 app_name = "test-app"
@@ -40,3 +44,100 @@ class TestScheduledJobsScaler:
 
         # 10k items * 0.3 = 3k => 2 instances
         assert scheduled_job_scaler.get_desired_instance_count() == 2
+
+
+@freeze_time("2018-05-31 09:00:00")
+class TestScheduledJobsScalerHistogram:
+    def _get_scaler(self, **kwargs):
+        input_attrs = {"threshold": 600, "horizon_minutes": 15, "instance_startup_seconds": 120}
+        input_attrs.update(kwargs)
+        with patch.dict(os.environ, {"SQLALCHEMY_DATABASE_URI": "test-db-uri"}):
+            scaler = ScheduledJobsScaler(app_name, min_instances, 50, **input_attrs)
+        scaler.statsd_client = Mock()
+        scaler.cf_attributes = {}
+        return scaler
+
+    def _minute(self, minutes_from_now):
+        return int(datetime(2018, 5, 31, 9, tzinfo=timezone.utc).timestamp()) + minutes_from_now * 60
+
+    def test_query_groups_jobs_by_minute_within_the_horizon(self):
+        scaler = self._get_scaler()
+        assert "date_trunc('minute', scheduled_for)" in scaler.query
+        assert "interval '15 minutes'" in scaler.query
+        assert "GROUP BY 1" in scaler.query
+
+    def test_reads_every_row(self):
+        scaler = self._get_scaler()
+        cursor = Mock()
+        cursor.fetchall.return_value = [(self._minute(1), 100)]
+        assert scaler._read_result(cursor) == [(self._minute(1), 100)]
+
+    def test_scales_ahead_of_jobs_by_the_instance_startup_time(self):
+        scaler = self._get_scaler()
+        # 30k in two minutes, 60k in ten
+        scaler.run_query = Mock(return_value=[(self._minute(2), 30000), (self._minute(10), 60000)])
+
+        # 30k * 0.3 / 600 => 15
+        assert scaler.get_desired_instance_count() == 15
+        scaler.statsd_client.gauge.assert_called_once_with("test-app.scheduled-items", 30000)
+
+    def test_measured_startup_time_wins_over_the_configured_one(self):
+        scaler = self._get_scaler()
+        scaler.cf_attributes = {"instance_startup_seconds": 600}
+        scaler.run_query = Mock(return_value=[(self._minute(2), 30000), (self._minute(10), 60000)])
+
+        # both are due within the 10 minutes it takes to start an instance, 90k * 0.3 / 600 => 45
+        assert scaler.get_desired_instance_count() == 45
+
+    def test_adds_up_every_minute_due_within_the_startup_time(self):
+        scaler = self._get_scaler()
+        scaler.run_query = Mock(return_value=[(self._minute(1), 10000), (self._minute(2), 20000)])
+
+        assert scaler.get_desired_instance_count() == 15
+        scaler.statsd_client.gauge.assert_called_once_with("test-app.scheduled-items", 30000)
+
+    def test_ignores_overdue_jobs_older_than_the_release_time(self):
+        scaler = self._get_scaler(release_after_seconds=300)
+        # still scheduled long after it was due, it isn't being sent
+        scaler.run_query = Mock(return_value=[(self._minute(-10), 60000), (self._minute(1), 30000)])
+
+        assert scaler.get_desired_instance_count() == 15
+
+    def test_implausibly_short_measured_startup_time_is_ignored(self):
+        scaler = self._get_scaler()
+        # a quarter of the configured 120 seconds or less is a bad measurement, not a fast start
+        scaler.cf_attributes = {"instance_startup_seconds": 2}
+        scaler.run_query = Mock(return_value=[(self._minute(2), 30000), (self._minute(10), 60000)])
+
+        assert scaler.get_desired_instance_count() == 15
+
+    def test_keeps_instances_while_due_jobs_are_sent(self):
+        scaler = self._get_scaler(release_after_seconds=300)
+        scaler.run_query = Mock(return_value=[(self._minute(1), 30000)])
+        assert scaler.get_desired_instance_count() == 15
+
+        with freeze_time("2018-05-31 09:03:00"):
+            # the job has started so it is no longer scheduled
+            scaler.run_query.return_value = []
+            assert scaler.get_desired_instance_count() == 15
+
+        with freeze_time("2018-05-31 09:07:00"):
+            assert scaler.get_desired_instance_count() == min_instances
+
+    def test_forgets_cancelled_jobs(self):
+        scaler = self._get_scaler()
+        scaler.run_query = Mock(return_value=[(self._minute(1), 30000)])
+        scaler.get_desired_instance_count()
+
+        scaler.run_query.return_value = []
+        assert scaler.get_desired_instance_count() == min_instances
+
+    def test_state_round_trip(self):
+        scaler = self._get_scaler()
+        scaler.run_query = Mock(return_value=[(self._minute(0), 30000)])
+        scaler.get_desired_instance_count()
+
+        restored = self._get_scaler()
+        restored.set_state(json.loads(json.dumps(scaler.get_state())))
+        restored.run_query = Mock(return_value=[])
+        assert restored.get_desired_instance_count() == 15
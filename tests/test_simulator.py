@@ -0,0 +1,107 @@
+import random
+from unittest.mock import patch
+
+import fakeredis
+
+from app.autoscaler import Autoscaler
+from app.controllers import TargetTrackingController
+from app.simulator import simulate
+
+min_instances = 2
+max_instances = 30
+tasks_per_instance_per_tick = 1000
+backlog_per_instance = 600
+# instances take a minute to start taking work
+startup_ticks = 12
+
+
+@patch.object(Autoscaler, "_load_autoscaler_apps")
+@patch("app.autoscaler.Redis", fakeredis.FakeRedis)
+@patch("app.autoscaler.PaasClient")
+@patch("app.autoscaler.get_statsd_client")
+class TestControllerBenchmark:
+    """Compares the target tracking controller against the current threshold and cooldown policy"""
+
+    def _cooldown_policy(self):
+        autoscaler = Autoscaler()
+        # a server of its own, so a run doesn't start out in the cooldowns another test left behind
+        autoscaler.redis_client = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+        autoscaler.cooldown_seconds_after_scale_up = 300
+        autoscaler.cooldown_seconds_after_scale_down = 60
+        clock = {"now": 0}
+        autoscaler._now = lambda: clock["now"]
+
+        def policy(current, desired, now):
+            clock["now"] = now
+            new_instance_count = autoscaler.get_new_instance_count(current, desired, "test-app")
+            # the simulated cf takes every update straight away
+            autoscaler._record_scale("test-app", current, new_instance_count)
+            return new_instance_count
+
+        return policy
+
+    def _target_tracking_policy(self):
+        controller = TargetTrackingController("test-app", min_instances, max_instances)
+        return controller.update
+
+    def _simulate(self, policy, arrivals, initial_instances):
+        return simulate(
+            policy,
+            arrivals,
+            tasks_per_instance_per_tick,
+            backlog_per_instance,
+            min_instances,
+            max_instances,
+            initial_instances=initial_instances,
+            startup_ticks=startup_ticks,
+        )
+
+    def test_step_up(self, *args):
+        arrivals = [2000] * 20 + [12000] * 200
+
+        cooldown = self._simulate(self._cooldown_policy(), arrivals, 5)
+        target_tracking = self._simulate(self._target_tracking_policy(), arrivals, 5)
+
+        assert target_tracking.overshoot(12, start=20) < cooldown.overshoot(12, start=20)
+        # the cooldown policy is still working its way down from the overshoot when the simulation ends
+        assert target_tracking.convergence_tick(12, start=20) is not None
+        assert cooldown.convergence_tick(12, start=20) is None
+
+    def test_step_down(self, *args):
+        arrivals = [12000] * 60 + [3000] * 300
+
+        cooldown = self._simulate(self._cooldown_policy(), arrivals, 15)
+        target_tracking = self._simulate(self._target_tracking_policy(), arrivals, 15)
+
+        assert target_tracking.convergence_tick(3, start=60) < cooldown.convergence_tick(3, start=60)
+
+    def test_noisy_load_around_a_threshold(self, *args):
+        rng = random.Random(1)
+        arrivals = [int(rng.gauss(5000, 400)) for _ in range(400)]
+
+        cooldown = self._simulate(self._cooldown_policy(), arrivals, 5)
+        target_tracking = self._simulate(self._target_tracking_policy(), arrivals, 5)
+
+        # the cooldown policy chases every peak straight away, tracking the average needs fewer instances
+        assert max(target_tracking.instances[20:]) < max(cooldown.instances[20:])
+        assert sum(target_tracking.instances) < sum(cooldown.instances)
+
+
+class TestSimulationResult:
+    def _simulate(self, counts):
+        counts = iter(counts)
+        return simulate(lambda current, desired, now: next(counts), [0] * 6, 1000, 600, 1, 10)
+
+    def test_convergence_tick(self):
+        result = self._simulate([1, 5, 3, 4, 4, 4])
+
+        assert result.convergence_tick(4) == 3
+        assert result.convergence_tick(4, tolerance=1) == 1
+        assert result.convergence_tick(7) is None
+
+    def test_overshoot(self):
+        assert self._simulate([1, 6, 3, 4, 4, 4]).overshoot(4) == 2
+        assert self._simulate([1, 2, 3, 4, 4, 4]).overshoot(4) == 0
+
+    def test_direction_changes(self):
+        assert self._simulate([1, 5, 3, 3, 4, 4]).direction_changes() == 2
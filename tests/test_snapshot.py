@@ -0,0 +1,119 @@
+import json
+from unittest.mock import Mock, patch
+
+import fakeredis
+from freezegun import freeze_time
+
+from app.base_scalers import BaseScaler
+from app.schedule_scaler import ScheduleScaler
+from app.snapshot import REDIS_SNAPSHOT_KEY, StateSnapshotter
+from app.sqs_scaler import SqsScaler
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _get_app(name, scalers):
+    app = Mock()
+    app.name = name
+    app.key = name
+    app.scalers = scalers
+    return app
+
+
+@freeze_time("2018-05-31 06:00:00")
+@patch("app.base_scalers.boto3")
+class TestStateSnapshotter:
+    def setup_method(self, method):
+        self.redis_client = fakeredis.FakeRedis()
+        self.redis_client.flushall()
+        self.clock = FakeClock()
+
+    def _sqs_scaler(self):
+        return SqsScaler("test-app", 1, 10, threshold=250, queues=["queue1"], auto_calibrate=True)
+
+    def test_restores_what_was_saved(self, mock_boto3):
+        old_scaler = self._sqs_scaler()
+        old_scaler.last_good_instance_count = 7
+        old_scaler.last_good_at = old_scaler._now()
+        old_scaler.calibrator.samples.extend([400, 500, 600])
+        StateSnapshotter(self.redis_client, clock=self.clock).save([_get_app("test-app", [old_scaler])])
+
+        new_scaler = self._sqs_scaler()
+        restored = StateSnapshotter(self.redis_client, clock=self.clock).restore([_get_app("test-app", [new_scaler])])
+
+        assert restored == 1
+        assert new_scaler.last_good_instance_count == 7
+        assert new_scaler.last_good_at == old_scaler.last_good_at
+        assert new_scaler.calibrator.estimate == 500
+        # the calibrator doesn't go back to redis and double up its samples
+        assert new_scaler.calibrator.state_loaded is True
+
+    def test_state_is_matched_on_position_and_type(self, mock_boto3):
+        old_scaler = self._sqs_scaler()
+        old_scaler.last_good_instance_count = 7
+        StateSnapshotter(self.redis_client, clock=self.clock).save([_get_app("test-app", [old_scaler])])
+
+        # the config changed, another scaler now sits where the sqs scaler used to
+        schedule_scaler = ScheduleScaler("test-app", 1, 10, schedule={})
+        StateSnapshotter(self.redis_client, clock=self.clock).restore([_get_app("test-app", [schedule_scaler])])
+
+        assert schedule_scaler.last_good_instance_count is None
+
+    def test_ignores_old_snapshots(self, mock_boto3):
+        old_scaler = BaseScaler("test-app", 1, 10)
+        old_scaler.last_good_instance_count = 7
+        StateSnapshotter(self.redis_client, clock=self.clock).save([_get_app("test-app", [old_scaler])])
+
+        self.clock.now += 601
+        new_scaler = BaseScaler("test-app", 1, 10)
+        snapshotter = StateSnapshotter(self.redis_client, max_age_seconds=600, clock=self.clock)
+
+        assert snapshotter.restore([_get_app("test-app", [new_scaler])]) == 0
+        assert new_scaler.last_good_instance_count is None
+
+    def test_snapshot_is_versioned(self, mock_boto3):
+        StateSnapshotter(self.redis_client, clock=self.clock).save(
+            [_get_app("test-app", [BaseScaler("test-app", 1, 10)])]
+        )
+
+        assert REDIS_SNAPSHOT_KEY.endswith(":v1")
+        assert json.loads(self.redis_client.hget(REDIS_SNAPSHOT_KEY, "test-app"))["version"] == 1
+
+    def test_reports_size_and_load_time(self, mock_boto3):
+        snapshotter = StateSnapshotter(self.redis_client, clock=self.clock)
+        size = snapshotter.save([_get_app("test-app", [BaseScaler("test-app", 1, 10)])])
+        snapshotter.restore([_get_app("test-app", [BaseScaler("test-app", 1, 10)])])
+
+        assert size == len(self.redis_client.hget(REDIS_SNAPSHOT_KEY, "test-app"))
+        rendered = snapshotter.metrics.render()
+        assert "autoscaler_snapshot_size_bytes {}".format(size) in rendered
+        assert "autoscaler_snapshot_load_seconds" in rendered
+
+    def test_saves_every_interval(self, mock_boto3):
+        snapshotter = StateSnapshotter(self.redis_client, interval_seconds=30, clock=self.clock)
+        snapshotter.save = Mock(wraps=snapshotter.save)
+        apps = [_get_app("test-app", [BaseScaler("test-app", 1, 10)])]
+
+        snapshotter.maybe_save(apps)
+        self.clock.now += 29
+        snapshotter.maybe_save(apps)
+        self.clock.now += 1
+        snapshotter.maybe_save(apps)
+
+        assert snapshotter.save.call_count == 2
+
+    def test_redis_errors_are_not_fatal(self, mock_boto3):
+        redis_client = Mock()
+        redis_client.hset.side_effect = ConnectionError
+        redis_client.hgetall.side_effect = ConnectionError
+        snapshotter = StateSnapshotter(redis_client, clock=self.clock)
+        apps = [_get_app("test-app", [BaseScaler("test-app", 1, 10)])]
+
+        assert snapshotter.save(apps) == 0
+        assert snapshotter.restore(apps) == 0
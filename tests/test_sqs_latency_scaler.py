@@ -0,0 +1,94 @@
+from datetime import datetime
+from unittest.mock import Mock, call, patch
+
+from freezegun import freeze_time
+
+from app.sqs_latency_scaler import SqsLatencyScaler
+
+app_name = "test-app"
+min_instances = 1
+max_instances = 20
+
+
+@patch("app.base_scalers.boto3")
+class TestSqsLatencyScaler:
+    input_attrs = {"threshold": 100, "queues": ["queue1"], "max_message_age_seconds": 30}
+
+    def _get_scaler(self, mock_boto3, visible, in_flight, oldest_message_age):
+        client = mock_boto3.client.return_value
+        client.get_queue_attributes.return_value = {
+            "Attributes": {
+                "ApproximateNumberOfMessages": str(visible),
+                "ApproximateNumberOfMessagesNotVisible": str(in_flight),
+            }
+        }
+        client.get_metric_statistics.return_value = {
+            "Datapoints": [
+                {"Maximum": 600, "Timestamp": 111111110},
+                {"Maximum": oldest_message_age, "Timestamp": 111111111},
+            ]
+        }
+        scaler = SqsLatencyScaler(app_name, min_instances, max_instances, **self.input_attrs)
+        scaler.statsd_client = Mock()
+        return scaler
+
+    def test_init_assigns_relevant_values(self, mock_boto3):
+        scaler = SqsLatencyScaler(app_name, min_instances, max_instances, **self.input_attrs)
+
+        assert scaler.queues == ["queue1"]
+        assert scaler.queue_length_threshold == 100
+        assert scaler.max_message_age_seconds == 30
+
+    def test_sizes_for_visible_and_in_flight_messages_within_target_age(self, mock_boto3):
+        scaler = self._get_scaler(mock_boto3, visible=250, in_flight=150, oldest_message_age=10)
+
+        assert scaler.get_desired_instance_count() == 4
+
+    def test_scales_up_in_proportion_to_age_over_target(self, mock_boto3):
+        scaler = self._get_scaler(mock_boto3, visible=250, in_flight=150, oldest_message_age=75)
+
+        # 4 instances for the backlog, messages are 2.5 times older than allowed
+        assert scaler.get_desired_instance_count() == 10
+
+    def test_fetches_queue_attributes_in_one_call(self, mock_boto3):
+        scaler = self._get_scaler(mock_boto3, visible=1, in_flight=1, oldest_message_age=1)
+
+        scaler.get_desired_instance_count()
+
+        mock_boto3.client.return_value.get_queue_attributes.assert_called_once_with(
+            QueueUrl=scaler._get_sqs_queue_url("testqueue1"),
+            AttributeNames=["ApproximateNumberOfMessages", "ApproximateNumberOfMessagesNotVisible"],
+        )
+
+    def test_publishes_gauges(self, mock_boto3):
+        scaler = self._get_scaler(mock_boto3, visible=5, in_flight=3, oldest_message_age=12)
+
+        scaler.get_desired_instance_count()
+
+        scaler.statsd_client.gauge.assert_has_calls(
+            [
+                call("testqueue1.queue-length", 5),
+                call("testqueue1.in-flight", 3),
+                call("testqueue1.oldest-message-age", 12),
+            ]
+        )
+
+    @freeze_time("2018-03-15 15:10:00")
+    def test_get_age_of_oldest_message(self, mock_boto3):
+        cloudwatch_client = mock_boto3.client.return_value
+        cloudwatch_client.get_metric_statistics.return_value = {"Datapoints": []}
+        scaler = SqsLatencyScaler(app_name, min_instances, max_instances, **self.input_attrs)
+
+        assert scaler._get_age_of_oldest_message("my-queue") == 0
+        cloudwatch_client.get_metric_statistics.assert_called_once_with(
+            Namespace="AWS/SQS",
+            MetricName="ApproximateAgeOfOldestMessage",
+            Dimensions=[
+                {"Name": "QueueName", "Value": "my-queue"},
+            ],
+            StartTime=datetime(2018, 3, 15, 15, 5, 0),
+            EndTime=datetime(2018, 3, 15, 15, 10, 0),
+            Period=60,
+            Statistics=["Maximum"],
+            Unit="Seconds",
+        )
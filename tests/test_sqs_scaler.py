@@ -1,9 +1,14 @@
+import json
 from datetime import datetime
-from unittest.mock import Mock, call, patch
+from unittest.mock import ANY, Mock, call, patch
 
+import fakeredis
+import pytest
 from freezegun import freeze_time
 
-from app.sqs_scaler import SqsScaler
+from app.calibration import REDIS_CALIBRATION_KEY
+from app.polling import get_signal_cache
+from app.sqs_scaler import SqsScaler, get_queue_index, reset_queue_indexes
 
 app_name = "test-app"
 min_instances = 1
@@ -57,8 +62,8 @@ class TestSqsScaler:
         assert sqs_scaler.sqs_client == mock_client.return_value
         assert sqs_scaler.cloudwatch_client == mock_client.return_value
         calls = [
-            call("sqs", region_name="eu-west-1"),
-            call("cloudwatch", region_name="eu-west-1"),
+            call("sqs", config=ANY, region_name="eu-west-1"),
+            call("cloudwatch", config=ANY, region_name="eu-west-1"),
         ]
         for x in calls:
             assert x in mock_client.call_args_list
@@ -124,7 +129,7 @@ class TestSqsScaler:
         sqs_scaler = SqsScaler(app_name, min_instances, max_instances, **self.input_attrs)
 
         _get_sqs_throughput_mock = mocker.patch.object(
-            sqs_scaler, "_get_sqs_throughput_of_tasks_put_onto_queue", return_value=[100, 200, 50]
+            sqs_scaler, "_get_sqs_throughput_of_tasks_put_onto_queue", return_value=[(1, 100), (2, 200), (3, 50)]
         )
         statsd_mock = mocker.patch.object(sqs_scaler, "statsd_client")
 
@@ -133,6 +138,23 @@ class TestSqsScaler:
         statsd_mock.gauge.assert_called_once_with("testmy-queue.queue-throughput", 50)
         _get_sqs_throughput_mock.assert_called_once_with("testmy-queue")
 
+    @freeze_time("2018-03-15 15:10:00")
+    def test_get_throughput_of_tasks_put_onto_queue_uses_configured_statistic(self, mock_boto3, mocker):
+        sqs_scaler = SqsScaler(
+            app_name, min_instances, max_instances, statistic={"type": "ewma", "alpha": 0.5}, **self.input_attrs
+        )
+        mocker.patch.object(sqs_scaler, "statsd_client")
+        mocker.patch.object(
+            sqs_scaler,
+            "_get_sqs_throughput_of_tasks_put_onto_queue",
+            side_effect=lambda name: [(1, 100), (2, 300)] if name == "testqueue-a" else [(2, 1000)],
+        )
+
+        assert sqs_scaler._get_throughput_of_tasks_put_onto_queue("queue-a") == 200
+        # each queue has its own average
+        assert sqs_scaler._get_throughput_of_tasks_put_onto_queue("queue-b") == 1000
+        assert set(sqs_scaler.get_state()["statistics"]) == {"testqueue-a", "testqueue-b"}
+
     def test_get_throughput_of_tasks_put_onto_queue_returns_0_if_no_data(self, mock_boto3, mocker):
         sqs_scaler = SqsScaler(app_name, min_instances, max_instances, **self.input_attrs)
 
@@ -159,7 +181,13 @@ class TestSqsScaler:
 
         sqs_scaler = SqsScaler(app_name, min_instances, max_instances, **self.input_attrs)
 
-        assert sqs_scaler._get_sqs_throughput_of_tasks_put_onto_queue("my-queue") == [1500, 1600, 5500, 5300, 2100]
+        assert sqs_scaler._get_sqs_throughput_of_tasks_put_onto_queue("my-queue") == [
+            (111111110, 1500),
+            (111111111, 1600),
+            (111111112, 5500),
+            (111111113, 5300),
+            (111111114, 2100),
+        ]
 
         cloudwatch_client.get_metric_statistics.assert_called_once_with(
             Namespace="AWS/SQS",
@@ -227,3 +255,248 @@ class TestSqsScaler:
             Statistics=["Sum"],
             Unit="Count",
         )
+
+
+@patch("app.base_scalers.boto3")
+class TestSqsScalerCalibration:
+    input_attrs = {"threshold": 250, "queues": ["queue1", "queue2"], "auto_calibrate": True}
+
+    def _get_scaler(self, mock_boto3, queue_lengths, received, partial=None, **kwargs):
+        partial = partial or {}
+        client = mock_boto3.client.return_value
+        client.get_queue_attributes.side_effect = lambda QueueUrl, **_: {
+            "Attributes": {
+                "ApproximateNumberOfMessages": str(queue_lengths[QueueUrl.rsplit("/", 1)[1]]),
+                "ApproximateNumberOfMessagesNotVisible": "0",
+            }
+        }
+        client.get_metric_statistics.side_effect = lambda MetricName, Dimensions, **_: {
+            "Datapoints": [
+                {"Sum": received[Dimensions[0]["Value"]], "Timestamp": 111111050},
+                {"Sum": partial.get(Dimensions[0]["Value"], received[Dimensions[0]["Value"]]), "Timestamp": 111111110},
+            ]
+            if MetricName == "NumberOfMessagesReceived"
+            else []
+        }
+        sqs_scaler = SqsScaler(app_name, min_instances, 100, **dict(self.input_attrs, **kwargs))
+        sqs_scaler.statsd_client = Mock()
+        sqs_scaler.redis_client = fakeredis.FakeRedis()
+        sqs_scaler.refresh_cf_info({"instances": 4})
+        return sqs_scaler
+
+    def test_uses_configured_throughput_until_calibrated(self, mock_boto3):
+        sqs_scaler = self._get_scaler(
+            mock_boto3, {"testqueue1": 10, "testqueue2": 0}, {"testqueue1": 0, "testqueue2": 0}
+        )
+
+        sqs_scaler.get_desired_instance_count()
+
+        assert sqs_scaler._get_tasks_per_worker_per_minute() == 1000
+
+    def test_calibrates_from_received_throughput_per_instance(self, mock_boto3):
+        sqs_scaler = self._get_scaler(
+            mock_boto3, {"testqueue1": 1000, "testqueue2": 0}, {"testqueue1": 1500, "testqueue2": 500}
+        )
+
+        for minute in range(5):
+            with freeze_time(datetime(2018, 3, 15, 15, minute)):
+                sqs_scaler.get_desired_instance_count()
+
+        # 2000 tasks a minute across 4 instances, once the backlog has been over 250 a worker for 3 minutes
+        assert list(sqs_scaler.calibrator.samples) == [500, 500, 500]
+        assert sqs_scaler._get_tasks_per_worker_per_minute() == 500
+        sqs_scaler.statsd_client.gauge.assert_any_call("test-app.calibrated-tasks-per-worker-per-minute", 500)
+
+    def test_calibrates_on_ready_instances_only(self, mock_boto3):
+        sqs_scaler = self._get_scaler(
+            mock_boto3,
+            {"testqueue1": 500, "testqueue2": 0},
+            {"testqueue1": 1500, "testqueue2": 500},
+            calibration_minutes=1,
+        )
+        # 4 instances asked for, but 2 of them are still starting
+        sqs_scaler.refresh_cf_info({"instances": 4, "ready_instances": 2})
+
+        with freeze_time(datetime(2018, 3, 15, 15, 0)):
+            sqs_scaler.get_desired_instance_count()
+
+        assert list(sqs_scaler.calibrator.samples) == [1000]
+
+    def test_calibrates_from_the_last_complete_minute(self, mock_boto3):
+        sqs_scaler = self._get_scaler(
+            mock_boto3,
+            {"testqueue1": 1000, "testqueue2": 0},
+            {"testqueue1": 1500, "testqueue2": 500},
+            # a few seconds into the minute, cloudwatch only has some of what was received so far
+            partial={"testqueue1": 100, "testqueue2": 20},
+            calibration_minutes=1,
+        )
+
+        with freeze_time(datetime(2018, 3, 15, 15, 0, 10)):
+            sqs_scaler.get_desired_instance_count()
+
+        assert list(sqs_scaler.calibrator.samples) == [500]
+
+    def test_takes_one_sample_per_minute(self, mock_boto3):
+        sqs_scaler = self._get_scaler(
+            mock_boto3,
+            {"testqueue1": 1000, "testqueue2": 0},
+            {"testqueue1": 1500, "testqueue2": 500},
+            calibration_minutes=1,
+        )
+
+        with freeze_time("2018-03-15 15:00:05"):
+            sqs_scaler.get_desired_instance_count()
+        with freeze_time("2018-03-15 15:00:50"):
+            sqs_scaler.get_desired_instance_count()
+
+        assert len(sqs_scaler.calibrator.samples) == 1
+
+    def test_steady_traffic_does_not_ratchet_the_instance_count(self, mock_boto3):
+        # the workers keep up with 2000 tasks a minute, a handful are always waiting to be picked up
+        sqs_scaler = self._get_scaler(
+            mock_boto3, {"testqueue1": 10, "testqueue2": 0}, {"testqueue1": 1500, "testqueue2": 500}
+        )
+        client = mock_boto3.client.return_value
+        client.get_metric_statistics.side_effect = lambda MetricName, Dimensions, **_: {
+            "Datapoints": [{"Sum": {"testqueue1": 1500, "testqueue2": 500}[Dimensions[0]["Value"]], "Timestamp": 1}]
+        }
+
+        desired = []
+        for minute in range(15):
+            with freeze_time(datetime(2018, 3, 15, 15, minute)):
+                desired.append(sqs_scaler.get_desired_instance_count())
+            sqs_scaler.refresh_cf_info({"instances": desired[-1]})
+
+        assert len(sqs_scaler.calibrator.samples) == 0
+        assert set(desired) == {3}
+
+    def test_calibrates_while_the_backlog_grows(self, mock_boto3):
+        queue_lengths = {"testqueue1": 10, "testqueue2": 0}
+        sqs_scaler = self._get_scaler(mock_boto3, queue_lengths, {"testqueue1": 1500, "testqueue2": 500})
+
+        for minute in range(3):
+            queue_lengths["testqueue1"] = 10 + 100 * minute
+            get_signal_cache().clear()
+            with freeze_time(datetime(2018, 3, 15, 15, minute)):
+                sqs_scaler.get_desired_instance_count()
+
+        assert list(sqs_scaler.calibrator.samples) == [500]
+
+    def test_calibrated_throughput_is_kept_near_the_configured_one(self, mock_boto3):
+        sqs_scaler = self._get_scaler(
+            mock_boto3, {"testqueue1": 0, "testqueue2": 0}, {"testqueue1": 0, "testqueue2": 0}
+        )
+
+        sqs_scaler.calibrator.samples.extend([50, 50, 50])
+        assert sqs_scaler._get_tasks_per_worker_per_minute() == 500
+        sqs_scaler.calibrator.samples.extend([5000, 5000, 5000, 5000])
+        assert sqs_scaler._get_tasks_per_worker_per_minute() == 2000
+
+    def test_does_not_calibrate_while_workers_are_idle(self, mock_boto3):
+        sqs_scaler = self._get_scaler(
+            mock_boto3, {"testqueue1": 0, "testqueue2": 0}, {"testqueue1": 80, "testqueue2": 0}
+        )
+
+        sqs_scaler.get_desired_instance_count()
+
+        assert len(sqs_scaler.calibrator.samples) == 0
+
+    def test_calibration_is_restored_from_redis(self, mock_boto3):
+        sqs_scaler = self._get_scaler(
+            mock_boto3, {"testqueue1": 0, "testqueue2": 0}, {"testqueue1": 0, "testqueue2": 0}
+        )
+        sqs_scaler.redis_client.hset(REDIS_CALIBRATION_KEY, app_name, json.dumps({"samples": [600, 700, 800]}))
+
+        sqs_scaler.get_desired_instance_count()
+
+        assert sqs_scaler._get_tasks_per_worker_per_minute() == 700
+
+    def test_backlog_drain_target_sizes_for_backlog(self, mock_boto3):
+        sqs_scaler = self._get_scaler(
+            mock_boto3,
+            {"testqueue1": 3000, "testqueue2": 0},
+            {"testqueue1": 0, "testqueue2": 0},
+            backlog_drain_seconds=30,
+            auto_calibrate=False,
+        )
+
+        # each worker clears 500 tasks in 30 seconds
+        assert sqs_scaler._get_desired_instance_count_based_on_current_queue_length() == 6
+
+
+def _queue_urls(*names):
+    return ["https://sqs.eu-west-1.amazonaws.com/123456/{}".format(name) for name in names]
+
+
+@pytest.fixture
+def queue_indexes():
+    reset_queue_indexes()
+    yield
+    reset_queue_indexes()
+
+
+@pytest.mark.usefixtures("queue_indexes")
+@patch("app.base_scalers.boto3")
+class TestSqsQueueDiscovery:
+    def _get_scaler(self, mock_boto3, queues):
+        sqs_client = mock_boto3.client.return_value
+        sqs_client.get_caller_identity.return_value = {"Account": 123456}
+        sqs_client.list_queues.side_effect = [
+            {"QueueUrls": _queue_urls("testsend-sms-tasks", "testsend-email-tasks"), "NextToken": "page-2"},
+            {"QueueUrls": _queue_urls("testretry-tasks", "testsend-letter-jobs")},
+        ]
+        return SqsScaler(app_name, min_instances, max_instances, threshold=100, queues=queues)
+
+    def test_patterns_are_matched_against_every_page_of_queues(self, mock_boto3):
+        sqs_scaler = self._get_scaler(mock_boto3, ["send-*-tasks", "retry-tasks", "*-tasks"])
+
+        assert sqs_scaler._get_queues() == ["send-email-tasks", "send-sms-tasks", "retry-tasks"]
+        assert mock_boto3.client.return_value.list_queues.call_args_list == [
+            call(MaxResults=1000, QueueNamePrefix="test"),
+            call(MaxResults=1000, QueueNamePrefix="test", NextToken="page-2"),
+        ]
+
+    def test_queues_are_only_listed_by_the_index(self, mock_boto3):
+        sqs_scaler = self._get_scaler(mock_boto3, ["send-*-tasks"])
+        another_scaler = SqsScaler("another-app", min_instances, max_instances, threshold=100, queues=["retry-*"])
+
+        sqs_scaler._get_queues()
+        sqs_scaler._get_queues()
+        assert another_scaler._get_queues() == ["retry-tasks"]
+
+        assert mock_boto3.client.return_value.list_queues.call_count == 2
+
+    def test_queues_created_later_are_picked_up_on_refresh(self, mock_boto3):
+        sqs_scaler = self._get_scaler(mock_boto3, ["send-*-tasks"])
+        sqs_scaler._get_queues()
+        index = get_queue_index("eu-west-1", Mock())
+
+        mock_boto3.client.return_value.list_queues.side_effect = [
+            {"QueueUrls": _queue_urls("testsend-sms-tasks", "testsend-email-tasks", "testsend-push-tasks")}
+        ]
+        index.refresh()
+
+        assert sqs_scaler._get_queues() == ["send-email-tasks", "send-push-tasks", "send-sms-tasks"]
+
+    def test_discovered_queues_are_read_like_configured_ones(self, mock_boto3):
+        sqs_scaler = self._get_scaler(mock_boto3, ["send-*-tasks"])
+        sqs_client = mock_boto3.client.return_value
+        sqs_client.get_queue_attributes.side_effect = [
+            {"Attributes": {"ApproximateNumberOfMessages": "150"}},
+            {"Attributes": {"ApproximateNumberOfMessages": "100"}},
+        ]
+
+        assert sqs_scaler._get_desired_instance_count_based_on_current_queue_length() == 3
+        assert [kwargs["QueueUrl"] for _, kwargs in sqs_client.get_queue_attributes.call_args_list] == [
+            "https://sqs.eu-west-1.amazonaws.com/123456/testsend-email-tasks",
+            "https://sqs.eu-west-1.amazonaws.com/123456/testsend-sms-tasks",
+        ]
+
+    def test_holds_until_queues_have_been_listed(self, mock_boto3):
+        sqs_scaler = SqsScaler(app_name, min_instances, max_instances, threshold=100, queues=["send-*-tasks"])
+        mock_boto3.client.return_value.list_queues.side_effect = Exception("AccessDenied")
+        sqs_scaler.refresh_cf_info({"instances": 2})
+
+        assert sqs_scaler.get_desired_instance_count() == 2
+        assert sqs_scaler.stale
@@ -0,0 +1,67 @@
+import pytest
+
+from app.exceptions import CannotLoadConfig
+from app.tick_interval import AdaptiveTickInterval, build_tick_interval
+
+
+class TestAdaptiveTickInterval:
+    def setup_method(self):
+        self.interval = AdaptiveTickInterval(5, 1, 30, stable_ticks=2, growth_factor=2, rise_threshold=0.1)
+        self.now = 0
+
+    def _tick(self, inputs, desired=None, scaled=False):
+        self.now += self.interval.interval_seconds
+        return self.interval.next_interval(inputs, desired or {"app": 1}, scaled, self.now)
+
+    def test_grows_while_nothing_changes(self):
+        assert self._tick({"queue": 0}) == 5
+        assert self._tick({"queue": 0}) == 5
+        assert self._tick({"queue": 1}) == 10
+        assert self._tick({"queue": 0}) == 20
+        assert self._tick({"queue": 0}) == 30
+        assert self._tick({"queue": 0}) == 30
+
+    def test_drops_to_the_minimum_when_an_input_rises_fast(self):
+        for _ in range(4):
+            self._tick({"queue": 10})
+        assert self.interval.interval_seconds == 20
+
+        # 10 -> 50 over 20 seconds is 20% a second
+        assert self._tick({"queue": 50}) == 1
+        assert self.interval.stable_for == 0
+
+    def test_slow_rises_go_back_to_the_base_interval(self):
+        for _ in range(4):
+            self._tick({"queue": 100})
+
+        # 100 -> 120 over 20 seconds is 1% a second
+        assert self._tick({"queue": 120}) == 5
+
+    def test_falling_inputs_and_changed_decisions_are_not_stable(self):
+        for _ in range(4):
+            self._tick({"queue": 100})
+
+        assert self._tick({"queue": 10}) == 5
+        assert self._tick({"queue": 10}, desired={"app": 2}) == 5
+
+    def test_drops_to_the_minimum_when_an_app_is_scaled(self):
+        for _ in range(4):
+            self._tick({})
+
+        assert self._tick({}, scaled=True) == 1
+
+    def test_not_configured(self):
+        assert build_tick_interval(5, None) is None
+
+    @pytest.mark.parametrize(
+        "settings",
+        [
+            {"MIN_SECONDS": 10, "MAX_SECONDS": 30},
+            {"MIN_SECONDS": 1, "MAX_SECONDS": 2},
+            {"MIN_SECONDS": 0, "MAX_SECONDS": 30},
+            {"MIN_SECONDS": 1, "MAX_SECONDS": 30, "GROWTH_FACTOR": 1},
+        ],
+    )
+    def test_rejects_bad_bounds(self, settings):
+        with pytest.raises(CannotLoadConfig):
+            build_tick_interval(5, settings)
@@ -0,0 +1,142 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.exceptions import CannotLoadApp
+from app.window_statistics import (
+    EwmaStatistic,
+    MaxStatistic,
+    PercentileStatistic,
+    TrimmedMaxStatistic,
+    build_statistic,
+)
+
+now = datetime(2018, 5, 31, 6, 0, 0)
+
+
+def _window(values, start=now):
+    return [(start + timedelta(minutes=minute), value) for minute, value in enumerate(values)]
+
+
+class TestBuildStatistic:
+    def test_defaults_to_max(self):
+        assert isinstance(build_statistic(None), MaxStatistic)
+
+    def test_from_name(self):
+        assert isinstance(build_statistic("trimmed_max"), TrimmedMaxStatistic)
+
+    def test_from_dict_with_parameters(self):
+        statistic = build_statistic({"type": "percentile", "percentile": 75}, window=10)
+
+        assert isinstance(statistic, PercentileStatistic)
+        assert statistic.percentile == 75
+        assert len(statistic.buffer) == 10
+
+    def test_unknown_statistic(self):
+        with pytest.raises(CannotLoadApp):
+            build_statistic({"type": "median"})
+
+    def test_unknown_parameter(self):
+        with pytest.raises(CannotLoadApp, match="ewma"):
+            build_statistic({"type": "ewma", "beta": 0.5})
+
+
+class TestMaxStatistic:
+    def test_max_of_window(self):
+        assert MaxStatistic().summarise(_window([1, 5, 3])) == 5
+
+    def test_empty_window(self):
+        assert MaxStatistic().summarise([]) == 0
+
+
+class TestTrimmedMaxStatistic:
+    def test_ignores_a_single_spike(self):
+        assert TrimmedMaxStatistic().summarise(_window([100, 110, 900, 105, 100])) == 110
+
+    def test_short_window(self):
+        assert TrimmedMaxStatistic(trim=2).summarise(_window([100, 900])) == 900
+
+
+class TestEwmaStatistic:
+    def test_seeds_from_the_window(self):
+        statistic = EwmaStatistic(alpha=0.5)
+
+        # 100, then 0.5 * 200 + 0.5 * 100
+        assert statistic.summarise(_window([100, 200])) == 150
+
+    def test_takes_each_datapoint_once(self):
+        statistic = EwmaStatistic(alpha=0.5)
+        statistic.summarise(_window([100]))
+
+        # the window is fetched every tick, the same datapoints are not added again
+        assert statistic.summarise(_window([100, 300])) == 200
+        assert statistic.summarise(_window([100, 300])) == 200
+        assert statistic.average == 100
+
+    def test_lagging_datapoints_are_not_counted_twice(self):
+        statistic = EwmaStatistic(alpha=0.5)
+        statistic.summarise(_window([100, 300, 500]))
+
+        # a minute later CloudWatch hasn't published anything new
+        assert statistic.summarise(_window([100, 300, 500])) == statistic.summarise(_window([100, 300, 500]))
+        assert statistic.average == 200
+
+    def test_minute_in_progress_is_corrected(self):
+        statistic = EwmaStatistic(alpha=0.5)
+        statistic.summarise(_window([100, 100]))
+
+        # the newest minute keeps growing until it is over, only its final value is taken
+        assert statistic.summarise(_window([100, 300])) == 200
+        assert statistic.summarise(_window([100, 500, 100])) == 200
+        assert statistic.average == 300
+
+    def test_empty_window_adds_nothing(self):
+        statistic = EwmaStatistic(alpha=0.5)
+        statistic.summarise(_window([100, 100]))
+
+        assert statistic.summarise([]) == 100
+        assert statistic.average == 100
+
+    def test_state_round_trip(self):
+        statistic = EwmaStatistic(alpha=0.5)
+        statistic.summarise(_window([100, 200]))
+
+        restored = EwmaStatistic(alpha=0.5)
+        restored.set_state(statistic.get_state())
+
+        # only the newest datapoint is new to the restored average
+        assert restored.summarise(_window([500, 300])) == 200
+
+
+class TestPercentileStatistic:
+    def test_percentile_of_the_window(self):
+        statistic = PercentileStatistic(percentile=90, window=10)
+
+        assert statistic.summarise(_window(range(1, 11))) == 9
+
+    def test_older_datapoints_leave_the_window(self):
+        statistic = PercentileStatistic(percentile=100, window=3)
+        statistic.summarise(_window([900, 1, 1]))
+
+        assert statistic.summarise(_window([900, 1, 1, 2, 3])) == 3
+        assert list(statistic.ordered) == [1, 1, 2]
+
+    def test_memory_stays_fixed(self):
+        statistic = PercentileStatistic(percentile=50, window=3)
+        statistic.summarise(_window([1, 2, 3]))
+        for minute in range(1, 5):
+            value = statistic.summarise(_window([100, 100, 100], start=now + timedelta(minutes=minute)))
+
+        assert len(statistic.buffer) == 3
+        assert len(statistic.ordered) == 3
+        assert statistic.get_state() == {"values": [100, 100, 100]}
+        assert value == 100
+
+    def test_state_round_trip(self):
+        statistic = PercentileStatistic(window=5)
+        statistic.summarise(_window([1, 2, 3, 4, 5, 6, 7, 8]))
+
+        restored = PercentileStatistic(window=5)
+        restored.set_state(statistic.get_state())
+
+        assert restored.get_state() == {"values": [3, 4, 5, 6, 7]}